@@ -0,0 +1,150 @@
+import os
+import json
+import asyncio
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+try:
+    from backend.services import tracing
+    from backend.services.documents import build_attachment_context, extract, extractable, select_chunks
+    from backend.services.rerank import tokenize
+except Exception:
+    from services import tracing
+    from services.documents import build_attachment_context, extract, extractable, select_chunks
+    from services.rerank import tokenize
+
+from .metrics import metrics
+
+
+# extracted documents kept in memory (chunks plus their tokens), keyed by content hash
+ATTACHMENT_CACHE_MAX_ENTRIES = int(os.getenv("ATTACHMENT_CACHE_MAX_ENTRIES", "128"))
+ATTACHMENT_EXTRACT_TIMEOUT_SECONDS = float(os.getenv("ATTACHMENT_EXTRACT_TIMEOUT_SECONDS", "30"))
+
+
+class ExtractionCache:
+    """Process-local LRU of extracted documents by sha256 of the file bytes.
+
+    Entries hold the chunks and their BM25 tokens, so a document referenced again (by later messages
+    or re-uploaded unchanged) is neither downloaded, parsed nor tokenized a second time.
+    """
+
+    def __init__(self, max_entries: int = ATTACHMENT_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._data: "OrderedDict[str, Dict]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, sha: str) -> Optional[Dict]:
+        with self._lock:
+            doc = self._data.get(sha)
+            if doc is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(sha)
+            self.hits += 1
+            return doc
+
+    def put(self, sha: str, extracted: Dict) -> Dict:
+        doc = {**extracted, "tokens": [tokenize(c["text"]) for c in extracted["chunks"]]}
+        with self._lock:
+            self._data[sha] = doc
+            self._data.move_to_end(sha)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+        return doc
+
+    def stats(self) -> Dict:
+        with self._lock:
+            entries = len(self._data)
+        return {"entries": entries, "hits": self.hits, "misses": self.misses}
+
+
+extraction_cache = ExtractionCache()
+
+
+def _text_path(storage_path: str) -> str:
+    return storage_path.rsplit("/", 1)[0] + "/extracted.json"
+
+
+async def extract_attachment(storage_path: str, content_type: str, data: bytes) -> Optional[Dict]:
+    """Extract a PDF/text attachment and store its chunks next to the original file.
+
+    Returns the "extraction" summary to record on the attachment document, or None for types that
+    carry no text (images). Identical bytes seen before in this worker are not parsed again.
+    """
+    if not extractable(content_type):
+        return None
+    from .main import get_storage
+    sha = hashlib.sha256(data).hexdigest()
+    with tracing.span("attachments.extract", content_type=content_type, size=len(data)):
+        cached = extraction_cache.get(sha)
+        if cached is not None:
+            result = {**cached, "error": None}
+        else:
+            try:
+                result = await asyncio.wait_for(extract(data, content_type), ATTACHMENT_EXTRACT_TIMEOUT_SECONDS)
+            except asyncio.TimeoutError:
+                result = {"chunks": [], "pages": 0, "chars": 0, "truncated": False, "error": "extraction timed out"}
+        metrics.inc("attachment_extractions", outcome="cached" if cached is not None else ("error" if result["error"] else "ok"))
+        summary = {"status": "failed" if result["error"] else "done", "sha256": sha, "pages": result["pages"], "chars": result["chars"], "chunks": len(result["chunks"]), "truncated": result["truncated"]}
+        if result["error"]:
+            summary["error"] = result["error"]
+            return summary
+        stored = {k: result[k] for k in ("chunks", "pages", "chars", "truncated")}
+        if cached is None:
+            extraction_cache.put(sha, stored)
+        path = _text_path(storage_path)
+        payload = json.dumps(stored).encode("utf-8")
+        await asyncio.to_thread(get_storage().put, path, payload, "application/json")
+        summary["textPath"] = path
+        return summary
+
+
+async def _load(uid: str, aid: str, meta: Dict) -> Optional[Dict]:
+    """Chunks and tokens for one attachment: from memory, else the stored extraction, else extracted now."""
+    from .main import get_fs, get_storage
+    extraction = meta.get("extraction")
+    if extraction is None and meta.get("storagePath") and extractable(meta.get("contentType")):
+        # uploaded before extraction existed: extract once and record it on the attachment
+        data = await asyncio.to_thread(get_storage().get, meta["storagePath"])
+        extraction = await extract_attachment(meta["storagePath"], meta.get("contentType"), data)
+        ref = get_fs().collection("users").document(uid).collection("attachments").document(aid)
+        await asyncio.to_thread(ref.update, {"extraction": extraction})
+    if not extraction or extraction.get("status") != "done":
+        return None
+    doc = extraction_cache.get(extraction["sha256"])
+    if doc is None:
+        raw = await asyncio.to_thread(get_storage().get, extraction["textPath"])
+        doc = extraction_cache.put(extraction["sha256"], json.loads(raw))
+    return doc
+
+
+async def build_context(uid: str, attachments: List[Dict], prompt: str) -> Optional[str]:
+    """System context holding the attached documents' most relevant chunks for `prompt`, or None.
+
+    `attachments` are the user's attachment documents as [{"id", **metadata}]; ones without text
+    (images, failed extractions) are skipped, and a document that cannot be loaded is logged and
+    left out rather than failing the message.
+    """
+    with tracing.span("attachments.context", attachments=len(attachments)) as span:
+        loaded = await asyncio.gather(*[_load(uid, a["id"], a) for a in attachments], return_exceptions=True)
+        docs = []
+        for meta, doc in zip(attachments, loaded):
+            if isinstance(doc, Exception):
+                logging.warning(f"Attachment {meta['id']} could not be loaded for context: {doc}")
+            elif doc is not None:
+                docs.append({"name": meta.get("filename") or meta["id"], **doc})
+        if not docs:
+            return None
+        selected = select_chunks(prompt, docs)
+        span.set_attribute("chunks", len(selected))
+        metrics.observe("attachment_context_chars", sum(len(c["text"]) for c in selected))
+        return build_attachment_context(selected) if selected else None
+
+
+def attachment_stats() -> Dict:
+    return extraction_cache.stats()
@@ -2,16 +2,34 @@ import os
 import asyncio
 import time
 import uuid
+import logging
 from typing import AsyncGenerator
 
-import google.generativeai as genai
+try:
+    from backend.services.resilience import get_dependency
+except Exception:
+    from services.resilience import get_dependency
 
-# Configure Gemini API only if key is available
-gemini_api_key = os.getenv("GEMINI_API_KEY")
-if gemini_api_key:
-    genai.configure(api_key=gemini_api_key)
-else:
-    print("Warning: GEMINI_API_KEY not set. Gemini functionality will be disabled.")
+_genai = None
+
+
+def _get_genai():
+    """Import and configure the Gemini SDK on first use.
+
+    google.generativeai pulls in gRPC and protobuf stubs, which is a large share of worker import
+    time, so it is only loaded once a generation is actually requested.
+    """
+    global _genai
+    if _genai is None:
+        import google.generativeai as genai
+        # Configure Gemini API only if key is available
+        gemini_api_key = os.getenv("GEMINI_API_KEY")
+        if gemini_api_key:
+            genai.configure(api_key=gemini_api_key)
+        else:
+            logging.warning("GEMINI_API_KEY not set - Gemini functionality will be disabled")
+        _genai = genai
+    return _genai
 
 
 async def _gemini_token_stream(prompt: str, model: str, system_context: str | None = None) -> AsyncGenerator[str, None]:
@@ -27,21 +45,24 @@ async def _gemini_token_stream(prompt: str, model: str, system_context: str | No
         if system_context:
             messages.append({"role": "system", "content": system_context})
         messages.append({"role": "user", "content": prompt})
-        response = genai.chat.completions.stream(model=model, messages=messages)
-        async for event in response:
-            # event may contain delta text
-            delta = getattr(event, "delta", None) or event
-            text = ""
-            # try to extract text from common shapes
-            if isinstance(delta, dict):
-                text = delta.get("content", "") or delta.get("text", "")
-            else:
-                try:
-                    text = str(delta)
-                except Exception:
-                    text = ""
-            if text:
-                yield text
+        genai = _get_genai()
+        # a slot is held for the whole stream: the bulkhead bounds concurrent Gemini streams per worker
+        async with get_dependency("gemini").slot():
+            response = genai.chat.completions.stream(model=model, messages=messages)
+            async for event in response:
+                # event may contain delta text
+                delta = getattr(event, "delta", None) or event
+                text = ""
+                # try to extract text from common shapes
+                if isinstance(delta, dict):
+                    text = delta.get("content", "") or delta.get("text", "")
+                else:
+                    try:
+                        text = str(delta)
+                    except Exception:
+                        text = ""
+                if text:
+                    yield text
     except Exception as e:
         raise
 
@@ -0,0 +1,285 @@
+import os
+import json
+import time
+import argparse
+import tempfile
+from datetime import datetime, timezone
+from typing import Callable, Dict, Iterator, List, Optional
+
+from .logs import log_event
+
+
+CLEANUP_PAGE_SIZE = int(os.getenv("CLEANUP_PAGE_SIZE", "300"))
+# Firestore batches are capped at 500 writes
+CLEANUP_BATCH_SIZE = min(500, int(os.getenv("CLEANUP_BATCH_SIZE", "400")))
+CLEANUP_MAX_WRITES_PER_SECOND = float(os.getenv("CLEANUP_MAX_WRITES_PER_SECOND", "500"))
+
+# Assistant messages left in these states past the aborted TTL never completed
+STUCK_STATUSES = ["streaming", "generating", "queued"]
+
+
+def _server_timestamp():
+    from firebase_admin import firestore
+    return firestore.SERVER_TIMESTAMP
+
+
+class _RateLimitedWriter:
+    """Accumulates deletes/updates into Firestore batches and commits them at a bounded write rate."""
+
+    def __init__(self, fs, batch_size: int, max_writes_per_second: float, dry_run: bool, on_commit: Callable[[], None]):
+        self.fs = fs
+        self.batch_size = batch_size
+        self.min_interval = (batch_size / max_writes_per_second) if max_writes_per_second > 0 else 0
+        self.dry_run = dry_run
+        self.on_commit = on_commit
+        self._batch = None
+        self._pending = 0
+        self._last_commit = 0.0
+        self.committed = 0
+
+    def delete(self, ref):
+        self._add(lambda b: b.delete(ref))
+
+    def update(self, ref, data: dict):
+        self._add(lambda b: b.update(ref, data))
+
+    def _add(self, op):
+        if self._batch is None:
+            self._batch = self.fs.batch()
+        op(self._batch)
+        self._pending += 1
+        if self._pending >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self._pending:
+            return
+        wait = self.min_interval - (time.time() - self._last_commit)
+        if wait > 0:
+            time.sleep(wait)
+        if not self.dry_run:
+            self._batch.commit()
+        self._last_commit = time.time()
+        self.committed += self._pending
+        self._batch = None
+        self._pending = 0
+        self.on_commit()
+
+
+class CleanupEngine:
+    """Retention cleanup for requests, stuck messages, video jobs, attachments and generated images.
+
+    Each task pages through an indexed range query on `createdAt` (ascending, resuming from a
+    createdAt cursor) and applies bulk writes through rate-limited batches. With a uid the engine is
+    scoped to users/{uid}/... (messages, which sit under each chat, through a collection-group query
+    on their `uid` field); without one it uses collection-group queries across all users, which
+    need single-field collection-group index exemptions on `createdAt` (and composite indexes on
+    status+createdAt and type+createdAt for `messages`). Progress is checkpointed per task so an
+    interrupted CLI run resumes where it stopped.
+    """
+
+    def __init__(self, fs, storage, *, uid: Optional[str] = None, request_ttl_seconds: int, aborted_ttl_seconds: int,
+                 media_retention_days: int, dry_run: bool = False, page_size: int = CLEANUP_PAGE_SIZE,
+                 batch_size: int = CLEANUP_BATCH_SIZE, max_writes_per_second: float = CLEANUP_MAX_WRITES_PER_SECOND,
+                 checkpoint_path: Optional[str] = None, now: Optional[float] = None):
+        self.fs = fs
+        self.storage = storage
+        self.uid = uid
+        self.now = now or time.time()
+        self.request_ttl_seconds = request_ttl_seconds
+        self.aborted_ttl_seconds = aborted_ttl_seconds
+        self.media_retention_seconds = media_retention_days * 86400
+        self.dry_run = dry_run
+        self.page_size = page_size
+        self.checkpoint_path = checkpoint_path
+        self._checkpoint = self._load_checkpoint()
+        self._task = None
+        self.writer = _RateLimitedWriter(fs, batch_size, max_writes_per_second, dry_run, self._save_checkpoint)
+        self.stats: Dict[str, Dict[str, int]] = {}
+
+    # -- checkpointing -------------------------------------------------------------------------
+
+    def _load_checkpoint(self) -> dict:
+        if not self.checkpoint_path or not os.path.exists(self.checkpoint_path):
+            return {}
+        try:
+            with open(self.checkpoint_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_checkpoint(self):
+        if not self.checkpoint_path:
+            return
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.checkpoint_path)), prefix=".cleanup-")
+        with os.fdopen(fd, "w") as f:
+            json.dump(self._checkpoint, f)
+        os.replace(tmp, self.checkpoint_path)
+
+    def _mark(self, snap):
+        created = (snap.to_dict() or {}).get("createdAt")
+        state = self._checkpoint.setdefault(self._task, {})
+        state["cursor"] = created.timestamp() if hasattr(created, "timestamp") else created
+        state["cursor_path"] = snap.reference.path
+
+    # -- queries -------------------------------------------------------------------------------
+
+    def _scope(self, collection: str):
+        if self.uid and collection == "messages":
+            # messages live under users/{uid}/chats/{chat_id}/messages and carry their owner's uid
+            return self.fs.collection_group(collection).where("uid", "==", self.uid)
+        if self.uid:
+            return self.fs.collection("users").document(self.uid).collection(collection)
+        return self.fs.collection_group(collection)
+
+    def _older_than(self, collection: str, cutoff: float, filters: List[tuple] = ()) -> Iterator:
+        """Yield snapshots with createdAt < cutoff, oldest first, one page at a time.
+
+        Pages are ordered by (createdAt, document path) and resume after both, so documents sharing a
+        timestamp across a page boundary are neither skipped nor repeated.
+        """
+        cutoff_dt = datetime.fromtimestamp(cutoff, tz=timezone.utc)
+        state = self._checkpoint.get(self._task) or {}
+        cursor, cursor_path = state.get("cursor"), state.get("cursor_path")
+        while True:
+            q = self._scope(collection)
+            for f in filters:
+                q = q.where(*f)
+            q = q.where("createdAt", "<", cutoff_dt).order_by("createdAt").order_by("__name__").limit(self.page_size)
+            if cursor is not None and cursor_path:
+                created = datetime.fromtimestamp(cursor, tz=timezone.utc) if isinstance(cursor, (int, float)) else cursor
+                q = q.start_after({"createdAt": created, "__name__": self.fs.document(cursor_path)})
+            page = list(q.stream())
+            for snap in page:
+                yield snap
+            if len(page) < self.page_size:
+                return
+            cursor, cursor_path = page[-1].to_dict().get("createdAt"), page[-1].reference.path
+
+    def _count(self, key: str, n: int = 1):
+        self.stats.setdefault(self._task, {}).setdefault(key, 0)
+        self.stats[self._task][key] += n
+
+    def _delete_blob(self, path: Optional[str]):
+        if not path or path.startswith("/"):
+            return
+        if not self.dry_run:
+            try:
+                self.storage.delete(path)
+            except Exception:
+                return
+        self._count("blobs_deleted")
+
+    # -- tasks ---------------------------------------------------------------------------------
+
+    def cleanup_requests(self):
+        for snap in self._older_than("requests", self.now - self.request_ttl_seconds):
+            self.writer.delete(snap.reference)
+            self._count("deleted")
+            self._mark(snap)
+
+    def _owner(self, snap) -> Optional[str]:
+        # users/{uid}/chats/{chat_id}/messages/{message_id}
+        parts = snap.reference.path.split("/")
+        return self.uid or (parts[1] if len(parts) > 1 and parts[0] == "users" else None)
+
+    def cleanup_stuck_messages(self):
+        for snap in self._older_than("messages", self.now - self.aborted_ttl_seconds, [("status", "in", STUCK_STATUSES)]):
+            self.writer.update(snap.reference, {"status": "error", "error": "aborted", "updatedAt": _server_timestamp()})
+            self._count("marked_error")
+            # a stuck stream still holding the user's active-request lock would keep rejecting their chats
+            uid = self._owner(snap)
+            if uid:
+                meta_ref = self.fs.collection("users").document(uid).collection("meta").document("state")
+                meta = meta_ref.get()
+                if meta.exists and (meta.to_dict() or {}).get("active_assistant_msg_id") == snap.id:
+                    self.writer.update(meta_ref, {"active_request_id": None, "active_assistant_msg_id": None})
+                    self._count("unlocked")
+            self._mark(snap)
+
+    def cleanup_video_jobs(self):
+        for snap in self._older_than("video_jobs", self.now - self.media_retention_seconds):
+            self.writer.delete(snap.reference)
+            self._count("deleted")
+            self._mark(snap)
+
+    def cleanup_attachments(self):
+        for snap in self._older_than("attachments", self.now - self.media_retention_seconds):
+            self._delete_blob(snap.to_dict().get("storagePath"))
+            self._delete_blob((snap.to_dict().get("extraction") or {}).get("textPath"))
+            self.writer.delete(snap.reference)
+            self._count("deleted")
+            self._mark(snap)
+
+    def cleanup_images(self):
+        # image messages are created with mediaExpired: false, so expired ones drop out of the query
+        filters = [("type", "==", "image"), ("mediaExpired", "==", False)]
+        for snap in self._older_than("messages", self.now - self.media_retention_seconds, filters):
+            data = snap.to_dict()
+            if not data.get("images"):
+                continue
+            for img in data.get("images") or []:
+                self._delete_blob(img.get("storagePath"))
+                for v in img.get("variants") or []:
+                    self._delete_blob(v.get("storagePath"))
+            self.writer.update(snap.reference, {"images": [], "mediaExpired": True, "updatedAt": _server_timestamp()})
+            self._count("expired")
+            self._mark(snap)
+
+    def cleanup_image_flags(self):
+        """One-off: add mediaExpired: false to image messages written before the field existed."""
+        for snap in self._older_than("messages", self.now, [("type", "==", "image")]):
+            if "mediaExpired" not in (snap.to_dict() or {}):
+                self.writer.update(snap.reference, {"mediaExpired": False})
+                self._count("flagged")
+            self._mark(snap)
+
+    TASKS = ("requests", "stuck_messages", "video_jobs", "attachments", "images")
+
+    def run(self, tasks=TASKS) -> Dict[str, Dict[str, int]]:
+        started = time.time()
+        for name in tasks:
+            if (self._checkpoint.get(name) or {}).get("done"):
+                continue
+            self._task = name
+            task_start = time.time()
+            getattr(self, f"cleanup_{name}")()
+            self.writer.flush()
+            self._checkpoint.setdefault(name, {})["done"] = True
+            self._save_checkpoint()
+            log_event("cleanup_task", task=name, uid=self.uid, dry_run=self.dry_run, stats=self.stats.get(name, {}), seconds=round(time.time() - task_start, 2))
+        log_event("cleanup_done", uid=self.uid, writes=self.writer.committed, seconds=round(time.time() - started, 2))
+        return self.stats
+
+
+def main(argv=None):
+    """Run retention cleanup from the command line: python -m app.cleanup [--uid UID] [--checkpoint FILE]."""
+    parser = argparse.ArgumentParser(description="Purge expired requests, stuck messages, video jobs and media.")
+    parser.add_argument("--uid", help="limit cleanup to one user (default: all users)")
+    parser.add_argument("--tasks", default=",".join(CleanupEngine.TASKS),
+                        help="comma-separated subset of tasks; image_flags is a one-off backfill for image messages older than the mediaExpired field")
+    parser.add_argument("--checkpoint", help="JSON file used to resume an interrupted run")
+    parser.add_argument("--dry-run", action="store_true", help="report what would be removed without writing")
+    parser.add_argument("--max-writes-per-second", type=float, default=CLEANUP_MAX_WRITES_PER_SECOND)
+    args = parser.parse_args(argv)
+
+    # importing the app configures the JSON logging pipeline
+    from .logs import stop_logging
+    from .main import REQUEST_TTL_SECONDS, ABORTED_TTL_SECONDS, MEDIA_RETENTION_DAYS, init_firebase, get_fs, get_storage
+    if not init_firebase():
+        raise SystemExit("Firebase is not configured")
+    engine = CleanupEngine(
+        get_fs(), get_storage(), uid=args.uid,
+        request_ttl_seconds=REQUEST_TTL_SECONDS, aborted_ttl_seconds=ABORTED_TTL_SECONDS, media_retention_days=MEDIA_RETENTION_DAYS,
+        dry_run=args.dry_run, max_writes_per_second=args.max_writes_per_second, checkpoint_path=args.checkpoint,
+    )
+    stats = engine.run([t for t in args.tasks.split(",") if t])
+    print(json.dumps(stats, indent=2))
+    if args.checkpoint and os.path.exists(args.checkpoint):
+        # a completed run starts from scratch next time
+        os.unlink(args.checkpoint)
+    stop_logging()
+
+
+if __name__ == "__main__":
+    main()
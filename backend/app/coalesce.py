@@ -0,0 +1,158 @@
+import os
+import time
+import asyncio
+import logging
+import unicodedata
+from typing import AsyncGenerator, AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+
+# identical prompts from the same user within this window share one generation
+COALESCE_WINDOW_SECONDS = float(os.getenv("COALESCE_WINDOW_SECONDS", "120"))
+# a registered generation whose upstream has not started by then (e.g. its response was never consumed) is ignored
+COALESCE_START_TIMEOUT_SECONDS = float(os.getenv("COALESCE_START_TIMEOUT_SECONDS", "60"))
+
+
+class Broadcast:
+    """Fan-out of one upstream token stream to any number of subscribers.
+
+    Every token is kept for the life of the broadcast, so a subscriber that attaches late still
+    receives the full sequence from the first token. `meta` carries the ids of the shared chat and
+    message so followers can render into the same message as the leader.
+    """
+
+    def __init__(self, meta: Optional[Dict] = None):
+        self.meta = dict(meta or {})
+        self.tokens: List[str] = []
+        self.done = False
+        self.error: Optional[str] = None
+        self.subscribers = 0
+        self.started = time.time()
+        self._cond = asyncio.Condition()
+        self._task: Optional[asyncio.Task] = None
+
+    async def publish(self, token: str):
+        async with self._cond:
+            self.tokens.append(token)
+            self._cond.notify_all()
+
+    async def finish(self, error: Optional[str] = None):
+        async with self._cond:
+            self.done = True
+            self.error = error
+            self._cond.notify_all()
+
+    async def subscribe(self) -> AsyncGenerator[str, None]:
+        """Yield every token from the start; raises RuntimeError if the upstream failed."""
+        self.subscribers += 1
+        try:
+            i = 0
+            while True:
+                async with self._cond:
+                    while i >= len(self.tokens) and not self.done:
+                        await self._cond.wait()
+                    batch = self.tokens[i:]
+                    done, error = self.done, self.error
+                i += len(batch)
+                for token in batch:
+                    yield token
+                if done and i >= len(self.tokens):
+                    if error:
+                        raise RuntimeError(error)
+                    return
+        finally:
+            self.subscribers -= 1
+            # nobody is listening any more: stop paying for the upstream generation
+            if self.subscribers == 0 and self._task is not None and not self._task.done():
+                self._task.cancel()
+
+    def run(self, source: AsyncIterator[str]) -> asyncio.Task:
+        """Drain `source` into the broadcast in a task of its own, independent of any one subscriber."""
+        async def produce():
+            try:
+                async for token in source:
+                    await self.publish(token)
+                await self.finish()
+            except asyncio.CancelledError:
+                await self.finish("generation cancelled")
+                raise
+            except Exception as e:
+                await self.finish(str(e))
+
+        return self.track(asyncio.create_task(produce()))
+
+    def track(self, task: asyncio.Task) -> asyncio.Task:
+        """Tie the broadcast to a task that produces its result out of band (e.g. media generation)."""
+        self._task = task
+        return task
+
+
+def content_key(uid: str, chat_id: Optional[str], model: str, prompt: str, grounding: bool) -> Tuple:
+    text = " ".join(unicodedata.normalize("NFKC", prompt or "").casefold().split())
+    return ("content", uid, chat_id or "", model, bool(grounding), text)
+
+
+def request_key(uid: str, request_id: str) -> Tuple:
+    return ("request", uid, request_id)
+
+
+class Coalescer:
+    """Process-local registry of in-flight generations.
+
+    A generation is registered under one or more keys: its request identity (uid, request_id), so a
+    retried or double-submitted request joins it, and optionally a content key, so the same prompt
+    sent from another tab within COALESCE_WINDOW_SECONDS joins it too. Keys are dropped when the
+    generation finishes; later duplicates fall back to the persisted message.
+    """
+
+    def __init__(self, window_seconds: float = COALESCE_WINDOW_SECONDS):
+        self.window_seconds = window_seconds
+        self._inflight: Dict[Tuple, Broadcast] = {}
+        self.joined = 0
+
+    def get(self, *keys: Optional[Tuple]) -> Optional[Broadcast]:
+        for key in keys:
+            if key is None:
+                continue
+            b = self._inflight.get(key)
+            if b is None or b.done:
+                continue
+            if b._task is None and time.time() - b.started > COALESCE_START_TIMEOUT_SECONDS:
+                continue
+            if key[0] == "content" and time.time() - b.started > self.window_seconds:
+                continue
+            self.joined += 1
+            return b
+        return None
+
+    def register(self, broadcast: Broadcast, *keys: Optional[Tuple]) -> Callable[[], None]:
+        """Register under every key; returns a callable that removes the registrations again."""
+        keys = [k for k in keys if k is not None]
+        for key in keys:
+            self._inflight[key] = broadcast
+
+        def release():
+            for key in keys:
+                if self._inflight.get(key) is broadcast:
+                    del self._inflight[key]
+
+        return release
+
+    def stats(self) -> Dict:
+        return {"inflight": len({id(b) for b in self._inflight.values()}), "joined": self.joined}
+
+
+coalescer = Coalescer()
+
+
+async def follow(broadcast: Broadcast) -> AsyncGenerator[str, None]:
+    """SSE events for a subscriber attached to someone else's generation."""
+    meta = broadcast.meta
+    yield f"event: meta\ndata: {{ \"chat_id\": \"{meta.get('chat_id')}\", \"message_id\": \"{meta.get('message_id')}\", \"coalesced\": true }}\n\n"
+    try:
+        async for token in broadcast.subscribe():
+            token_payload = token.replace("\n", "\\n")
+            yield f"event: token\ndata: {{\"text\": \"{token_payload}\"}}\n\n"
+        yield "event: done\ndata: {}\n\n"
+    except Exception as e:
+        logging.info(f"Coalesced stream ended with error: {e}")
+        yield f"event: error\ndata: {{\"message\": \"{str(e)}\"}}\n\n"
@@ -0,0 +1,202 @@
+import os
+import time
+import asyncio
+import logging
+from typing import Dict, List, Optional
+
+from .logs import log_event
+
+
+DELETE_PAGE_SIZE = int(os.getenv("DELETE_PAGE_SIZE", "200"))
+# Firestore batches are capped at 500 writes
+DELETE_BATCH_SIZE = min(500, int(os.getenv("DELETE_BATCH_SIZE", "400")))
+DELETE_CONCURRENCY = int(os.getenv("DELETE_CONCURRENCY", "4"))
+
+
+def _server_timestamp():
+    from firebase_admin import firestore
+    return firestore.SERVER_TIMESTAMP
+
+
+def tombstone_ref(fs, uid: str, chat_id: str):
+    return fs.collection("users").document(uid).collection("tombstones").document(chat_id)
+
+
+class ChatDeleter:
+    """Recursively deletes a chat's messages, their subcollections and stored media.
+
+    The chat document itself is removed up front by `start_deletion`, so listings stop showing the
+    chat immediately; this class then drains users/{uid}/chats/{chat_id}/messages page by page.
+    Each page's documents (messages plus nested subcollections such as `feedback`) are split into
+    batches of at most DELETE_BATCH_SIZE writes that are committed concurrently, bounded by
+    DELETE_CONCURRENCY. Image blobs (originals and variants) and attachments referenced by user
+    messages are deleted from storage along the way; an attachment that messages in another chat
+    still reference is kept and left to retention cleanup. Progress is mirrored to the tombstone at
+    users/{uid}/tombstones/{chat_id}, which doubles as the status handle.
+    """
+
+    def __init__(self, fs, storage, uid: str, chat_id: str, *, page_size: int = DELETE_PAGE_SIZE,
+                 batch_size: int = DELETE_BATCH_SIZE, concurrency: int = DELETE_CONCURRENCY):
+        self.fs = fs
+        self.storage = storage
+        self.uid = uid
+        self.chat_id = chat_id
+        self.page_size = page_size
+        self.batch_size = batch_size
+        self.concurrency = max(1, concurrency)
+        self.counts = {"messages": 0, "subdocs": 0, "blobs": 0, "attachments": 0}
+        # attachments already handled in this run: several messages (on any page) may reference one
+        self._attachments_seen = set()
+
+    @property
+    def chat_ref(self):
+        return self.fs.collection("users").document(self.uid).collection("chats").document(self.chat_id)
+
+    def _collect_subdocs(self, ref) -> List:
+        """All documents in nested subcollections of ref (depth-first), excluding ref itself."""
+        out = []
+        for col in ref.collections():
+            for snap in col.stream():
+                out.append(snap.reference)
+                out.extend(self._collect_subdocs(snap.reference))
+        return out
+
+    def _media_for(self, data: Dict):
+        blobs, attachment_ids = [], []
+        for img in data.get("images") or []:
+            if img.get("storagePath"):
+                blobs.append(img["storagePath"])
+            for v in img.get("variants") or []:
+                if v.get("storagePath"):
+                    blobs.append(v["storagePath"])
+        for aid in data.get("attachments") or []:
+            if isinstance(aid, str):
+                attachment_ids.append(aid)
+        return blobs, attachment_ids
+
+    def _commit(self, refs: List):
+        batch = self.fs.batch()
+        for ref in refs:
+            batch.delete(ref)
+        batch.commit()
+
+    def _delete_blob(self, path: str) -> bool:
+        try:
+            return bool(self.storage.delete(path))
+        except Exception as e:
+            logging.warning(f"Blob delete failed for {path}: {e}")
+            return False
+
+    def _shared(self, aid: str) -> bool:
+        """Whether a message outside this chat still references attachment `aid`."""
+        query = (self.fs.collection_group("messages").where("uid", "==", self.uid)
+                 .where("attachments", "array_contains", aid))
+        try:
+            return any(snap.to_dict().get("chatId") != self.chat_id for snap in query.stream())
+        except Exception as e:
+            # without the index (or on any read error) keep the file; retention cleanup removes it later
+            logging.warning(f"Attachment reference check failed for {aid}: {e}")
+            return True
+
+    def _delete_attachment(self, aid: str) -> Optional[object]:
+        ref = self.fs.collection("users").document(self.uid).collection("attachments").document(aid)
+        snap = ref.get()
+        if not snap.exists or self._shared(aid):
+            return None
+        data = snap.to_dict() or {}
+        for path in (data.get("storagePath"), (data.get("extraction") or {}).get("textPath")):
+            if path and self._delete_blob(path):
+                self.counts["blobs"] += 1
+        self.counts["attachments"] += 1
+        return ref
+
+    def _next_page(self):
+        return list(self.chat_ref.collection("messages").limit(self.page_size).stream())
+
+    async def _commit_all(self, refs: List):
+        sem = asyncio.Semaphore(self.concurrency)
+
+        async def commit(chunk):
+            async with sem:
+                await asyncio.to_thread(self._commit, chunk)
+
+        chunks = [refs[i:i + self.batch_size] for i in range(0, len(refs), self.batch_size)]
+        await asyncio.gather(*(commit(c) for c in chunks))
+
+    async def _update_tombstone(self, **fields):
+        ref = tombstone_ref(self.fs, self.uid, self.chat_id)
+        data = {**fields, "counts": dict(self.counts), "updatedAt": _server_timestamp()}
+        await asyncio.to_thread(lambda: ref.set(data, merge=True))
+
+    async def run(self) -> Dict[str, int]:
+        started = time.time()
+        try:
+            while True:
+                page = await asyncio.to_thread(self._next_page)
+                if not page:
+                    break
+                subdocs, refs, blobs, attachment_ids = [], [], [], []
+                for snap in page:
+                    children = await asyncio.to_thread(self._collect_subdocs, snap.reference)
+                    subdocs.extend(children)
+                    refs.append(snap.reference)
+                    self.counts["subdocs"] += len(children)
+                    b, a = self._media_for(snap.to_dict() or {})
+                    blobs.extend(b)
+                    attachment_ids.extend(a)
+                for aid in attachment_ids:
+                    if aid in self._attachments_seen:
+                        continue
+                    self._attachments_seen.add(aid)
+                    ref = await asyncio.to_thread(self._delete_attachment, aid)
+                    if ref is not None:
+                        refs.append(ref)
+                deleted = await asyncio.gather(*(asyncio.to_thread(self._delete_blob, p) for p in blobs))
+                self.counts["blobs"] += sum(deleted)
+                # children before parents: an interrupted run can only find subcollections through their message
+                await self._commit_all(subdocs)
+                await self._commit_all(refs)
+                self.counts["messages"] += len(page)
+                await self._update_tombstone(status="deleting")
+            # subcollections hanging off the chat document itself, if any
+            rest = await asyncio.to_thread(self._collect_subdocs, self.chat_ref)
+            if rest:
+                await self._commit_all(rest)
+                self.counts["subdocs"] += len(rest)
+            await self._update_tombstone(status="deleted", finishedAt=_server_timestamp())
+        except asyncio.CancelledError:
+            # worker shutdown: deleting the chat again resumes from what is left
+            try:
+                ref = tombstone_ref(self.fs, self.uid, self.chat_id)
+                ref.set({"status": "interrupted", "counts": dict(self.counts), "updatedAt": _server_timestamp()}, merge=True)
+            except Exception:
+                pass
+            raise
+        except Exception as e:
+            logging.error(f"Chat deletion failed uid={self.uid} chat={self.chat_id}: {e}")
+            await self._update_tombstone(status="error", error=str(e))
+            raise
+        log_event("chat_deleted", chat_id=self.chat_id, uid=self.uid, counts=self.counts, seconds=round(time.time() - started, 2))
+        return self.counts
+
+
+def start_deletion(fs, uid: str, chat_id: str) -> Dict:
+    """Write the tombstone and remove the chat document in one batch; returns the tombstone data.
+
+    Messages are left for ChatDeleter.run, which the caller schedules in the background.
+    """
+    chat_ref = fs.collection("users").document(uid).collection("chats").document(chat_id)
+    snap = chat_ref.get()
+    tomb = {
+        "chatId": chat_id,
+        "status": "deleting",
+        "counts": {"messages": 0, "subdocs": 0, "blobs": 0, "attachments": 0},
+        "createdAt": _server_timestamp(),
+        "updatedAt": _server_timestamp(),
+    }
+    batch = fs.batch()
+    batch.set(tombstone_ref(fs, uid, chat_id), tomb)
+    if snap.exists:
+        batch.delete(chat_ref)
+    batch.commit()
+    return {"chatId": chat_id, "status": "deleting", "existed": snap.exists}
@@ -0,0 +1,90 @@
+import os
+import time
+import asyncio
+import logging
+from typing import Callable, Dict, Optional, Tuple
+
+
+HEALTH_PROBE_INTERVAL_SECONDS = float(os.getenv("HEALTH_PROBE_INTERVAL_SECONDS", "30"))
+HEALTH_PROBE_TIMEOUT_SECONDS = float(os.getenv("HEALTH_PROBE_TIMEOUT_SECONDS", "5"))
+
+# A probe returns (configured, ok). configured=False means the dependency is intentionally absent
+# (missing env vars); it is reported as unavailable but never blocks readiness.
+ProbeFn = Callable[[], Tuple[bool, bool]]
+
+
+class HealthProber:
+    """Periodically probes external dependencies in the background and keeps the latest results.
+
+    Probes are blocking callables executed in worker threads, so the event loop never waits on
+    Firestore or HTTP reachability checks; /health only reads the in-memory snapshot.
+    """
+
+    def __init__(self, interval: float = HEALTH_PROBE_INTERVAL_SECONDS, timeout: float = HEALTH_PROBE_TIMEOUT_SECONDS):
+        self.interval = interval
+        self.timeout = timeout
+        self._probes: Dict[str, Tuple[ProbeFn, bool]] = {}
+        self._results: Dict[str, dict] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._rounds = 0
+
+    def register(self, name: str, fn: ProbeFn, *, critical: bool = False):
+        self._probes[name] = (fn, critical)
+        self._results.setdefault(name, {"ok": False, "configured": None, "critical": critical, "checked_at": None, "latency_ms": None, "error": None})
+
+    async def _run_probe(self, name: str, fn: ProbeFn, critical: bool):
+        start = time.perf_counter()
+        configured, ok, error = None, False, None
+        try:
+            configured, ok = await asyncio.wait_for(asyncio.to_thread(fn), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            error = f"timed out after {self.timeout}s"
+        except Exception as e:
+            error = str(e)
+        self._results[name] = {
+            "ok": bool(ok),
+            "configured": configured,
+            "critical": critical,
+            "checked_at": time.time(),
+            "latency_ms": round((time.perf_counter() - start) * 1000, 2),
+            "error": error,
+        }
+
+    async def run_once(self):
+        await asyncio.gather(*(self._run_probe(name, fn, critical) for name, (fn, critical) in self._probes.items()))
+        self._rounds += 1
+
+    async def _loop(self):
+        while True:
+            try:
+                await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.warning(f"Health probe round failed: {e}")
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except (asyncio.CancelledError, Exception):
+                pass
+            self._task = None
+
+    def snapshot(self) -> Dict[str, dict]:
+        return {name: dict(res) for name, res in self._results.items()}
+
+    def ready(self) -> bool:
+        """Ready once a probe round has completed and every configured critical dependency is up."""
+        if self._rounds == 0:
+            return False
+        return all(r["ok"] for r in self._results.values() if r["critical"] and r["configured"])
+
+
+prober = HealthProber()
@@ -0,0 +1,323 @@
+import os
+import re
+import html
+import time
+import hashlib
+import sqlite3
+import logging
+import tempfile
+import threading
+from typing import Dict, List, Optional
+
+
+HISTORY_INDEX_ROOT = os.getenv("HISTORY_INDEX_ROOT", os.path.join(tempfile.gettempdir(), "gemini-history-index"))
+HISTORY_SEARCH_ENABLED = os.getenv("HISTORY_SEARCH_ENABLED", "1") == "1"
+HISTORY_SEARCH_MAX_LIMIT = 50
+HISTORY_SNIPPET_TOKENS = int(os.getenv("HISTORY_SNIPPET_TOKENS", "12"))
+# searches pull changes made elsewhere (other workers/hosts) at most this often per user
+HISTORY_INDEX_SYNC_SECONDS = float(os.getenv("HISTORY_INDEX_SYNC_SECONDS", "5"))
+# an index is rebuilt from scratch when its last full backfill is older than this
+HISTORY_INDEX_REBUILD_SECONDS = float(os.getenv("HISTORY_INDEX_REBUILD_SECONDS", str(24 * 3600)))
+# rebuild instead of replaying when more than this many sync pages of changes are pending
+HISTORY_INDEX_MAX_SYNC_PAGES = 10
+
+# chat titles are stored as rows with an empty message_id
+_CHAT_ROW = ""
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS docs (
+    id INTEGER PRIMARY KEY,
+    chat_id TEXT NOT NULL,
+    message_id TEXT NOT NULL,
+    role TEXT,
+    created_at REAL,
+    title TEXT NOT NULL DEFAULT '',
+    content TEXT NOT NULL DEFAULT '',
+    UNIQUE (chat_id, message_id)
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS docs_fts USING fts5(
+    title, content, content='docs', content_rowid='id', tokenize='porter unicode61', prefix='2 3'
+);
+CREATE TRIGGER IF NOT EXISTS docs_ai AFTER INSERT ON docs BEGIN
+    INSERT INTO docs_fts(rowid, title, content) VALUES (new.id, new.title, new.content);
+END;
+CREATE TRIGGER IF NOT EXISTS docs_ad AFTER DELETE ON docs BEGIN
+    INSERT INTO docs_fts(docs_fts, rowid, title, content) VALUES ('delete', old.id, old.title, old.content);
+END;
+CREATE TRIGGER IF NOT EXISTS docs_au AFTER UPDATE OF title, content ON docs BEGIN
+    INSERT INTO docs_fts(docs_fts, rowid, title, content) VALUES ('delete', old.id, old.title, old.content);
+    INSERT INTO docs_fts(rowid, title, content) VALUES (new.id, new.title, new.content);
+END;
+CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT);
+"""
+
+_TERM_RE = re.compile(r"\w+", re.UNICODE)
+# highlight markers for snippet(): control characters that survive html.escape and are swapped for <mark> after
+_MARK_START, _MARK_END = "\x02", "\x03"
+
+
+def fts_query(text: str) -> Optional[str]:
+    """Turn free text into a safe FTS5 query: every word must match, the last one as a prefix.
+
+    Terms are quoted so FTS5 operators and column filters typed by the user are treated as text.
+    """
+    terms = _TERM_RE.findall(text or "")[:16]
+    if not terms:
+        return None
+    quoted = [f'"{t}"' for t in terms]
+    quoted[-1] += "*"
+    return " AND ".join(quoted)
+
+
+def _ts(value) -> Optional[float]:
+    if value is None:
+        return None
+    if hasattr(value, "timestamp"):
+        return value.timestamp()
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class HistoryIndex:
+    """Per-user full-text index over chat titles and message content.
+
+    Each user gets a small SQLite database under HISTORY_INDEX_ROOT (sharded like the local storage
+    backend) holding the text once in `docs` with an external-content FTS5 index kept in sync by
+    triggers. The index is a local, rebuildable cache of Firestore: it is updated incrementally by
+    the history endpoints on this host, backfilled from Firestore in the background the first time a
+    user searches on a host, and before each search catches up on changes made elsewhere through the /history/sync
+    delta feed, from a watermark (sync cursor) stored with the index. Methods are blocking; call them
+    via asyncio.to_thread.
+    """
+
+    def __init__(self, root: str = HISTORY_INDEX_ROOT):
+        self.root = root
+        self._init_lock = threading.Lock()
+        self._initialized = set()
+        # uid -> monotonic time of the last catch-up check
+        self._checked: Dict[str, float] = {}
+
+    def path_for(self, uid: str) -> str:
+        digest = hashlib.sha256(uid.encode("utf-8")).hexdigest()
+        return os.path.join(self.root, digest[:2], f"{digest}.sqlite3")
+
+    def exists(self, uid: str) -> bool:
+        return os.path.exists(self.path_for(uid))
+
+    def _connect(self, uid: str) -> sqlite3.Connection:
+        path = self.path_for(uid)
+        if path not in self._initialized:
+            with self._init_lock:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                conn = sqlite3.connect(path, timeout=5)
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.executescript(_SCHEMA)
+                conn.close()
+                self._initialized.add(path)
+        conn = sqlite3.connect(path, timeout=5)
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    # -- writes --------------------------------------------------------------------------------
+
+    def upsert_message(self, uid: str, chat_id: str, message_id: str, content: Optional[str], role: Optional[str] = None, created_at=None):
+        conn = self._connect(uid)
+        try:
+            with conn:
+                conn.execute(
+                    "INSERT INTO docs (chat_id, message_id, role, created_at, content) VALUES (?, ?, ?, ?, ?) "
+                    "ON CONFLICT (chat_id, message_id) DO UPDATE SET content = excluded.content, "
+                    "role = COALESCE(excluded.role, docs.role), created_at = COALESCE(docs.created_at, excluded.created_at)",
+                    (chat_id, message_id, role, _ts(created_at) or time.time(), content or ""),
+                )
+        finally:
+            conn.close()
+
+    def upsert_chat(self, uid: str, chat_id: str, title: Optional[str], created_at=None):
+        conn = self._connect(uid)
+        try:
+            with conn:
+                conn.execute(
+                    "INSERT INTO docs (chat_id, message_id, created_at, title) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT (chat_id, message_id) DO UPDATE SET title = excluded.title",
+                    (chat_id, _CHAT_ROW, _ts(created_at) or time.time(), title or ""),
+                )
+        finally:
+            conn.close()
+
+    def delete_message(self, uid: str, chat_id: str, message_id: str):
+        conn = self._connect(uid)
+        try:
+            with conn:
+                conn.execute("DELETE FROM docs WHERE chat_id = ? AND message_id = ?", (chat_id, message_id))
+        finally:
+            conn.close()
+
+    def delete_chat(self, uid: str, chat_id: str):
+        conn = self._connect(uid)
+        try:
+            with conn:
+                conn.execute("DELETE FROM docs WHERE chat_id = ?", (chat_id,))
+        finally:
+            conn.close()
+
+    def backfill(self, uid: str, fs) -> int:
+        """Rebuild a user's index from Firestore. Returns the number of rows indexed."""
+        from .sync import fresh_cursor
+        # taken before reading, so writes that land during the backfill are replayed by the next catch-up
+        cursor = fresh_cursor()
+        chats_ref = fs.collection("users").document(uid).collection("chats")
+        rows = []
+        for chat in chats_ref.stream():
+            data = chat.to_dict() or {}
+            rows.append((chat.id, _CHAT_ROW, None, _ts(data.get("createdAt")), data.get("title") or "", ""))
+            for m in chats_ref.document(chat.id).collection("messages").stream():
+                md = m.to_dict() or {}
+                if md.get("content"):
+                    rows.append((chat.id, m.id, md.get("role"), _ts(md.get("createdAt")), "", md.get("content")))
+        conn = self._connect(uid)
+        try:
+            with conn:
+                conn.execute("DELETE FROM docs")
+                conn.executemany("INSERT INTO docs (chat_id, message_id, role, created_at, title, content) VALUES (?, ?, ?, ?, ?, ?)", rows)
+                conn.execute("INSERT OR REPLACE INTO state (key, value) VALUES ('backfilled_at', ?)", (str(time.time()),))
+                conn.execute("INSERT OR REPLACE INTO state (key, value) VALUES ('sync_cursor', ?)", (cursor,))
+            conn.execute("INSERT INTO docs_fts(docs_fts) VALUES ('optimize')")
+        finally:
+            conn.close()
+        return len(rows)
+
+    def _state(self, uid: str) -> Dict[str, str]:
+        conn = self._connect(uid)
+        try:
+            return dict(conn.execute("SELECT key, value FROM state").fetchall())
+        finally:
+            conn.close()
+
+    def _backfill_pending(self, uid: str) -> Dict:
+        self._checked[uid] = time.monotonic()
+        return {"action": "backfill_pending", "rows": 0}
+
+    def catch_up(self, uid: str, fs) -> Dict:
+        """Bring a user's index up to date with Firestore before searching it.
+
+        Replays the chats, messages and chat deletions changed since the stored watermark. When this
+        host has no index, the last backfill is older than HISTORY_INDEX_REBUILD_SECONDS, or the
+        watermark is too far behind to replay, nothing is read and the action is "backfill_pending":
+        a backfill scans every chat, so the caller runs `backfill` in the background instead of on
+        the search request. Checks are throttled to one per HISTORY_INDEX_SYNC_SECONDS per user.
+        Returns {"action", "rows"}.
+        """
+        from .sync import HistorySync, InvalidCursor
+        if self.exists(uid):
+            last = self._checked.get(uid)
+            if last is not None and time.monotonic() - last < HISTORY_INDEX_SYNC_SECONDS:
+                return {"action": "none", "rows": 0}
+            state = self._state(uid)
+            fresh = time.time() - float(state.get("backfilled_at") or 0) < HISTORY_INDEX_REBUILD_SECONDS
+            cursor = state.get("sync_cursor")
+        else:
+            fresh, cursor = False, None
+        if not fresh or not cursor:
+            return self._backfill_pending(uid)
+
+        sync = HistorySync(fs, uid)
+        chats, messages, deleted = [], [], []
+        try:
+            for _ in range(HISTORY_INDEX_MAX_SYNC_PAGES):
+                page = sync.changes(cursor)
+                chats += page["chats"]
+                messages += page["messages"]
+                deleted += page["deleted"]
+                cursor = page["cursor"]
+                if not page["has_more"]:
+                    break
+            else:
+                # too far behind to replay cheaply
+                return self._backfill_pending(uid)
+        except InvalidCursor:
+            return self._backfill_pending(uid)
+
+        conn = self._connect(uid)
+        try:
+            with conn:
+                for c in chats:
+                    conn.execute(
+                        "INSERT INTO docs (chat_id, message_id, created_at, title) VALUES (?, ?, ?, ?) "
+                        "ON CONFLICT (chat_id, message_id) DO UPDATE SET title = excluded.title",
+                        (c["id"], _CHAT_ROW, _ts(c.get("createdAt")) or time.time(), c.get("title") or ""),
+                    )
+                for m in messages:
+                    if not m.get("content"):
+                        continue
+                    conn.execute(
+                        "INSERT INTO docs (chat_id, message_id, role, created_at, content) VALUES (?, ?, ?, ?, ?) "
+                        "ON CONFLICT (chat_id, message_id) DO UPDATE SET content = excluded.content, "
+                        "role = COALESCE(excluded.role, docs.role)",
+                        (m["chat_id"], m["id"], m.get("role"), _ts(m.get("createdAt")) or time.time(), m["content"]),
+                    )
+                for d in deleted:
+                    conn.execute("DELETE FROM docs WHERE chat_id = ?", (d["chat_id"],))
+                conn.execute("INSERT OR REPLACE INTO state (key, value) VALUES ('sync_cursor', ?)", (cursor,))
+        finally:
+            conn.close()
+        self._checked[uid] = time.monotonic()
+        return {"action": "sync", "rows": len(chats) + len(messages) + len(deleted)}
+
+    # -- reads ---------------------------------------------------------------------------------
+
+    def search(self, uid: str, text: str, limit: int = 20, offset: int = 0) -> Dict:
+        """Rank matches with BM25 (title hits weigh more than content) and return one page.
+
+        Returns {"results": [...], "next_offset": int | None}; each result carries chat_id,
+        message_id (None for a title match), role, chat title, a highlighted snippet and score.
+        """
+        query = fts_query(text)
+        if not query or not self.exists(uid):
+            return {"results": [], "next_offset": None}
+        limit = max(1, min(limit, HISTORY_SEARCH_MAX_LIMIT))
+        conn = self._connect(uid)
+        try:
+            rows = conn.execute(
+                "SELECT d.chat_id, d.message_id, d.role, d.created_at, t.title, "
+                "snippet(docs_fts, -1, ?, ?, '…', ?), bm25(docs_fts, 4.0, 1.0) AS score "
+                "FROM docs_fts JOIN docs d ON d.id = docs_fts.rowid "
+                "LEFT JOIN docs t ON t.chat_id = d.chat_id AND t.message_id = '' "
+                "WHERE docs_fts MATCH ? ORDER BY score LIMIT ? OFFSET ?",
+                (_MARK_START, _MARK_END, HISTORY_SNIPPET_TOKENS, query, limit + 1, offset),
+            ).fetchall()
+        except sqlite3.OperationalError as e:
+            logging.warning(f"History search failed for query {query!r}: {e}")
+            return {"results": [], "next_offset": None}
+        finally:
+            conn.close()
+        results: List[Dict] = []
+        for chat_id, message_id, role, created_at, title, snippet, score in rows[:limit]:
+            results.append({
+                "chat_id": chat_id,
+                "message_id": message_id or None,
+                "role": role,
+                "title": title,
+                "snippet": _highlight(snippet),
+                "createdAt": created_at,
+                # bm25() is lower-is-better; flip it so clients can sort descending
+                "score": round(-score, 4),
+            })
+        return {"results": results, "next_offset": offset + limit if len(rows) > limit else None}
+
+
+def _highlight(snippet: Optional[str]) -> str:
+    """HTML-escape stored text, then turn the match markers into <mark> tags."""
+    return html.escape(snippet or "").replace(_MARK_START, "<mark>").replace(_MARK_END, "</mark>")
+
+
+_index: Optional[HistoryIndex] = None
+
+
+def get_history_index() -> HistoryIndex:
+    global _index
+    if _index is None:
+        _index = HistoryIndex()
+    return _index
@@ -0,0 +1,104 @@
+import os
+import time
+import asyncio
+import logging
+from collections import Counter
+from typing import Coroutine, Dict, Optional
+
+from .logs import log_event
+
+
+# after the drain window, how long cancelled work gets to record that it was interrupted
+SHUTDOWN_FLUSH_SECONDS = float(os.getenv("SHUTDOWN_FLUSH_SECONDS", "5"))
+
+
+class ShuttingDownError(RuntimeError):
+    """Raised when new work is submitted to a worker that is shutting down."""
+
+    def __init__(self, retry_after: int = 1):
+        super().__init__("This server is shutting down; retry shortly")
+        self.retry_after = retry_after
+
+
+class TaskRegistry:
+    """Tracks every stream pipeline and background job of this worker so shutdown can drain them.
+
+    Work is spawned through `spawn(coro, kind)`. On shutdown the registry stops accepting new work,
+    waits for tracked tasks to finish, then cancels what is left. Jobs handle their own
+    CancelledError to flush buffered output and mark their documents as interrupted, so nothing is
+    left `streaming`/`generating` and the user is not locked out by a stale active request.
+    """
+
+    def __init__(self):
+        self._tasks: Dict[asyncio.Task, tuple] = {}
+        self.accepting = True
+        self.finished = Counter()
+        self.failed = Counter()
+
+    def check_accepting(self):
+        if not self.accepting:
+            raise ShuttingDownError()
+
+    def spawn(self, coro: Coroutine, kind: str = "background", name: Optional[str] = None) -> asyncio.Task:
+        task = asyncio.create_task(coro, name=name)
+        self._tasks[task] = (kind, time.time())
+        task.add_done_callback(self._done)
+        return task
+
+    def _done(self, task: asyncio.Task):
+        kind, started = self._tasks.pop(task, ("background", time.time()))
+        if task.cancelled():
+            return
+        if task.exception() is not None:
+            self.failed[kind] += 1
+            logging.warning(f"Background {kind} task failed after {time.time() - started:.1f}s: {task.exception()!r}")
+        else:
+            self.finished[kind] += 1
+
+    def active(self) -> Dict[str, int]:
+        return dict(Counter(kind for kind, _ in self._tasks.values()))
+
+    async def _wait(self, seen: Dict[asyncio.Task, str], deadline: float) -> None:
+        """Wait until no tracked task is left or `deadline` passes, including tasks spawned meanwhile.
+
+        Finishing work often spawns follow-up jobs (persisting grounding, indexing history), so a
+        single snapshot of the pending tasks would miss them.
+        """
+        while True:
+            pending = [t for t in self._tasks if not t.done()]
+            for t in pending:
+                seen.setdefault(t, self._tasks[t][0])
+            remaining = deadline - time.time()
+            if not pending or remaining <= 0:
+                return
+            await asyncio.wait(pending, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+
+    async def shutdown(self, timeout: float, flush_timeout: float = SHUTDOWN_FLUSH_SECONDS) -> Dict:
+        """Stop accepting work, drain tracked tasks for up to `timeout`, then cancel the rest."""
+        self.accepting = False
+        started = time.time()
+        seen: Dict[asyncio.Task, str] = {}
+        await self._wait(seen, started + timeout)
+        left = [t for t in self._tasks if not t.done()]
+        for t in left:
+            t.cancel()
+        if left:
+            # give the cancelled jobs a moment to persist partial output and mark themselves interrupted
+            await self._wait(seen, time.time() + flush_timeout)
+        tracked = Counter(seen.values())
+        interrupted = Counter(seen[t] for t in left)
+        summary = {
+            "seconds": round(time.time() - started, 2),
+            "tracked": dict(tracked),
+            "drained": dict(tracked - interrupted),
+            "interrupted": dict(interrupted),
+            "unflushed": sum(1 for t in self._tasks if not t.done()),
+        }
+        log_event("shutdown_drain", **summary)
+        return summary
+
+    def stats(self) -> Dict:
+        return {"accepting": self.accepting, "active": self.active(), "finished": dict(self.finished), "failed": dict(self.failed)}
+
+
+registry = TaskRegistry()
@@ -0,0 +1,177 @@
+import os
+import sys
+import json
+import queue
+import random
+import atexit
+import logging
+import logging.handlers
+import contextvars
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "")
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+# "event=rate,..." — keep this fraction of INFO/DEBUG records of a high-volume event; warnings and errors are always kept
+LOG_SAMPLE_RATES = os.getenv("LOG_SAMPLE_RATES", "model_route=0.1")
+# requests slower than this (or failing) are always logged, whatever the "request" sample rate
+LOG_SLOW_REQUEST_MS = float(os.getenv("LOG_SLOW_REQUEST_MS", "1000"))
+
+# request-scoped fields (request_id, uid, chat_id, ...) added to every log line emitted in the context,
+# including from tasks spawned by the request such as the streaming pipeline
+_context: contextvars.ContextVar[Dict] = contextvars.ContextVar("log_context", default={})
+
+
+def bind(**fields) -> contextvars.Token:
+    """Add fields to the current log context; None values are ignored."""
+    merged = {**_context.get(), **{k: v for k, v in fields.items() if v is not None}}
+    return _context.set(merged)
+
+
+def reset(token: contextvars.Token):
+    _context.reset(token)
+
+
+@contextmanager
+def bound(**fields):
+    token = bind(**fields)
+    try:
+        yield
+    finally:
+        reset(token)
+
+
+def current() -> Dict:
+    return _context.get()
+
+
+def _parse_rates(spec: str) -> Dict[str, float]:
+    rates = {}
+    for part in spec.split(","):
+        if "=" in part:
+            name, rate = part.split("=", 1)
+            try:
+                rates[name.strip()] = float(rate)
+            except ValueError:
+                pass
+    return rates
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """Runs on the logging thread (usually the event loop): capture context, sample, enqueue.
+
+    Formatting and I/O happen on the listener thread. Records are only sampled here, never
+    formatted; the message is resolved eagerly only when it has %-args, which may be mutated later.
+    """
+
+    def __init__(self, q, rates: Dict[str, float]):
+        super().__init__(q)
+        self.rates = rates
+        self.dropped = 0
+        self.sampled_out = 0
+
+    def _keep(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self.rates.get(record.msg) if isinstance(record.msg, str) else None
+        if rate is None or rate >= 1:
+            return True
+        fields = getattr(record, "fields", None) or {}
+        if fields.get("always"):
+            return True
+        return random.random() < rate
+
+    def emit(self, record: logging.LogRecord):
+        if not self._keep(record):
+            self.sampled_out += 1
+            return
+        try:
+            self.enqueue(self.prepare(record))
+        except queue.Full:
+            # never block the event loop on logging; count what was lost instead
+            self.dropped += 1
+        except Exception:
+            self.handleError(record)
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.ctx = _context.get()
+        if record.args:
+            record.msg = record.getMessage()
+            record.args = None
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: ts, level, logger, event, the request context, then event fields."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        out = {
+            "ts": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "event": record.msg if isinstance(record.msg, str) else str(record.msg),
+        }
+        out.update(getattr(record, "ctx", None) or {})
+        fields = getattr(record, "fields", None)
+        if fields:
+            out.update({k: v for k, v in fields.items() if v is not None and k != "always"})
+        if record.exc_info:
+            out["exc"] = self.formatException(record.exc_info)
+        return json.dumps(out, default=str)
+
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_queue_handler: Optional[_QueueHandler] = None
+
+
+def setup_logging(env: str = "development"):
+    """Route the root logger through a bounded queue to a background listener writing JSON lines."""
+    global _listener, _queue_handler
+    if _listener is not None:
+        return
+    q = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    out = logging.StreamHandler(sys.stderr)
+    out.setFormatter(JsonFormatter())
+    _queue_handler = _QueueHandler(q, _parse_rates(LOG_SAMPLE_RATES))
+    root = logging.getLogger()
+    root.addHandler(_queue_handler)
+    root.setLevel(LOG_LEVEL.upper() if LOG_LEVEL else (logging.INFO if env == "production" else logging.DEBUG))
+    _listener = logging.handlers.QueueListener(q, out, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+    if hasattr(os, "register_at_fork"):
+        os.register_at_fork(after_in_child=_restart_after_fork)
+
+
+def _restart_after_fork():
+    # the listener thread does not survive fork (gunicorn preload_app), so each worker gets a
+    # fresh queue and its own listener; otherwise the queue fills up and every record is dropped
+    global _listener
+    if _listener is None or _queue_handler is None:
+        return
+    handlers = _listener.handlers
+    q = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    _queue_handler.queue = q
+    _listener = logging.handlers.QueueListener(q, *handlers, respect_handler_level=True)
+    _listener.start()
+
+
+def stop_logging():
+    """Flush queued records and stop the listener thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def log_event(event: str, level: int = logging.INFO, **fields):
+    logging.log(level, event, extra={"fields": fields})
+
+
+def stats() -> Dict:
+    h = _queue_handler
+    if h is None:
+        return {}
+    return {"queued": h.queue.qsize(), "dropped": h.dropped, "sampled_out": h.sampled_out}
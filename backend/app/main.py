@@ -1,32 +1,56 @@
 from fastapi import FastAPI, Request, Depends, HTTPException, UploadFile, File
-from fastapi.responses import StreamingResponse, JSONResponse
+from fastapi.responses import StreamingResponse, JSONResponse, FileResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 import os
 import time
 import asyncio
 import uuid
 import logging
-from typing import Optional
-import requests
-from app.tools import router as tools_router
+from typing import Dict, Optional
+from app.tools import public_router as tools_public_router, router as tools_router
+from .health import prober
+from .metrics import metrics
+from .lifecycle import ShuttingDownError, registry
+from .streaming import STREAM_DRAIN_SECONDS, StreamCapacityError, stream_admission
+
+try:
+    from backend.services.images import sniff_content_type, extension_for, generate_derivatives, pick_variant
+    from backend.services.resilience import BulkheadFullError, CircuitOpenError, breaker_states, dependency_states, get_dependency
+    from backend.services import tracing
+except Exception:
+    from services.images import sniff_content_type, extension_for, generate_derivatives, pick_variant
+    from services.resilience import BulkheadFullError, CircuitOpenError, breaker_states, dependency_states, get_dependency
+    from services import tracing
 
 app = FastAPI(title="Gemini Clone Backend")
 
-# Include routers
-app.include_router(tools_router)
 
+@app.exception_handler(CircuitOpenError)
+async def circuit_open_handler(request: Request, exc: CircuitOpenError):
+    headers = {"Retry-After": str(max(1, int(exc.retry_after)))}
+    return JSONResponse(status_code=503, content=make_error("DEPENDENCY_UNAVAILABLE", str(exc)), headers=headers)
 
-# Structured JSON logging setup
-import json
-handler = logging.StreamHandler()
-handler.setFormatter(logging.Formatter('%(message)s'))
+
+@app.exception_handler(BulkheadFullError)
+async def bulkhead_full_handler(request: Request, exc: BulkheadFullError):
+    return JSONResponse(status_code=503, content=make_error("DEPENDENCY_BUSY", str(exc)), headers={"Retry-After": "1"})
+
+
+@app.exception_handler(StreamCapacityError)
+async def stream_capacity_handler(request: Request, exc: StreamCapacityError):
+    return JSONResponse(status_code=503, content=make_error("STREAMS_BUSY", str(exc)), headers={"Retry-After": str(exc.retry_after)})
+
+
+@app.exception_handler(ShuttingDownError)
+async def shutting_down_handler(request: Request, exc: ShuttingDownError):
+    return JSONResponse(status_code=503, content=make_error("SHUTTING_DOWN", str(exc)), headers={"Retry-After": str(exc.retry_after)})
+
+
+# Structured JSON logging: records are queued from the event loop and formatted/written by a listener thread
+from .logs import LOG_SLOW_REQUEST_MS, bind, log_event, reset as reset_log_context, setup_logging, stats as logging_stats
 # Respect environment to reduce logs in production
 env = os.getenv("PYTHON_ENV") or os.getenv("ENV") or "development"
-if env == "production":
-    logging.getLogger().setLevel(logging.INFO)
-else:
-    logging.getLogger().setLevel(logging.DEBUG)
-logging.getLogger().addHandler(handler)
+setup_logging(env)
 
 
 ALLOWED_MODELS = ["gemini-2.0-flash", "gemini-3.0-pro-preview"]
@@ -37,6 +61,10 @@ VIDEO_RATE_LIMIT_PER_HOUR = 2
 MAX_IMAGE_SIZE_BYTES = 10 * 1024 * 1024
 MAX_ATTACHMENT_SIZE_BYTES = int(os.getenv("MAX_ATTACHMENT_SIZE_BYTES", str(10 * 1024 * 1024)))
 STREAM_UPDATE_INTERVAL_MS = int(os.getenv("STREAM_UPDATE_INTERVAL_MS", "500"))
+VIDEO_MAX_WAIT_SECONDS = int(os.getenv("VIDEO_MAX_WAIT_SECONDS", "900"))
+# /bootstrap: chats in the first sidebar page and most recent messages of the active chat
+BOOTSTRAP_CHATS_LIMIT = int(os.getenv("BOOTSTRAP_CHATS_LIMIT", "50"))
+BOOTSTRAP_MESSAGES_LIMIT = int(os.getenv("BOOTSTRAP_MESSAGES_LIMIT", "50"))
 # Retention defaults: how long to keep generated media and requests. Adjust via operator-run cleanup.
 MEDIA_RETENTION_DAYS = int(os.getenv("MEDIA_RETENTION_DAYS", "30"))  # purge generated media older than this
 
@@ -61,20 +89,44 @@ async def request_timing_middleware(request: Request, call_next):
     chat_id = request.headers.get("X-Chat-Id") or request.query_params.get("chat_id")
     generation_type = request.headers.get("X-Generation-Type") or request.query_params.get("type")
 
-    resp = await call_next(request)
-    latency = time.time() - start
-    log = {
-        "path": request.url.path,
-        "method": request.method,
-        "status_code": resp.status_code,
-        "latency": latency,
-        "request_id": request_id,
-        "uid": uid,
-        "chat_id": chat_id,
-        "model": model,
-        "generation_type": generation_type,
-    }
-    logging.info(json.dumps(log))
+    # root span of the request; continues the caller's trace when it sends a W3C traceparent
+    root = tracing.start_trace(f"{request.method} {request.url.path}", request.headers.get("traceparent"), **{"http.method": request.method, "http.target": request.url.path})
+    # everything logged while handling the request (and by tasks it spawns) carries these fields
+    token = bind(request_id=request_id, chat_id=chat_id, trace_id=root.trace_id)
+    try:
+        with tracing.use_span(root):
+            resp = await call_next(request)
+    except Exception as e:
+        root.record_exception(e)
+        root.end()
+        raise
+    finally:
+        reset_log_context(token)
+    latency_ms = (time.time() - start) * 1000
+    route = request.scope.get("route")
+    if root.sampled:
+        if route is not None:
+            root.name = f"{request.method} {route.path}"
+        root.set_attribute("http.status_code", resp.status_code)
+    root.end()
+    resp.headers["X-Trace-Id"] = root.trace_id
+    user = getattr(request.state, "user", None)
+    if isinstance(user, dict) and user.get("uid"):
+        uid = user["uid"]
+    log_event(
+        "request",
+        path=request.url.path,
+        method=request.method,
+        status_code=resp.status_code,
+        latency_ms=round(latency_ms, 2),
+        request_id=request_id,
+        uid=uid,
+        chat_id=chat_id,
+        model=model,
+        generation_type=generation_type,
+        # slow and failed requests are never sampled out
+        always=resp.status_code >= 500 or latency_ms >= LOG_SLOW_REQUEST_MS,
+    )
     return resp
 
 origins = [os.getenv("FRONTEND_ORIGIN", "*")]
@@ -83,12 +135,14 @@ app.add_middleware(
     allow_origins=origins,
     allow_credentials=True,
     allow_methods=["*"],
-    allow_headers=["*"]
+    allow_headers=["*"],
+    expose_headers=["X-Trace-Id"],
 )
 
 # Firebase Admin initialization
-import firebase_admin
-from firebase_admin import auth as firebase_auth, credentials
+# The SDK (and the gRPC channels behind the Firestore client) is imported and created lazily in
+# each worker process: gunicorn preloads this module in the master, and gRPC clients must not be
+# shared across fork().
 
 
 def init_firebase():
@@ -99,6 +153,9 @@ def init_firebase():
     
     Returns early with True if Firebase app is already initialized.
     """
+    import firebase_admin
+    from firebase_admin import credentials
+
     if firebase_admin._apps:
         return True
     
@@ -123,6 +180,10 @@ def init_firebase():
         }
         cred = credentials.Certificate(service_account)
         firebase_admin.initialize_app(cred)
+        try:
+            tracing.instrument_firestore()
+        except Exception as e:
+            logging.warning(f"Firestore tracing unavailable: {e}")
         
         # Test firestore client initialization
         try:
@@ -138,9 +199,6 @@ def init_firebase():
         return False
 
 
-init_firebase()
-
-
 # Environment variables split into REQUIRED (fatal if missing) and OPTIONAL (degraded features)
 # Currently all env vars are optional to enable graceful degradation.
 # TODO: If any services become truly mandatory for core operation (e.g., authentication),
@@ -160,9 +218,10 @@ OPTIONAL_ENV_VARS = [
 
 
 def _check_http_endpoint(url: Optional[str], api_key_name: str) -> bool:
-    if not url:
+    if not url or not os.getenv(api_key_name):
         return False
     try:
+        import requests
         # lightweight HEAD request to verify reachability
         r = requests.head(url, timeout=5)
         return r.status_code < 500
@@ -170,6 +229,47 @@ def _check_http_endpoint(url: Optional[str], api_key_name: str) -> bool:
         return False
 
 
+def _probe_firestore():
+    if not init_firebase():
+        return False, False
+    # single document read; the document does not need to exist. Its outcome drives the firestore
+    # breaker, so this bypasses get_fs(), which refuses to hand out a client while the breaker is open.
+    from firebase_admin import firestore
+    dep = get_dependency("firestore")
+    started = time.time()
+    try:
+        firestore.client().collection("_health").document("probe").get(timeout=dep.timeout())
+    except Exception:
+        dep.record(False)
+        raise
+    dep.record(True, time.time() - started)
+    return True, True
+
+
+def _probe_storage():
+    bucket_name = os.getenv("FIREBASE_STORAGE_BUCKET")
+    if not bucket_name or not init_firebase():
+        return False, False
+    from firebase_admin import storage as _storage
+    return True, _storage.bucket(bucket_name).exists()
+
+
+def _http_probe(endpoint_env: str, default_url: str, api_key_name: str):
+    def probe():
+        if not os.getenv(api_key_name):
+            return False, False
+        return True, _check_http_endpoint(os.getenv(endpoint_env, default_url), api_key_name)
+    return probe
+
+
+prober.register("firestore", _probe_firestore, critical=True)
+prober.register("storage", _probe_storage)
+prober.register("gemini", _http_probe("GEMINI_ENDPOINT", "https://generativelanguage.googleapis.com", "GEMINI_API_KEY"))
+prober.register("nano_banana", _http_probe("NANO_BANANA_ENDPOINT", "https://api.nanobanana.example/generate", "NANO_BANANA_API_KEY"))
+prober.register("veo", _http_probe("VEO_ENDPOINT", "https://api.veo.example/jobs", "VEO_API_KEY"))
+prober.register("tavily", _http_probe("TAVILY_ENDPOINT", "https://api.tavily.example/search", "TAVILY_API_KEY"))
+
+
 def check_and_increment_grounding_quota(uid: str) -> bool:
     """Per-user grounding quota. Uses Firestore quota doc under users/{uid}/quota/usage."""
     fs = get_fs()
@@ -192,11 +292,12 @@ def check_and_increment_grounding_quota(uid: str) -> bool:
         data["grounding"] = counts
         tx.set(ref, data, merge=True)
 
-    try:
-        fs.transaction().run(lambda t: txn(t))
-        return True
-    except Exception:
-        return False
+    with tracing.span("quota.grounding"):
+        try:
+            fs.transaction().run(lambda t: txn(t))
+            return True
+        except Exception:
+            return False
 
 
 @app.on_event("startup")
@@ -205,7 +306,12 @@ def startup_checks():
     Perform startup validation and diagnostics.
     Logs warnings for missing optional services but does NOT exit.
     Only truly fatal misconfigurations should prevent startup.
+
+    Runs once per worker after fork, so this is where the Firebase clients are created. Checks are
+    limited to configuration and client construction; no Firestore or Storage RPCs are issued here
+    so worker boot stays fast when autoscaling.
     """
+    boot_start = time.time()
     errors = []
     warnings = []
     
@@ -221,31 +327,16 @@ def startup_checks():
         errors.append({"missing_required_env_vars": missing_required})
         logging.error(f"Required environment variables not set: {missing_required}")
     
-    # Verify Firestore connectivity (non-fatal)
-    fs_ok = False
-    try:
-        from firebase_admin import firestore as _fs
-        _fs.client().collections()
-        fs_ok = True
-        logging.info("Firestore connectivity: OK")
-    except Exception as e:
-        warnings.append({"firestore_warning": str(e)})
-        logging.warning(f"Firestore not available: {e}")
+    # Create the Firestore client for this worker (non-fatal)
+    fs_ok = init_firebase()
+    if not fs_ok:
+        warnings.append({"firestore_warning": "Firebase Admin SDK not initialized"})
     
-    # Verify storage bucket access if configured (non-fatal)
+    # Storage is configured if Firebase is up and a bucket name is set (non-fatal)
     storage_ok = False
     bucket_name = os.getenv("FIREBASE_STORAGE_BUCKET")
     if bucket_name:
-        try:
-            from firebase_admin import storage as _storage
-            b = _storage.bucket(bucket_name)
-            # attempt to get bucket metadata
-            _ = b.name
-            storage_ok = True
-            logging.info("Firebase Storage connectivity: OK")
-        except Exception as e:
-            warnings.append({"storage_warning": str(e)})
-            logging.warning(f"Firebase Storage not available: {e}")
+        storage_ok = fs_ok
     else:
         warnings.append({"storage_warning": "FIREBASE_STORAGE_BUCKET not set"})
         logging.warning("Firebase Storage not configured")
@@ -280,8 +371,10 @@ def startup_checks():
         "errors": errors,
     }
     
+    diagnostics["boot_ms"] = round((time.time() - boot_start) * 1000, 2)
+
     # Log comprehensive startup diagnostics
-    logging.info(json.dumps({"startup_diagnostics": diagnostics}))
+    log_event("startup_diagnostics", **diagnostics)
     
     # Only exit if there are truly fatal errors (required env vars missing)
     # NOTE: REQUIRED_ENV_VARS is currently empty to support maximum graceful degradation.
@@ -301,8 +394,10 @@ async def verify_firebase_token(request: Request):
     if not auth or not auth.startswith("Bearer "):
         raise HTTPException(status_code=401, detail="Missing Authorization header")
     id_token = auth.split(" ", 1)[1]
+    from firebase_admin import auth as firebase_auth
     try:
-        decoded = firebase_auth.verify_id_token(id_token)
+        with tracing.span("auth.verify_token"):
+            decoded = firebase_auth.verify_id_token(id_token)
     except Exception:
         raise HTTPException(status_code=401, detail="Invalid Firebase ID token")
     user = {
@@ -315,60 +410,119 @@ async def verify_firebase_token(request: Request):
     return user
 
 
+# Tool invocations act on behalf of the user (quota, chats, media jobs), so they require a Firebase token;
+# /tools/health only reports availability and stays public like /health
+app.include_router(tools_router, dependencies=[Depends(verify_firebase_token)])
+app.include_router(tools_public_router)
+
+
 def make_error(code: str, message: str):
     return {"ok": False, "error": {"code": code, "message": message}}
 
 
 def log_info(uid: Optional[str], request_id: Optional[str], msg: str, **kwargs):
-    base = {"uid": uid, "request_id": request_id}
-    base.update(kwargs)
-    logging.info(f"{msg} | %s", base)
+    log_event(msg, uid=uid, request_id=request_id, **kwargs)
 
 
-@app.get("/health")
-async def health():
-    """
-    Health check endpoint that reports status of all services and dependencies.
-    Returns 200 OK even if some services are unavailable, with details about each service.
+def _spawn_background(coro, kind: str = "background"):
+    """Run a coroutine off the request's critical path; the task registry drains it on shutdown."""
+    return registry.spawn(coro, kind)
+
+
+async def _traced(name: str, coro, **attributes):
+    """Await `coro` inside a span, so a background job's work is traced under the request that started it."""
+    with tracing.span(name, **attributes):
+        return await coro
+
+
+def _mark_interrupted(uid: str, request_id: str, msg_ref, **fields):
+    """Record a generation cut off by worker shutdown and release the user's active-request lock."""
+    fs = get_fs()
+    msg_ref.update({"status": "error", "error": "interrupted", "updatedAt": server_timestamp(), **fields})
+    fs.collection("users").document(uid).collection("requests").document(request_id).update({"status": "interrupted", "updatedAt": server_timestamp()})
+    fs.collection("users").document(uid).collection("meta").document("state").set({"active_request_id": None, "active_assistant_msg_id": None}, merge=True)
+
+
+def _index_history(method: str, uid: str, *args):
+    """Apply an incremental update to the user's history search index off the request path.
+
+    Users without a local index on this host are skipped; searches build the index, and catch up on
+    writes that reached Firestore through other workers, before querying it.
     """
-    checks = {"firestore": False, "storage": False, "gemini": False, "nano_banana": False, "veo": False, "tavily": False}
-    missing_env_vars = []
-    
-    # Check environment variables
-    for var in OPTIONAL_ENV_VARS:
-        if not os.getenv(var):
-            missing_env_vars.append(var)
-    
-    # Firestore
+    from .history_index import HISTORY_SEARCH_ENABLED, get_history_index
+    index = get_history_index()
+    if not HISTORY_SEARCH_ENABLED or not index.exists(uid):
+        return
+
+    def apply():
+        try:
+            getattr(index, method)(uid, *args)
+        except Exception as e:
+            logging.warning(f"History index {method} failed: {e}")
+
+    _spawn_background(asyncio.to_thread(apply))
+
+
+@app.on_event("startup")
+async def start_health_prober():
+    prober.start()
+
+
+@app.on_event("shutdown")
+async def drain_work():
+    # uvicorn has stopped accepting connections; stop admitting work, let in-flight streams and jobs
+    # finish and persist, and mark whatever is still running after the window as interrupted
+    stream_admission.close()
+    await registry.shutdown(STREAM_DRAIN_SECONDS)
+
+
+@app.on_event("shutdown")
+async def stop_health_prober():
+    await prober.stop()
+
+
+@app.on_event("shutdown")
+def flush_traces():
+    tracing.flush()
+
+
+@app.on_event("shutdown")
+def stop_image_pool():
     try:
-        from firebase_admin import firestore as _fs
-        _fs.client().collections()
-        checks["firestore"] = True
+        from backend.services.images import shutdown_pool
     except Exception:
-        checks["firestore"] = False
+        from services.images import shutdown_pool
+    shutdown_pool()
 
-    # Storage
+
+@app.on_event("shutdown")
+def stop_document_pool():
     try:
-        bucket_name = os.getenv("FIREBASE_STORAGE_BUCKET")
-        if bucket_name:
-            from firebase_admin import storage as _storage
-            b = _storage.bucket(bucket_name)
-            _ = b.name
-            checks["storage"] = True
+        from backend.services.documents import shutdown_pool
     except Exception:
-        checks["storage"] = False
+        from services.documents import shutdown_pool
+    shutdown_pool()
+
 
-    # External services: presence of API keys
-    checks["gemini"] = bool(os.getenv("GEMINI_API_KEY"))
-    checks["nano_banana"] = bool(os.getenv("NANO_BANANA_API_KEY"))
-    checks["veo"] = bool(os.getenv("VEO_API_KEY"))
-    checks["tavily"] = bool(os.getenv("TAVILY_API_KEY"))
+@app.get("/health")
+async def health():
+    """
+    Health check endpoint that reports status of all services and dependencies.
+    Returns 200 OK even if some services are unavailable, with details about each service.
+    Served from the background prober's last snapshot; it never calls a dependency itself.
+    """
+    snapshot = prober.snapshot()
+    checks = {name: res["ok"] for name, res in snapshot.items()}
+    missing_env_vars = [var for var in OPTIONAL_ENV_VARS if not os.getenv(var)]
 
     ok = all(checks.values())
     
     response = {
         "ok": ok,
         "services": checks,
+        "probes": snapshot,
+        "breakers": breaker_states(),
+        "dependencies": dependency_states(),
     }
     
     # Include missing env vars if any, to help with debugging
@@ -379,6 +533,38 @@ async def health():
     return response
 
 
+@app.get("/health/live")
+async def health_live():
+    """Liveness: the worker's event loop is responsive. Never touches dependencies."""
+    return {"ok": True}
+
+
+@app.get("/health/ready")
+async def health_ready():
+    """Readiness: an initial probe round finished and configured critical dependencies are up."""
+    ready = prober.ready()
+    body = {"ok": ready, "services": {name: res["ok"] for name, res in prober.snapshot().items()}}
+    if not ready:
+        return JSONResponse(status_code=503, content=body)
+    return body
+
+
+@app.get("/metrics")
+async def get_metrics():
+    """Process-local metrics for this worker (latency summaries and counters)."""
+    try:
+        from backend.services.search import search_cache_stats
+    except Exception:
+        from services.search import search_cache_stats
+    from .response_cache import response_cache_stats
+    from .study import study_stats
+    from .attachments import attachment_stats
+    from .coalesce import coalescer
+    from .routing import router
+    from .tools import tools
+    return {"ok": True, "metrics": metrics.snapshot(), "search_cache": search_cache_stats(), "tool_cache": tools.cache.stats(), "study": study_stats(), "attachments": attachment_stats(), "response_cache": response_cache_stats(), "coalescing": coalescer.stats(), "models": router.snapshot(), "streams": stream_admission.stats(), "tasks": registry.stats(), "logging": logging_stats(), "tracing": tracing.stats()}
+
+
 @app.get("/auth/verify")
 async def auth_verify(user=Depends(verify_firebase_token)):
     return {"ok": True, "user": user}
@@ -402,34 +588,143 @@ async def upload_file(file: UploadFile = File(...), user=Depends(verify_firebase
     if not any(ctype.startswith(p) for p in allowed_prefixes):
         return JSONResponse(status_code=400, content=make_error("INVALID_TYPE", "Attachment type not allowed"))
 
-    # store in Firebase Storage if configured
-    bucket_name = os.getenv("FIREBASE_STORAGE_BUCKET")
+    # store via the configured storage backend (Firebase Storage or local disk)
     attachment_id = str(uuid.uuid4())
     storage_path = None
     try:
-        if bucket_name:
-            from firebase_admin import storage
-            bucket = storage.bucket(bucket_name)
-            path = f"attachments/{uid}/{attachment_id}/{file.filename}"
-            blob = bucket.blob(path)
-            blob.upload_from_string(contents, content_type=ctype)
-            storage_path = path
-        else:
-            dest = f"/tmp/{int(time.time())}_{attachment_id}_{file.filename}"
-            with open(dest, "wb") as f:
-                f.write(contents)
-            storage_path = dest
+        stored = await asyncio.to_thread(get_storage().put, f"attachments/{uid}/{attachment_id}/{file.filename}", contents, ctype)
+        storage_path = stored["storagePath"]
     except Exception as e:
         return JSONResponse(status_code=500, content=make_error("STORAGE_ERROR", str(e)))
 
+    # PDFs and text files are parsed now (in the process pool), so chat requests only read the stored chunks
+    from .attachments import extract_attachment
+    try:
+        extraction = await extract_attachment(storage_path, ctype, contents)
+    except Exception as e:
+        logging.warning(f"Attachment extraction failed for {attachment_id}: {e}")
+        extraction = {"status": "failed", "error": str(e)}
+
     # persist metadata in Firestore under users/{uid}/attachments/{attachment_id}
     att_ref = fs.collection("users").document(uid).collection("attachments").document(attachment_id)
-    att_ref.set({"filename": file.filename, "contentType": ctype, "size": size, "storagePath": storage_path, "createdAt": server_timestamp(), "owner": uid})
-    return {"ok": True, "attachment_id": attachment_id}
+    meta = {"filename": file.filename, "contentType": ctype, "size": size, "storagePath": storage_path, "createdAt": server_timestamp(), "owner": uid}
+    if extraction is not None:
+        meta["extraction"] = extraction
+    att_ref.set(meta)
+    return {"ok": True, "attachment_id": attachment_id, "extraction": extraction}
+
+
+def _parse_range(header: Optional[str], size: int):
+    """Parse a single 'bytes=start-end' range. Returns (start, end) inclusive, None for no range,
+    or raises ValueError when the range is not satisfiable."""
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    start_s, _, end_s = header[len("bytes="):].strip().partition("-")
+    if not start_s:
+        # suffix range: last N bytes
+        n = int(end_s)
+        if n <= 0:
+            raise ValueError("unsatisfiable range")
+        return max(0, size - n), size - 1
+    start = int(start_s)
+    end = int(end_s) if end_s else size - 1
+    if start >= size or end < start:
+        raise ValueError("unsatisfiable range")
+    return start, min(end, size - 1)
+
+
+def _content_disposition(disposition: str, filename: str) -> str:
+    """Content-Disposition with an ASCII filename for old clients and the exact name as RFC 5987 filename*."""
+    from urllib.parse import quote
+    import unicodedata
+    fallback = "".join(
+        c if c.isascii() and c.isprintable() and c not in '"\\;' else "_"
+        for c in unicodedata.normalize("NFKD", filename) if not unicodedata.combining(c)
+    ).strip() or "download"
+    return f"{disposition}; filename=\"{fallback}\"; filename*=UTF-8''{quote(filename, safe='')}"
+
+
+def _renders_inline(content_type: str) -> bool:
+    """Whether stored content is safe to display from the API origin: raster images and PDFs.
+
+    Anything else users can upload (text/html, SVG, ...) could run script there, so it is downloaded.
+    """
+    ctype = (content_type or "").split(";")[0].strip().lower()
+    return ctype == "application/pdf" or (ctype.startswith("image/") and ctype != "image/svg+xml")
+
+
+async def _serve_stored(key: str, request: Request, filename: Optional[str] = None):
+    storage = get_storage()
+    st = await asyncio.to_thread(storage.stat, key)
+    if not st:
+        raise HTTPException(status_code=404, detail="Object not found")
+    size, ctype = st["size"], st["contentType"]
+    # nosniff: browsers must not reinterpret an upload as HTML/script whatever its bytes look like
+    headers = {"Accept-Ranges": "bytes", "Cache-Control": "private, max-age=3600", "X-Content-Type-Options": "nosniff"}
+    inline = _renders_inline(ctype)
+    if filename or not inline:
+        headers["Content-Disposition"] = _content_disposition("inline" if inline else "attachment", filename or key.rsplit("/", 1)[-1])
+    try:
+        rng = _parse_range(request.headers.get("range"), size)
+    except ValueError:
+        return Response(status_code=416, headers={"Content-Range": f"bytes */{size}"})
+    if rng is None:
+        path = storage.local_path(key)
+        if path:
+            # FileResponse lets the server use zero-copy file transmission where supported
+            return FileResponse(path, media_type=ctype, headers=headers)
+        headers["Content-Length"] = str(size)
+        return StreamingResponse(storage.stream(key), media_type=ctype, headers=headers)
+    start, end = rng
+    headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    headers["Content-Length"] = str(end - start + 1)
+    return StreamingResponse(storage.stream(key, start, end), status_code=206, media_type=ctype, headers=headers)
+
+
+@app.get("/files/{attachment_id}")
+async def get_file(attachment_id: str, request: Request, user=Depends(verify_firebase_token)):
+    uid = user["uid"]
+    att_ref = get_fs().collection("users").document(uid).collection("attachments").document(attachment_id)
+    doc = await asyncio.to_thread(att_ref.get)
+    if not doc.exists:
+        raise HTTPException(status_code=404, detail="Attachment not found")
+    data = doc.to_dict()
+    return await _serve_stored(data.get("storagePath"), request, filename=data.get("filename"))
+
+
+@app.get("/storage/{key:path}")
+async def get_stored_object(key: str, request: Request):
+    """Serve stored attachments and images, with single-range support.
+
+    Access is granted by a valid signed URL (expires + sig) or by a Firebase token whose uid owns
+    the key (attachments/{uid}/... or images/{uid}/...).
+    """
+    try:
+        from backend.services.storage import verify_signature
+    except Exception:
+        from services.storage import verify_signature
+    if not verify_signature(key, request.query_params.get("expires"), request.query_params.get("sig")):
+        user = await verify_firebase_token(request)
+        parts = key.split("/")
+        if len(parts) < 3 or parts[0] not in ("attachments", "images") or parts[1] != user["uid"]:
+            raise HTTPException(status_code=403, detail="Forbidden")
+    return await _serve_stored(key, request)
+
+
+def get_storage():
+    try:
+        from backend.services.storage import get_storage as _get_storage
+    except Exception:
+        from services.storage import get_storage as _get_storage
+    return _get_storage()
 
 
 def get_fs():
     from firebase_admin import firestore
+    # fail fast while Firestore is known to be down rather than letting every request wait out its timeout
+    dep = get_dependency("firestore")
+    if not dep.available():
+        raise CircuitOpenError("firestore", dep.breaker.retry_after())
     return firestore.client()
 
 
@@ -485,6 +780,7 @@ def check_and_increment_quota(uid: str, kind: str) -> bool:
 
 @app.post("/chat/stream")
 async def chat_stream(request: Request, user=Depends(verify_firebase_token)):
+    request_start = time.time()
     body = await request.json()
     prompt = body.get("message") or body.get("prompt") or ""
     model = body.get("model") or os.getenv("DEFAULT_MODEL", "gemini-2.0-flash")
@@ -510,6 +806,23 @@ async def chat_stream(request: Request, user=Depends(verify_firebase_token)):
     if model not in ALLOWED_MODELS:
         return JSONResponse(status_code=400, content=make_error("MODEL_NOT_ALLOWED", f"Model {model} is not permitted"))
 
+    # per-worker stream cap: raises StreamCapacityError (503 + Retry-After) when full or draining
+    slot = stream_admission.acquire()
+    from .streaming import SSEWriter
+
+    # A duplicate of an in-flight generation (same request_id, or the same prompt from another tab) attaches to
+    # it instead of being rejected or starting a second upstream stream
+    from .coalesce import Broadcast, coalescer, content_key, follow, request_key
+    req_key = request_key(uid, request_id)
+    prompt_key = content_key(uid, chat_id, model, prompt, grounding)
+    shared = coalescer.get(req_key, prompt_key)
+    if shared is not None:
+        metrics.inc("chat_coalesced")
+        log_info(uid, request_id, "coalesced_stream", chat_id=shared.meta.get("chat_id"), message_id=shared.meta.get("message_id"))
+        writer = SSEWriter(request)
+        _spawn_background(writer.pump(slot.track(follow(shared))), "stream")
+        return StreamingResponse(writer.events(), media_type="text/event-stream")
+
     # Use transaction to create chat (if needed), user message, assistant message and register request mapping
     def create_txn(transaction):
         # simple rate-limit: ensure no other active request
@@ -533,7 +846,7 @@ async def chat_stream(request: Request, user=Depends(verify_firebase_token)):
         if req_snap and req_snap.exists:
             # Idempotent: if request already created, reuse mapping
             r = req_snap.to_dict()
-            return {"chat_id": r.get("chat_id"), "assistant_msg_id": r.get("assistant_msg_id"), "user_msg_id": r.get("user_msg_id")}
+            return {"chat_id": r.get("chat_id"), "assistant_msg_id": r.get("assistant_msg_id"), "user_msg_id": r.get("user_msg_id"), "existing": True}
 
         # create or reuse chat
         effective_model = model
@@ -568,23 +881,30 @@ async def chat_stream(request: Request, user=Depends(verify_firebase_token)):
 
         # attachments: validate attachments belong to user
         attachments = []
+        attachment_docs = []
         try:
             req_attach_ids = body.get("attachments") or []
             for aid in req_attach_ids:
                 att_doc = fs.collection("users").document(uid).collection("attachments").document(aid).get()
                 if att_doc.exists:
                     attachments.append(aid)
+                    attachment_docs.append({"id": aid, **att_doc.to_dict()})
         except Exception:
             attachments = []
+            attachment_docs = []
 
-        transaction.set(user_msg_ref, {"role": "user", "content": prompt, "createdAt": server_timestamp(), "status": "done", "attachments": attachments, "grounding": grounding})
-        transaction.set(assistant_msg_ref, {"role": "assistant", "content": "", "createdAt": server_timestamp(), "status": "streaming"})
+        # uid/chatId let /history/sync find the user's changed messages with one collection-group query
+        owner = {"uid": uid, "chatId": chat_ref.id}
+        transaction.set(user_msg_ref, {"role": "user", "content": prompt, "createdAt": server_timestamp(), "updatedAt": server_timestamp(), "status": "done", "attachments": attachments, "grounding": grounding, **owner})
+        transaction.set(assistant_msg_ref, {"role": "assistant", "content": "", "createdAt": server_timestamp(), "updatedAt": server_timestamp(), "status": "streaming", **owner})
 
         # update chat title from first user message if default
+        title = None
         try:
             chat_snap = transaction.get(chat_ref)
             if chat_snap.exists and chat_snap.to_dict().get("title") == "New chat":
-                transaction.update(chat_ref, {"title": prompt[:120], "updatedAt": server_timestamp()})
+                title = prompt[:120]
+                transaction.update(chat_ref, {"title": title, "updatedAt": server_timestamp()})
         except Exception:
             pass
 
@@ -592,19 +912,28 @@ async def chat_stream(request: Request, user=Depends(verify_firebase_token)):
         transaction.set(requests_ref, {"chat_id": chat_ref.id, "user_msg_id": user_msg_id, "assistant_msg_id": assistant_msg_id, "status": "streaming", "createdAt": server_timestamp()})
         transaction.set(meta_ref, {"active_request_id": request_id, "active_assistant_msg_id": assistant_msg_id, "last_stream_at": server_timestamp()}, merge=True)
 
-        return {"chat_id": chat_ref.id, "assistant_msg_id": assistant_msg_id, "user_msg_id": user_msg_id, "effective_model": effective_model}
+        return {"chat_id": chat_ref.id, "assistant_msg_id": assistant_msg_id, "user_msg_id": user_msg_id, "effective_model": effective_model, "title": title, "attachments": attachment_docs}
 
     fs_transaction = fs.transaction()
+    txn_start = time.time()
     try:
-        mapping = fs_transaction.run(create_txn)
+        with tracing.span("chat.create_txn"):
+            mapping = fs_transaction.run(create_txn)
     except HTTPException as he:
+        slot.release()
         return JSONResponse(status_code=429, content=make_error("RATE_LIMIT", str(he.detail)))
     except Exception as e:
+        slot.release()
+        # the hottest Firestore write path also feeds the firestore breaker
+        get_dependency("firestore").record(False)
         return JSONResponse(status_code=500, content=make_error("UNKNOWN", str(e)))
+    get_dependency("firestore").record(True, time.time() - txn_start)
 
     chat_id = mapping["chat_id"]
     assistant_msg_id = mapping["assistant_msg_id"]
     model = mapping.get("effective_model", model)
+    # inherited by the streaming pipeline task, so every line it logs carries these ids
+    bind(uid=uid, request_id=request_id, chat_id=chat_id)
 
     # structured log for stream start
     try:
@@ -615,123 +944,187 @@ async def chat_stream(request: Request, user=Depends(verify_firebase_token)):
     chat_ref = chat_doc_ref(uid, chat_id)
     assistant_msg_ref = chat_ref.collection("messages").document(assistant_msg_id)
 
-    from .chat import _gemini_token_stream
+    from .chat import _gemini_token_stream, _get_genai
+    from .response_cache import CACHEABLE_ROUTES, RESPONSE_CACHE_ENABLED, get_response_cache, replay
+
+    from .routing import router
+    route = {}
+
+    broadcast = Broadcast({"chat_id": chat_id, "message_id": assistant_msg_id})
+    release = coalescer.register(broadcast, req_key, prompt_key)
+
+    trace_id = tracing.current_trace_id()
 
     async def event_generator():
-        # emit meta event so frontend knows authoritative ids
-        meta = f"event: meta\ndata: {{ \"chat_id\": \"{chat_id}\", \"message_id\": \"{assistant_msg_id}\" }}\n\n"
+        # emit meta event so frontend knows authoritative ids (and the trace id to quote in bug reports)
+        meta = f"event: meta\ndata: {{ \"chat_id\": \"{chat_id}\", \"message_id\": \"{assistant_msg_id}\", \"trace_id\": \"{trace_id or ''}\" }}\n\n"
         yield meta
 
-        # If request mapping already exists and is streaming, do not start a new model generation.
-        try:
-            req_doc = fs.collection("users").document(uid).collection("requests").document(request_id).get()
-            if req_doc.exists and req_doc.to_dict().get("status") == "streaming":
-                # Let the client know the message is still generating; don't spawn a duplicate generation.
-                yield f"event: status\ndata: {{\"status\": \"streaming\"}}\n\n"
-                return
-        except Exception:
-            pass
+        # If request mapping already existed (a retried request) and is streaming, do not start a new model generation.
+        # The mapping this request just created is always "streaming", so only pre-existing mappings are checked.
+        if mapping.get("existing"):
+            try:
+                req_doc = fs.collection("users").document(uid).collection("requests").document(request_id).get()
+                status = req_doc.to_dict().get("status") if req_doc.exists else None
+                if status == "streaming":
+                    # Generating in another worker; let the client know and don't spawn a duplicate generation.
+                    yield "event: status\ndata: {\"status\": \"streaming\"}\n\n"
+                    return
+                if status == "done":
+                    # Already answered: replay the stored message instead of generating it again
+                    content = (assistant_msg_ref.get().to_dict() or {}).get("content") or ""
+                    token_payload = content.replace("\n", "\\n")
+                    yield f"event: token\ndata: {{\"text\": \"{token_payload}\"}}\n\n"
+                    yield "event: done\ndata: {}\n\n"
+                    return
+            except Exception:
+                pass
+
+        def fail_request(error: str):
+            # mark this turn failed and release the active-request lock, or the user's next chats get 429
+            try:
+                assistant_msg_ref.update({"status": "error", "error": error, "updatedAt": server_timestamp()})
+                fs.collection("users").document(uid).collection("requests").document(request_id).update({"status": "error", "error": error, "updatedAt": server_timestamp()})
+                meta_ref.set({"active_request_id": None, "active_assistant_msg_id": None}, merge=True)
+            except Exception:
+                pass
 
-        # If grounding requested, perform web search via Tavily, persist grounding results, and inject system context
+        # If grounding requested, run the quota check and the web search concurrently, persist grounding
+        # results in the background, and inject the results as system context
         system_context = None
         try:
             if grounding:
-                # quota
-                allowed = check_and_increment_grounding_quota(uid)
-                if not allowed:
-                    try:
-                        fs.collection("users").document(uid).collection("requests").document(request_id).update({"status": "error", "error": "grounding_quota_exceeded", "updatedAt": server_timestamp()})
-                    except Exception:
-                        pass
-                    yield f"event: error\ndata: {{\"message\": \"Grounded queries quota exceeded\"}}\n\n"
+                search_dep = get_dependency("tavily")
+                if not search_dep.available():
+                    # don't charge grounding quota for a search that would be rejected anyway
+                    fail_request("search_unavailable")
+                    yield f"event: error\ndata: {{\"message\": \"Web search is temporarily unavailable (retry in {search_dep.breaker.retry_after():.0f}s)\"}}\n\n"
                     return
+                yield "event: searching\ndata: {\"status\": \"started\"}\n\n"
 
                 # import local search service
                 try:
-                    from backend.services.search import web_search
+                    from backend.services.search import multi_search
+                    from backend.services.rerank import build_grounding_context
                 except Exception:
-                    from services.search import web_search
+                    from services.search import multi_search
+                    from services.rerank import build_grounding_context
+
+                search_start = time.time()
+                # warm the Gemini SDK (first generation in a worker) while the search is in flight
+                _spawn_background(asyncio.to_thread(_get_genai))
+                quota_task = asyncio.create_task(asyncio.to_thread(check_and_increment_grounding_quota, uid))
+                # long prompts fan out into several sub-queries; quota is still charged once per request
+                search_task = asyncio.create_task(multi_search(prompt))
+
+                # quota
+                allowed = await quota_task
+                if not allowed:
+                    search_task.cancel()
+                    fail_request("grounding_quota_exceeded")
+                    yield "event: error\ndata: {\"message\": \"Grounded queries quota exceeded\"}\n\n"
+                    return
 
                 try:
-                    results = web_search(prompt)
+                    results = await search_task
                 except Exception as e:
                     # surface structured error
-                    try:
-                        fs.collection("users").document(uid).collection("requests").document(request_id).update({"status": "error", "error": str(e), "updatedAt": server_timestamp()})
-                        chat_ref.collection("messages").document(assistant_msg_id).update({"status": "error", "error": str(e), "updatedAt": server_timestamp()})
-                    except Exception:
-                        pass
+                    fail_request(str(e))
                     yield f"event: error\ndata: {{\"message\": \"Grounding failed: {str(e)}\"}}\n\n"
                     return
+                metrics.observe("grounding_search_ms", (time.time() - search_start) * 1000)
+                yield f"event: searching\ndata: {{\"status\": \"done\", \"results\": {len(results)}}}\n\n"
 
                 # store grounding results and citations on assistant message
                 citations = []
                 for r in results:
                     citations.append({"index": r.get("index"), "url": r.get("url"), "title": r.get("title")})
 
-                try:
-                    chat_ref.collection("messages").document(assistant_msg_id).update({"grounding": results, "citations": citations, "status": "streaming", "updatedAt": server_timestamp()})
-                    fs.collection("users").document(uid).collection("requests").document(request_id).update({"grounding": True, "status": "streaming", "updatedAt": server_timestamp()})
-                except Exception:
-                    pass
+                def persist_grounding():
+                    # status is left untouched: this write may land after the stream has finalized
+                    try:
+                        chat_ref.collection("messages").document(assistant_msg_id).update({"grounding": results, "citations": citations, "updatedAt": server_timestamp()})
+                        fs.collection("users").document(uid).collection("requests").document(request_id).update({"grounding": True, "updatedAt": server_timestamp()})
+                    except Exception:
+                        pass
+
+                _spawn_background(asyncio.to_thread(persist_grounding))
 
                 try:
                     log_info(uid, request_id, "start_generation", chat_id=chat_ref.id, model=model, generation_type="grounded")
                 except Exception:
                     pass
 
-                # Build system_context for the model. We include numbered summaries (title + snippet + published_date).
-                lines = ["You have access to the following web search results. Cite sources using [n] markers where n is the index. Use only these sources for factual claims and never invent URLs."]
-                for r in results:
-                    pd = r.get("published_date")
-                    pd_str = f" ({pd})" if pd else ""
-                    lines.append(f"[{r.get('index')}] {r.get('title')}{pd_str}: {r.get('snippet')}")
-                system_context = "\n".join(lines)
+                # Build system_context for the model: numbered summaries (title + snippet + published_date),
+                # best-ranked first, packed into the grounding token budget.
+                system_context = build_grounding_context(results)
 
                 # add headers so middleware logs include generation_type
                 try:
                     request._headers = {**getattr(request, "_headers", {}), "X-Generation-Type": "grounded"}
                 except Exception:
                     pass
-        except Exception:
+        except Exception as e:
             # If anything unexpected happens, surface an error
-            yield f"event: error\ndata: {{\"message\": \"Grounding pipeline failure\"}}\n\n"
+            fail_request(str(e))
+            yield "event: error\ndata: {\"message\": \"Grounding pipeline failure\"}\n\n"
             return
 
+        # inject the attached documents' most relevant extracted chunks next to any grounding context
+        if mapping.get("attachments"):
+            from .attachments import build_context as build_attachment_context
+            try:
+                attachment_context = await build_attachment_context(uid, mapping["attachments"], prompt)
+            except Exception as e:
+                logging.warning(f"Attachment context failed: {e}")
+                attachment_context = None
+            if attachment_context:
+                system_context = f"{system_context}\n\n{attachment_context}" if system_context else attachment_context
+
+        # opt-in response cache for repeated prompts; a hit is replayed through the same SSE/persistence path
+        use_cache = RESPONSE_CACHE_ENABLED and not grounding and body.get("cache", True) is not False and not body.get("attachments")
+        cached = {"text": None, "vector": None}
+        if use_cache:
+            with tracing.span("response_cache.lookup"):
+                cached = await get_response_cache().lookup(model, prompt, system_context)
+            metrics.inc("response_cache_lookups", result="hit" if cached["text"] else "miss", match=cached.get("match"))
+
         update_buffer = ""
+        full_text = []
         last_update = time.time()
+        first_token = True
+        generation_span = first_token_span = tracing.NOOP
         try:
             try:
-                token_stream = _gemini_token_stream(prompt, model, system_context=system_context)
+                if cached["text"]:
+                    log_info(uid, request_id, "response_cache_hit", chat_id=chat_id, model=model, match=cached.get("match"))
+                    token_stream = replay(cached["text"])
+                else:
+                    # the router may pick the fast model by policy or health, and falls back before the first token
+                    token_stream = router.stream(prompt, model, system_context, _gemini_token_stream, route)
             except Exception as e:
-                # mark error
-                try:
-                    assistant_msg_ref.update({"status": "error", "updatedAt": server_timestamp()})
-                    fs.collection("users").document(uid).collection("requests").document(request_id).update({"status": "error", "error": str(e), "updatedAt": server_timestamp()})
-                except Exception:
-                    pass
+                fail_request(str(e))
                 yield f"event: error\ndata: {{\"message\": \"{str(e)}\"}}\n\n"
                 return
 
-            async for token in token_stream:
-                # handle client disconnect
-                try:
-                    if await request.is_disconnected():
-                        # mark aborted
-                        try:
-                            assistant_msg_ref.update({"status": "error", "updatedAt": server_timestamp()})
-                            fs.collection("users").document(uid).collection("requests").document(request_id).update({"status": "error", "error": "client_disconnected", "updatedAt": server_timestamp()})
-                        except Exception:
-                            pass
-                        yield f"event: error\ndata: {{\"message\": \"client disconnected\"}}\n\n"
-                        return
-                except Exception:
-                    pass
+            # the upstream stream runs in its own task so coalesced duplicates can subscribe to it too
+            generation_span = tracing.start_span("gemini.stream", kind="client", model=model, cached=bool(cached["text"]))
+            first_token_span = tracing.start_span("gemini.first_token", kind="client", model=model)
+            with tracing.use_span(generation_span):
+                broadcast.run(token_stream)
+            # client disconnects are handled by the SSE writer: generation and persistence carry on so the
+            # answer completes in history even if nobody is reading the stream any more
+            async for token in broadcast.subscribe():
+                if first_token:
+                    first_token = False
+                    first_token_span.end()
+                    metrics.observe("chat_ttft_ms", (time.time() - request_start) * 1000, generation_type="grounded" if grounding else "text", model=route.get("model", model), cached=bool(cached["text"]))
 
                 token_payload = token.replace("\n", "\\n")
                 yield f"event: token\ndata: {{\"text\": \"{token_payload}\"}}\n\n"
 
                 update_buffer += token
+                full_text.append(token)
 
                 if time.time() - last_update > (STREAM_UPDATE_INTERVAL_MS / 1000.0):
                     # atomically append buffered content
@@ -741,18 +1134,22 @@ async def chat_stream(request: Request, user=Depends(verify_firebase_token)):
                         if doc and doc.exists:
                             cur = doc.to_dict().get("content", "") or ""
                         transaction.update(assistant_msg_ref, {"content": cur + update_buffer, "updatedAt": server_timestamp()})
-                    try:
-                        fs.transaction().run(append_txn)
-                    except Exception:
-                        # best-effort fallback
+                    with tracing.span("chat.flush", chars=len(update_buffer)):
                         try:
-                            cur = assistant_msg_ref.get().to_dict().get("content", "")
-                            assistant_msg_ref.update({"content": cur + update_buffer, "updatedAt": server_timestamp()})
+                            fs.transaction().run(append_txn)
                         except Exception:
-                            pass
+                            # best-effort fallback
+                            try:
+                                cur = assistant_msg_ref.get().to_dict().get("content", "")
+                                assistant_msg_ref.update({"content": cur + update_buffer, "updatedAt": server_timestamp()})
+                            except Exception:
+                                pass
                     update_buffer = ""
                     last_update = time.time()
 
+            generation_span.set_attribute("route.model", route.get("model"))
+            generation_span.end()
+
             # flush remaining
             if update_buffer:
                 try:
@@ -773,19 +1170,52 @@ async def chat_stream(request: Request, user=Depends(verify_firebase_token)):
             # finalize
             try:
                 def finalize_tx(transaction):
-                    transaction.update(assistant_msg_ref, {"status": "done", "updatedAt": server_timestamp()})
+                    done = {"status": "done", "updatedAt": server_timestamp()}
+                    if route.get("model"):
+                        done["model"] = route["model"]
+                    if cached["text"]:
+                        done["cached"] = True
+                    transaction.update(assistant_msg_ref, done)
                     transaction.update(chat_ref, {"updatedAt": server_timestamp()})
                     transaction.update(fs.collection("users").document(uid).collection("requests").document(request_id), {"status": "done", "updatedAt": server_timestamp()})
                     transaction.set(meta_ref, {"active_request_id": None, "active_assistant_msg_id": None}, merge=True)
-                fs.transaction().run(finalize_tx)
+                with tracing.span("chat.finalize"):
+                    fs.transaction().run(finalize_tx)
             except Exception:
                 try:
                     assistant_msg_ref.update({"status": "done", "updatedAt": server_timestamp()})
                 except Exception:
                     pass
 
+            if writer.disconnected:
+                log_info(uid, request_id, "stream_completed_after_disconnect", chat_id=chat_id)
+            if use_cache and not cached["text"] and route.get("reason", "requested") in CACHEABLE_ROUTES:
+                # same key as the lookup (the requested model)
+                get_response_cache().store(model, prompt, system_context, "".join(full_text), cached["vector"])
+            if mapping.get("title"):
+                _index_history("upsert_chat", uid, chat_id, mapping["title"])
+            _index_history("upsert_message", uid, chat_id, mapping["user_msg_id"], prompt, "user")
+            _index_history("upsert_message", uid, chat_id, assistant_msg_id, "".join(full_text), "assistant")
+
             yield "event: done\ndata: {}\n\n"
+        except asyncio.CancelledError:
+            # the worker is shutting down and the drain window ran out: keep what was generated so far
+            first_token_span.end()
+            generation_span.set_attribute("interrupted", True)
+            generation_span.end()
+            try:
+                if update_buffer:
+                    cur = (assistant_msg_ref.get().to_dict() or {}).get("content", "") or ""
+                    assistant_msg_ref.update({"content": cur + update_buffer})
+                _mark_interrupted(uid, request_id, assistant_msg_ref)
+                log_info(uid, request_id, "stream_interrupted", chat_id=chat_id, chars=len("".join(full_text)))
+            except Exception:
+                pass
+            raise
         except Exception as e:
+            first_token_span.end()
+            generation_span.record_exception(e)
+            generation_span.end()
             try:
                 assistant_msg_ref.update({"status": "error", "updatedAt": server_timestamp()})
                 fs.collection("users").document(uid).collection("requests").document(request_id).update({"status": "error", "error": str(e), "updatedAt": server_timestamp()})
@@ -794,22 +1224,122 @@ async def chat_stream(request: Request, user=Depends(verify_firebase_token)):
                 pass
             yield f"event: error\ndata: {{\"message\": \"{str(e)}\"}}\n\n"
 
-    return StreamingResponse(event_generator(), media_type="text/event-stream")
+    async def shared_generator():
+        try:
+            async for event in event_generator():
+                yield event
+        finally:
+            release()
+            if not broadcast.done:
+                # ended before or without an upstream stream (quota, grounding failure): release any followers
+                try:
+                    await broadcast.finish("generation ended")
+                except Exception:
+                    pass
+
+    # the pipeline runs as its own task and never waits on the client; the response drains the writer
+    writer = SSEWriter(request)
+    _spawn_background(_traced("chat.pipeline", writer.pump(slot.track(shared_generator())), model=model, grounding=grounding), "stream")
+    return StreamingResponse(writer.events(), media_type="text/event-stream")
+
+
+async def _store_media(storage, key: str, content: bytes, content_type: str, fallback_url: Optional[str] = None) -> dict:
+    """Store generated media; returns {"url", "storagePath"}, falling back to the remote URL on failure."""
+    try:
+        with tracing.span("storage.put", kind="client", size=len(content)):
+            obj = await asyncio.to_thread(storage.put, key, content, content_type)
+    except Exception:
+        return {"url": fallback_url, "storagePath": None}
+    public_url = obj["url"]
+    if storage.local_path(key) is not None:
+        # <img> cannot send a token: local objects need a signed URL, else keep the remote URL
+        try:
+            public_url = storage.signed_url(key, expires_in=MEDIA_RETENTION_DAYS * 86400)
+        except Exception:
+            public_url = fallback_url or public_url
+    return {"url": public_url, "storagePath": obj["storagePath"]}
+
+
+async def _attach_image_variants(msg_ref, images: list, originals: list):
+    """Generate thumbnail/web variants in the process pool, store them and record them on the message's images."""
+    storage = get_storage()
+    changed = False
+    for entry, content in zip(images, originals):
+        if not entry.get("storagePath"):
+            continue
+        result = await generate_derivatives(content)
+        entry["width"], entry["height"] = result["width"], result["height"]
+        variants = []
+        for v in result["variants"]:
+            key = f"{entry['storagePath'].rsplit('.', 1)[0]}_{v['name']}.{extension_for(v['contentType'])}"
+            obj = await _store_media(storage, key, v["data"], v["contentType"])
+            if not obj["storagePath"]:
+                continue
+            variants.append({"name": v["name"], "contentType": v["contentType"], "width": v["width"], "height": v["height"], "size": v["size"], "url": obj["url"], "storagePath": obj["storagePath"]})
+        entry["variants"] = variants
+        changed = True
+    if changed:
+        try:
+            msg_ref.update({"images": images, "updatedAt": server_timestamp()})
+        except Exception:
+            pass
+
+
+@app.get("/images/{chat_id}/{message_id}/{index}")
+async def get_image(chat_id: str, message_id: str, index: int, request: Request, w: Optional[int] = None, user=Depends(verify_firebase_token)):
+    """Serve the smallest stored rendition of a generated image that covers width `w` in a format the client accepts."""
+    snap = await asyncio.to_thread(message_doc_ref(user["uid"], chat_id, message_id).get)
+    if not snap.exists:
+        raise HTTPException(status_code=404, detail="Message not found")
+    images = snap.to_dict().get("images") or []
+    if index < 0 or index >= len(images):
+        raise HTTPException(status_code=404, detail="Image not found")
+    chosen = pick_variant(images[index], width=w, accept=request.headers.get("accept"))
+    if not chosen.get("storagePath"):
+        raise HTTPException(status_code=404, detail="Image not stored")
+    resp = await _serve_stored(chosen["storagePath"], request)
+    resp.headers["Vary"] = "Accept"
+    return resp
 
 
 @app.post("/image/generate")
 async def image_generate(request: Request, user=Depends(verify_firebase_token)):
-    body = await request.json()
+    return await start_image_job(user["uid"], await request.json())
+
+
+async def start_image_job(uid: str, body: dict) -> JSONResponse:
+    """Create the assistant image message and generate it in the background (also used by the image tool)."""
+    # a draining worker would have to abandon the job; let the client retry on another one
+    registry.check_accepting()
     prompt = body.get("prompt")
     chat_id = body.get("chat_id")
     request_id = body.get("request_id") or str(uuid.uuid4())
     model = body.get("model") or os.getenv("DEFAULT_MODEL", "gemini-2.0-flash")
-    uid = user["uid"]
     fs = get_fs()
 
     if not prompt:
         return JSONResponse(status_code=400, content=make_error("INVALID_INPUT", "prompt required"))
 
+    image_dep = get_dependency("nano_banana")
+    if not image_dep.available():
+        raise CircuitOpenError("nano_banana", image_dep.breaker.retry_after())
+
+    # duplicate calls with the same request_id share the first one's generation (and quota charge)
+    from .coalesce import Broadcast, coalescer, request_key
+    req_key = request_key(uid, request_id)
+    shared = coalescer.get(req_key)
+    if shared is not None:
+        metrics.inc("image_coalesced")
+        return JSONResponse({"ok": True, **shared.meta, "deduplicated": True})
+    try:
+        req_snap = fs.collection("users").document(uid).collection("requests").document(request_id).get()
+        if req_snap.exists and req_snap.to_dict().get("type") == "image":
+            r = req_snap.to_dict()
+            metrics.inc("image_coalesced")
+            return JSONResponse({"ok": True, "chat_id": r.get("chat_id"), "message_id": r.get("assistant_msg_id"), "status": r.get("status"), "deduplicated": True})
+    except Exception:
+        pass
+
     # quota
     allowed = check_and_increment_quota(uid, "images")
     if not allowed:
@@ -829,20 +1359,19 @@ async def image_generate(request: Request, user=Depends(verify_firebase_token)):
     try:
         def create_tx(tx):
             if tx.get(assistant_msg_ref).exists:
-                return
-            tx.set(assistant_msg_ref, {"role": "assistant", "content": "", "type": "image", "images": [], "createdAt": server_timestamp(), "status": "generating", "model": model})
+                return False
+            tx.set(assistant_msg_ref, {"role": "assistant", "content": "", "type": "image", "images": [], "mediaExpired": False, "createdAt": server_timestamp(), "updatedAt": server_timestamp(), "status": "generating", "model": model, "uid": uid, "chatId": chat_ref.id})
             tx.set(fs.collection("users").document(uid).collection("requests").document(request_id), {"chat_id": chat_ref.id, "assistant_msg_id": assistant_msg_id, "type": "image", "status": "generating", "createdAt": server_timestamp()})
             tx.set(fs.collection("users").document(uid).collection("meta").document("state"), {"active_request_id": request_id, "active_assistant_msg_id": assistant_msg_id}, merge=True)
-        fs.transaction().run(create_tx)
+            return True
+        created = fs.transaction().run(create_tx)
     except Exception as e:
         return JSONResponse(status_code=500, content=make_error("UNKNOWN", str(e)))
+    if not created:
+        # another worker won the race for this request_id and is already generating
+        return JSONResponse({"ok": True, "chat_id": chat_ref.id, "message_id": assistant_msg_id, "deduplicated": True})
 
-    # structured log for video generation request
-    try:
-        log_info(uid, request_id, "start_generation", chat_id=chat_ref.id, model=model, generation_type="video", job_id=job_id)
-    except Exception:
-        pass
-
+    bind(uid=uid, request_id=request_id, chat_id=chat_ref.id)
     # structured log for image generation request
     try:
         log_info(uid, request_id, "start_generation", chat_id=chat_ref.id, model=model, generation_type="image")
@@ -851,78 +1380,96 @@ async def image_generate(request: Request, user=Depends(verify_firebase_token)):
 
     # background task to call Nano Banana and store results
     async def bg():
+        done = False
         try:
             api_key = os.getenv("NANO_BANANA_API_KEY")
             if not api_key:
                 raise RuntimeError("NANO_BANANA_API_KEY not configured")
-            # call external API (pseudo)
+            # call external API (pseudo); blocking HTTP runs in a worker thread under the dependency's
+            # breaker, bulkhead and adaptive timeout
             import requests
             nb_url = os.getenv("NANO_BANANA_ENDPOINT", "https://api.nanobanana.example/generate")
-            r = requests.post(nb_url, json={"prompt": prompt, "model": model}, headers={"Authorization": f"Bearer {api_key}"}, timeout=120)
-            if r.status_code != 200:
-                raise RuntimeError(f"nanobanana error: {r.status_code}")
+            async with image_dep.slot():
+                with tracing.span("nano_banana.generate", kind="client", model=model):
+                    r = await asyncio.to_thread(requests.post, nb_url, json={"prompt": prompt, "model": model}, headers={"Authorization": f"Bearer {api_key}"}, timeout=image_dep.timeout())
+                if r.status_code != 200:
+                    raise RuntimeError(f"nanobanana error: {r.status_code}")
             data = r.json()
             # data expected: {images: [{url: ...}, ...]}
             imgs = data.get("images") or []
             stored = []
-            bucket_name = os.getenv("FIREBASE_STORAGE_BUCKET")
+            originals = []
+            storage = get_storage()
             for it in imgs:
                 url = it.get("url")
                 # fetch remote bytes
-                rr = requests.get(url, timeout=60)
+                with tracing.span("image.fetch", kind="client"):
+                    rr = await asyncio.to_thread(requests.get, url, timeout=60)
                 if rr.status_code != 200:
                     continue
                 content = rr.content
                 if len(content) > MAX_IMAGE_SIZE_BYTES:
                     continue
-                filename = f"images/{uid}/{assistant_msg_id}/{str(uuid.uuid4())}.jpg"
-                try:
-                    if bucket_name:
-                        from firebase_admin import storage
-                        bucket = storage.bucket(bucket_name)
-                        blob = bucket.blob(filename)
-                        blob.upload_from_string(content, content_type=rr.headers.get('Content-Type', 'image/jpeg'))
-                        storage_path = filename
-                        public_url = blob.public_url
-                    else:
-                        dest = f"/tmp/{int(time.time())}_{uuid.uuid4()}.jpg"
-                        with open(dest, "wb") as f:
-                            f.write(content)
-                        storage_path = dest
-                        public_url = url
-                except Exception:
-                    storage_path = None
-                    public_url = url
-                stored.append({"url": public_url, "storagePath": storage_path, "size": len(content)})
+                ctype = sniff_content_type(content, rr.headers.get('Content-Type'))
+                image_id = str(uuid.uuid4())
+                filename = f"images/{uid}/{assistant_msg_id}/{image_id}.{extension_for(ctype)}"
+                obj = await _store_media(storage, filename, content, ctype, fallback_url=url)
+                stored.append({"id": image_id, "url": obj["url"], "storagePath": obj["storagePath"], "size": len(content), "contentType": ctype})
+                originals.append(content)
 
             # update message
             chat_ref.collection("messages").document(assistant_msg_id).update({"images": stored, "status": "done", "updatedAt": server_timestamp()})
             fs.collection("users").document(uid).collection("requests").document(request_id).update({"status": "done", "updatedAt": server_timestamp()})
             fs.collection("users").document(uid).collection("meta").document("state").set({"active_request_id": None, "active_assistant_msg_id": None}, merge=True)
+            done = True
+
+            # thumbnails and web variants are added after the message is done so they never delay it
+            with tracing.span("image.variants", images=len(stored)):
+                await _attach_image_variants(chat_ref.collection("messages").document(assistant_msg_id), stored, originals)
+        except asyncio.CancelledError:
+            try:
+                if not done:
+                    _mark_interrupted(uid, request_id, chat_ref.collection("messages").document(assistant_msg_id))
+            except Exception:
+                pass
+            raise
         except Exception as e:
             try:
                 chat_ref.collection("messages").document(assistant_msg_id).update({"status": "error", "error": str(e), "updatedAt": server_timestamp()})
                 fs.collection("users").document(uid).collection("requests").document(request_id).update({"status": "error", "error": str(e), "updatedAt": server_timestamp()})
+                fs.collection("users").document(uid).collection("meta").document("state").set({"active_request_id": None, "active_assistant_msg_id": None}, merge=True)
             except Exception:
                 pass
 
-    asyncio.create_task(bg())
+    broadcast = Broadcast({"chat_id": chat_ref.id, "message_id": assistant_msg_id})
+    release = coalescer.register(broadcast, req_key)
+    task = broadcast.track(_spawn_background(_traced("image.generate", bg(), model=model), "image"))
+    task.add_done_callback(lambda _: release())
     return JSONResponse({"ok": True, "chat_id": chat_ref.id, "message_id": assistant_msg_id})
 
 
 @app.post("/video/generate")
 async def video_generate(request: Request, user=Depends(verify_firebase_token)):
-    body = await request.json()
+    return await start_video_job(user["uid"], await request.json())
+
+
+async def start_video_job(uid: str, body: dict) -> JSONResponse:
+    """Create the video job and submit/poll it in the background (also used by the video tool)."""
+    # a draining worker would have to abandon the job; let the client retry on another one
+    registry.check_accepting()
     prompt = body.get("prompt")
     chat_id = body.get("chat_id")
     request_id = body.get("request_id") or str(uuid.uuid4())
     model = body.get("model") or os.getenv("DEFAULT_MODEL", "gemini-2.0-flash")
-    uid = user["uid"]
     fs = get_fs()
 
     if not prompt:
         return JSONResponse(status_code=400, content=make_error("INVALID_INPUT", "prompt required"))
 
+    video_dep = get_dependency("veo")
+    if not video_dep.available():
+        raise CircuitOpenError("veo", video_dep.breaker.retry_after())
+
     # quota
     allowed = check_and_increment_quota(uid, "videos")
     if not allowed:
@@ -944,14 +1491,23 @@ async def video_generate(request: Request, user=Depends(verify_firebase_token)):
         def create_tx(tx):
             if tx.get(assistant_msg_ref).exists:
                 return
-            tx.set(assistant_msg_ref, {"role": "assistant", "content": "", "type": "video", "video": {"job_id": job_id, "status": "queued"}, "createdAt": server_timestamp(), "status": "queued", "model": model})
+            tx.set(assistant_msg_ref, {"role": "assistant", "content": "", "type": "video", "video": {"job_id": job_id, "status": "queued"}, "createdAt": server_timestamp(), "updatedAt": server_timestamp(), "status": "queued", "model": model, "uid": uid, "chatId": chat_ref.id})
             tx.set(fs.collection("users").document(uid).collection("video_jobs").document(job_id), {"prompt": prompt, "status": "queued", "createdAt": server_timestamp(), "request_id": request_id, "chat_id": chat_ref.id, "assistant_msg_id": assistant_msg_id})
             tx.set(fs.collection("users").document(uid).collection("requests").document(request_id), {"chat_id": chat_ref.id, "assistant_msg_id": assistant_msg_id, "type": "video", "status": "queued", "job_id": job_id, "createdAt": server_timestamp()})
         fs.transaction().run(create_tx)
     except Exception as e:
         return JSONResponse(status_code=500, content=make_error("UNKNOWN", str(e)))
 
+    bind(uid=uid, request_id=request_id, chat_id=chat_ref.id)
+    # structured log for video generation request
+    try:
+        log_info(uid, request_id, "start_generation", chat_id=chat_ref.id, model=model, generation_type="video", job_id=job_id)
+    except Exception:
+        pass
+
     # start background submission to Veo
+    submitted = {}
+
     async def bg():
         try:
             api_key = os.getenv("VEO_API_KEY")
@@ -959,20 +1515,32 @@ async def video_generate(request: Request, user=Depends(verify_firebase_token)):
                 raise RuntimeError("VEO_API_KEY not configured")
             import requests
             veo_endpoint = os.getenv("VEO_ENDPOINT", "https://api.veo.example/jobs")
-            r = requests.post(veo_endpoint, json={"prompt": prompt, "model": model}, headers={"Authorization": f"Bearer {api_key}"}, timeout=30)
-            if r.status_code != 200:
-                raise RuntimeError(f"veo submit error: {r.status_code}")
+            async with video_dep.slot():
+                with tracing.span("veo.submit", kind="client", model=model):
+                    r = await asyncio.to_thread(requests.post, veo_endpoint, json={"prompt": prompt, "model": model}, headers={"Authorization": f"Bearer {api_key}"}, timeout=video_dep.timeout())
+                if r.status_code != 200:
+                    raise RuntimeError(f"veo submit error: {r.status_code}")
             res = r.json()
             external_job_id = res.get("job_id")
+            submitted["external_job_id"] = external_job_id
             # update job doc
             job_ref = fs.collection("users").document(uid).collection("video_jobs").document(job_id)
             job_ref.update({"external_job_id": external_job_id, "status": "generating", "updatedAt": server_timestamp()})
             # poll status until done/error
             status = "generating"
             video_url = None
+            deadline = time.time() + VIDEO_MAX_WAIT_SECONDS
             while status == "generating":
+                if time.time() > deadline:
+                    status = "error"
+                    break
                 try:
-                    poll = requests.get(f"{veo_endpoint}/{external_job_id}", headers={"Authorization": f"Bearer {api_key}"}, timeout=30)
+                    # polls fail fast while the breaker is open and are retried after the sleep below
+                    async with video_dep.slot():
+                        with tracing.span("veo.poll", kind="client"):
+                            poll = await asyncio.to_thread(requests.get, f"{veo_endpoint}/{external_job_id}", headers={"Authorization": f"Bearer {api_key}"}, timeout=video_dep.timeout())
+                        if poll.status_code >= 500:
+                            raise RuntimeError(f"veo poll error: {poll.status_code}")
                     if poll.status_code != 200:
                         status = "error"
                         break
@@ -1001,6 +1569,15 @@ async def video_generate(request: Request, user=Depends(verify_firebase_token)):
                 job_ref.update({"status": "error", "updatedAt": server_timestamp()})
                 chat_ref.collection("messages").document(assistant_msg_id).update({"video": {"status": "error"}, "status": "error", "updatedAt": server_timestamp()})
                 fs.collection("users").document(uid).collection("requests").document(request_id).update({"status": "error", "updatedAt": server_timestamp()})
+        except asyncio.CancelledError:
+            # the provider keeps rendering a submitted job; record it so polling can be resumed later
+            try:
+                resumable = bool(submitted.get("external_job_id"))
+                fs.collection("users").document(uid).collection("video_jobs").document(job_id).update({"status": "interrupted", "resumable": resumable, "updatedAt": server_timestamp()})
+                _mark_interrupted(uid, request_id, chat_ref.collection("messages").document(assistant_msg_id), resumable=resumable)
+            except Exception:
+                pass
+            raise
         except Exception as e:
             try:
                 fs.collection("users").document(uid).collection("video_jobs").document(job_id).update({"status": "error", "error": str(e), "updatedAt": server_timestamp()})
@@ -1008,7 +1585,7 @@ async def video_generate(request: Request, user=Depends(verify_firebase_token)):
             except Exception:
                 pass
 
-    asyncio.create_task(bg())
+    _spawn_background(_traced("video.generate", bg(), model=model, job_id=job_id), "video")
     return JSONResponse({"ok": True, "job_id": job_id, "chat_id": chat_ref.id, "message_id": assistant_msg_id})
 
 
@@ -1038,17 +1615,17 @@ async def history_list(user=Depends(verify_firebase_token)):
     return {"ok": True, "conversations": out}
 
 
+def _chat_summary(d) -> dict:
+    data = d.to_dict()
+    return {"id": d.id, "title": data.get("title"), "model": data.get("model"), "pinned": data.get("pinned", False), "createdAt": data.get("createdAt"), "updatedAt": data.get("updatedAt")}
+
+
 @app.get("/history/chats")
 async def get_chats(user=Depends(verify_firebase_token)):
     uid = user["uid"]
     fs = get_fs()
     chats_q = fs.collection("users").document(uid).collection("chats").order_by("updatedAt", direction="DESCENDING")
-    docs = chats_q.stream()
-    out = []
-    for d in docs:
-        data = d.to_dict()
-        out.append({"id": d.id, "title": data.get("title"), "model": data.get("model"), "pinned": data.get("pinned", False), "createdAt": data.get("createdAt"), "updatedAt": data.get("updatedAt")})
-    return {"ok": True, "chats": out}
+    return {"ok": True, "chats": [_chat_summary(d) for d in chats_q.stream()]}
 
 
 @app.post("/history/chats")
@@ -1060,6 +1637,7 @@ async def create_chat(request: Request, user=Depends(verify_firebase_token)):
     fs = get_fs()
     chat_ref = fs.collection("users").document(uid).collection("chats").document()
     chat_ref.set({"title": title, "model": model, "createdAt": server_timestamp(), "updatedAt": server_timestamp(), "pinned": False})
+    _index_history("upsert_chat", uid, chat_ref.id, title)
     return {"ok": True, "chat_id": chat_ref.id}
 
 
@@ -1077,6 +1655,102 @@ async def get_chat(chat_id: str, user=Depends(verify_firebase_token)):
     return {"ok": True, "chat": {"id": chat_id, **chat_data}, "messages": msgs}
 
 
+@app.get("/history/sync")
+async def sync_history(cursor: Optional[str] = None, user=Depends(verify_firebase_token)):
+    """Chats, messages and chat deletions changed since `cursor`, oldest first.
+
+    Without a cursor nothing is returned but a fresh one and `reset: true`; the client loads the full
+    state (e.g. /bootstrap, which also hands out a cursor) and syncs from there. Keep calling with the
+    returned cursor while `has_more` is true.
+    """
+    from .sync import HistorySync, InvalidCursor, fresh_cursor
+    if not cursor:
+        return {"ok": True, "reset": True, "cursor": fresh_cursor(), "chats": [], "messages": [], "deleted": [], "has_more": False}
+    uid = user["uid"]
+    started = time.time()
+    try:
+        page = await asyncio.to_thread(HistorySync(get_fs(), uid).changes, cursor)
+    except InvalidCursor as e:
+        return JSONResponse(status_code=400, content=make_error("INVALID_CURSOR", str(e)))
+    metrics.observe("history_sync_ms", (time.time() - started) * 1000)
+    metrics.observe("history_sync_changes", len(page["chats"]) + len(page["messages"]) + len(page["deleted"]))
+    return {"ok": True, **page}
+
+
+# uid -> the running history index backfill, so concurrent searches start at most one per user
+_history_backfills: Dict[str, asyncio.Task] = {}
+
+
+def _start_history_backfill(uid: str):
+    """Rebuild a user's history index off the request path; the task registry drains it on shutdown."""
+    from .history_index import get_history_index
+    task = _history_backfills.get(uid)
+    if task is not None and not task.done():
+        return task
+
+    async def run():
+        started = time.time()
+        try:
+            rows = await asyncio.to_thread(get_history_index().backfill, uid, get_fs())
+            log_info(uid, None, "history_index_backfill", rows=rows, ms=round((time.time() - started) * 1000, 1))
+        finally:
+            _history_backfills.pop(uid, None)
+
+    task = _history_backfills[uid] = _spawn_background(run(), "history_backfill")
+    return task
+
+
+@app.get("/history/search")
+async def search_history(q: str, limit: int = 20, offset: int = 0, user=Depends(verify_firebase_token)):
+    """Full-text search over the caller's chat titles and messages, best matches first.
+
+    The first search on a host builds the user's index in the background and answers 202 with
+    `"indexing": true` and no results; while an existing index is being rebuilt its (possibly
+    stale) results are returned, also flagged `"indexing": true`.
+    """
+    from .history_index import HISTORY_SEARCH_ENABLED, get_history_index
+    if not HISTORY_SEARCH_ENABLED:
+        return JSONResponse(status_code=404, content=make_error("DISABLED", "History search is disabled"))
+    uid = user["uid"]
+    index = get_history_index()
+    started = time.time()
+    # catch up on writes handled elsewhere; a full backfill never runs on the request
+    try:
+        synced = await asyncio.to_thread(index.catch_up, uid, get_fs())
+        if synced["action"] == "sync":
+            log_info(uid, None, "history_index_sync", rows=synced["rows"], ms=round((time.time() - started) * 1000, 1))
+    except Exception as e:
+        return JSONResponse(status_code=503, content=make_error("INDEX_UNAVAILABLE", str(e)))
+    if synced["action"] == "backfill_pending":
+        _start_history_backfill(uid)
+    indexing = uid in _history_backfills
+    if indexing and not index.exists(uid):
+        took_ms = (time.time() - started) * 1000
+        return JSONResponse(status_code=202, content={"ok": True, "query": q, "results": [], "next_offset": None,
+                                                      "indexing": True, "took_ms": round(took_ms, 2)})
+    page = await asyncio.to_thread(index.search, uid, q, limit, max(0, offset))
+    took_ms = (time.time() - started) * 1000
+    metrics.observe("history_search_ms", took_ms)
+    return {"ok": True, "query": q, **page, "indexing": indexing, "took_ms": round(took_ms, 2)}
+
+
+@app.get("/study/decks")
+async def list_decks(user=Depends(verify_firebase_token)):
+    fs = get_fs()
+    decks_q = fs.collection("users").document(user["uid"]).collection("decks").order_by("createdAt", direction="DESCENDING")
+    decks = [{"id": d.id, **{k: v for k, v in d.to_dict().items() if k != "cards"}} for d in decks_q.stream()]
+    return {"ok": True, "decks": decks}
+
+
+@app.get("/study/decks/{deck_id}")
+async def get_deck(deck_id: str, user=Depends(verify_firebase_token)):
+    fs = get_fs()
+    snap = fs.collection("users").document(user["uid"]).collection("decks").document(deck_id).get()
+    if not snap.exists:
+        raise HTTPException(status_code=404, detail="Deck not found")
+    return {"ok": True, "deck": {"id": deck_id, **snap.to_dict()}}
+
+
 @app.get("/models")
 async def list_models(user=Depends(verify_firebase_token)):
     return {"ok": True, "models": ALLOWED_MODELS}
@@ -1084,37 +1758,47 @@ async def list_models(user=Depends(verify_firebase_token)):
 
 @app.delete("/history/chats/{chat_id}")
 async def delete_chat(chat_id: str, user=Depends(verify_firebase_token)):
+    """Remove the chat from listings immediately and purge its messages and media in the background.
+
+    The response carries the tombstone; poll GET /history/chats/{chat_id}/deletion for progress.
+    Repeating the DELETE restarts the purge, e.g. after a restart interrupted it.
+    """
+    from .deletion import ChatDeleter, start_deletion
     uid = user["uid"]
     fs = get_fs()
-    chat_ref = chat_doc_ref(uid, chat_id)
-    # delete messages in a batch to avoid orphaned docs
     try:
-        batch = fs.batch()
-        msgs = list(chat_ref.collection("messages").stream())
-        for m in msgs:
-            batch.delete(m.reference)
-        batch.delete(chat_ref)
-        batch.commit()
-
-        # reassign active chat in settings if needed
-        settings_ref = fs.collection("users").document(uid).collection("settings").document("meta")
-        try:
-            sdoc = settings_ref.get()
-            last_active = None
-            if sdoc.exists:
-                last_active = sdoc.to_dict().get("lastActiveChat")
-            if last_active == chat_id:
-                # pick newest chat
-                chats_q = fs.collection("users").document(uid).collection("chats").order_by("updatedAt", direction="DESCENDING").limit(1)
-                docs = list(chats_q.stream())
-                new_active = docs[0].id if docs else None
-                settings_ref.set({"lastActiveChat": new_active, "updatedAt": server_timestamp()}, merge=True)
-        except Exception:
-            pass
-
-        return {"ok": True}
+        tombstone = await asyncio.to_thread(start_deletion, fs, uid, chat_id)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to delete chat: {e}")
+    _spawn_background(ChatDeleter(fs, get_storage(), uid, chat_id).run(), "deletion")
+    _index_history("delete_chat", uid, chat_id)
+
+    # reassign active chat in settings if needed
+    settings_ref = fs.collection("users").document(uid).collection("settings").document("meta")
+    try:
+        sdoc = settings_ref.get()
+        last_active = None
+        if sdoc.exists:
+            last_active = sdoc.to_dict().get("lastActiveChat")
+        if last_active == chat_id:
+            # pick newest chat
+            chats_q = fs.collection("users").document(uid).collection("chats").order_by("updatedAt", direction="DESCENDING").limit(1)
+            docs = list(chats_q.stream())
+            new_active = docs[0].id if docs else None
+            settings_ref.set({"lastActiveChat": new_active, "updatedAt": server_timestamp()}, merge=True)
+    except Exception:
+        pass
+
+    return {"ok": True, "tombstone": tombstone}
+
+
+@app.get("/history/chats/{chat_id}/deletion")
+async def chat_deletion_status(chat_id: str, user=Depends(verify_firebase_token)):
+    from .deletion import tombstone_ref
+    snap = await asyncio.to_thread(tombstone_ref(get_fs(), user["uid"], chat_id).get)
+    if not snap.exists:
+        raise HTTPException(status_code=404, detail="No deletion for this chat")
+    return {"ok": True, "deletion": {"chatId": chat_id, **snap.to_dict()}}
 
 
 @app.post("/history/messages")
@@ -1130,8 +1814,10 @@ async def create_message(request: Request, user=Depends(verify_firebase_token)):
     fs = get_fs()
     chat_ref = chat_doc_ref(uid, chat_id)
     msg_ref = chat_ref.collection("messages").document()
-    msg_ref.set({"role": role, "content": content or "", "createdAt": server_timestamp(), "status": status})
+    msg_ref.set({"role": role, "content": content or "", "createdAt": server_timestamp(), "updatedAt": server_timestamp(), "status": status, "uid": uid, "chatId": chat_id})
     chat_ref.update({"updatedAt": server_timestamp()})
+    if content:
+        _index_history("upsert_message", uid, chat_id, msg_ref.id, content, role)
     return {"ok": True, "message_id": msg_ref.id}
 
 
@@ -1149,9 +1835,11 @@ async def patch_message(message_id: str, request: Request, user=Depends(verify_f
     uid = user["uid"]
     msg_ref = message_doc_ref(uid, chat_id, message_id)
     try:
-        msg_ref.update({**updates, "updatedAt": server_timestamp()})
+        msg_ref.update({**updates, "updatedAt": server_timestamp(), "uid": uid, "chatId": chat_id})
     except Exception:
         raise HTTPException(status_code=500, detail="Failed to update message")
+    if "content" in updates:
+        _index_history("upsert_message", uid, chat_id, message_id, updates["content"])
     return {"ok": True}
 
 
@@ -1209,44 +1897,32 @@ async def message_regenerate(message_id: str, request: Request, user=Depends(ver
 
 @app.post("/admin/cleanup")
 async def admin_cleanup(user=Depends(verify_firebase_token)):
+    """Run retention cleanup for the calling user. Operators clean up all users with `python -m app.cleanup`."""
+    from .cleanup import CleanupEngine
     uid = user["uid"]
-    fs = get_fs()
-    now = time.time()
-    cutoff = now - REQUEST_TTL_SECONDS
-    # cleanup requests older than TTL
-    reqs = fs.collection("users").document(uid).collection("requests").stream()
-    deleted = 0
-    for r in reqs:
-        data = r.to_dict()
-        created = data.get("createdAt")
-        try:
-            # created is a Firestore timestamp; compare by seconds since epoch if possible
-            if created and hasattr(created, "timestamp"):
-                ts = created.timestamp()
-            else:
-                ts = now
-        except Exception:
-            ts = now
-        if ts < cutoff:
-            try:
-                r.reference.delete()
-                deleted += 1
-            except Exception:
-                pass
+    engine = CleanupEngine(
+        get_fs(), get_storage(), uid=uid,
+        request_ttl_seconds=REQUEST_TTL_SECONDS, aborted_ttl_seconds=ABORTED_TTL_SECONDS, media_retention_days=MEDIA_RETENTION_DAYS,
+    )
+    try:
+        stats = await asyncio.to_thread(engine.run)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Cleanup failed: {e}")
+    return {"ok": True, "deleted_requests": stats.get("requests", {}).get("deleted", 0), "stats": stats}
+
 
-    # aborts older than ABORTED_TTL_SECONDS: scan messages with status error/streaming and createdAt older
-    # This is best-effort; complex queries may be costly.
-    return {"ok": True, "deleted_requests": deleted}
+def _load_settings(fs, uid: str) -> dict:
+    doc = fs.collection("users").document(uid).collection("settings").document("meta").get()
+    if not doc.exists:
+        return {"theme": "system", "defaultModel": os.getenv("DEFAULT_MODEL", "gemini-2.0-flash")}
+    return doc.to_dict()
 
 
 @app.get("/settings")
 async def get_settings(user=Depends(verify_firebase_token)):
     uid = user["uid"]
     fs = get_fs()
-    doc = fs.collection("users").document(uid).collection("settings").document("meta").get()
-    if not doc.exists:
-        return {"ok": True, "settings": {"theme": "system", "defaultModel": os.getenv("DEFAULT_MODEL", "gemini-2.0-flash")}}
-    return {"ok": True, "settings": doc.to_dict()}
+    return {"ok": True, "settings": _load_settings(fs, uid)}
 
 
 @app.patch("/settings")
@@ -1262,3 +1938,63 @@ async def patch_settings(request: Request, user=Depends(verify_firebase_token)):
     updates["updatedAt"] = server_timestamp()
     settings_ref.set(updates, merge=True)
     return {"ok": True, "settings": updates}
+
+
+@app.get("/bootstrap")
+async def bootstrap(chat_id: Optional[str] = None, user=Depends(verify_firebase_token)):
+    """Everything the app needs on load in one round-trip: settings, models, the first page of chats
+    and the active chat with its most recent messages.
+
+    The Firestore reads run concurrently. The active chat is `chat_id` when the client passes the one
+    it last showed, otherwise the saved lastActiveChat, otherwise the most recent chat; passing it lets
+    the message read start without waiting for settings.
+    """
+    from .sync import fresh_cursor
+    uid = user["uid"]
+    fs = get_fs()
+    started = time.time()
+    # taken before the reads, so anything written while they run is picked up by the first sync
+    sync_cursor = fresh_cursor()
+    chats_ref = fs.collection("users").document(uid).collection("chats")
+
+    def load_chats():
+        docs = list(chats_ref.order_by("updatedAt", direction="DESCENDING").limit(BOOTSTRAP_CHATS_LIMIT + 1).stream())
+        return [_chat_summary(d) for d in docs[:BOOTSTRAP_CHATS_LIMIT]], len(docs) > BOOTSTRAP_CHATS_LIMIT
+
+    def load_chat(cid: str):
+        ref = chats_ref.document(cid)
+        snap = ref.get()
+        if not snap.exists:
+            return None
+        docs = list(ref.collection("messages").order_by("createdAt", direction="DESCENDING").limit(BOOTSTRAP_MESSAGES_LIMIT + 1).stream())
+        msgs = [{"id": m.id, **m.to_dict()} for m in docs[:BOOTSTRAP_MESSAGES_LIMIT]]
+        msgs.reverse()
+        return {"chat": {"id": cid, **snap.to_dict()}, "messages": msgs, "has_more": len(docs) > BOOTSTRAP_MESSAGES_LIMIT}
+
+    async def no_hint():
+        return None
+
+    settings, (chats, chats_has_more), active = await asyncio.gather(
+        asyncio.to_thread(_load_settings, fs, uid),
+        asyncio.to_thread(load_chats),
+        asyncio.to_thread(load_chat, chat_id) if chat_id else no_hint(),
+    )
+    if active is None:
+        # no (valid) hint: same choice the client used to make after loading settings and chats
+        ids = {c["id"] for c in chats}
+        last_active = settings.get("lastActiveChat")
+        fallback = last_active if last_active in ids else (chats[0]["id"] if chats else None)
+        if fallback and fallback != chat_id:
+            active = await asyncio.to_thread(load_chat, fallback)
+    took_ms = (time.time() - started) * 1000
+    metrics.observe("bootstrap_ms", took_ms)
+    log_info(uid, None, "bootstrap", chats=len(chats), messages=len(active["messages"]) if active else 0, ms=round(took_ms, 1))
+    return {
+        "ok": True,
+        "settings": settings,
+        "models": ALLOWED_MODELS,
+        "chats": chats,
+        "chats_has_more": chats_has_more,
+        "active_chat": active,
+        "sync_cursor": sync_cursor,
+    }
@@ -0,0 +1,83 @@
+import os
+import threading
+from collections import deque
+from typing import Dict, Tuple
+
+
+METRICS_RESERVOIR_SIZE = int(os.getenv("METRICS_RESERVOIR_SIZE", "1024"))
+
+
+def _key(name: str, labels: Dict[str, object]) -> Tuple[str, Tuple[Tuple[str, str], ...]]:
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items() if v is not None))
+
+
+class _Summary:
+    """Count/sum/min/max plus a bounded window of recent samples for percentiles."""
+
+    __slots__ = ("count", "total", "min", "max", "recent")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self.recent = deque(maxlen=METRICS_RESERVOIR_SIZE)
+
+    def observe(self, value: float):
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        self.recent.append(value)
+
+    def to_dict(self) -> dict:
+        ordered = sorted(self.recent)
+
+        def pct(p):
+            if not ordered:
+                return None
+            return ordered[min(len(ordered) - 1, int(p * len(ordered)))]
+
+        return {
+            "count": self.count,
+            "sum": round(self.total, 3),
+            "min": self.min,
+            "max": self.max,
+            "p50": pct(0.50),
+            "p95": pct(0.95),
+            "p99": pct(0.99),
+        }
+
+
+class Metrics:
+    """Process-local counters and latency summaries, exposed as JSON on /metrics.
+
+    Safe to update from worker threads (asyncio.to_thread) as well as the event loop.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[tuple, float] = {}
+        self._summaries: Dict[tuple, _Summary] = {}
+
+    def inc(self, name: str, value: float = 1, **labels):
+        k = _key(name, labels)
+        with self._lock:
+            self._counters[k] = self._counters.get(k, 0) + value
+
+    def observe(self, name: str, value: float, **labels):
+        k = _key(name, labels)
+        with self._lock:
+            summary = self._summaries.get(k)
+            if summary is None:
+                summary = self._summaries[k] = _Summary()
+            summary.observe(value)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            counters = [{"name": n, "labels": dict(l), "value": v} for (n, l), v in self._counters.items()]
+            summaries = [{"name": n, "labels": dict(l), **s.to_dict()} for (n, l), s in self._summaries.items()]
+        return {"pid": os.getpid(), "counters": counters, "summaries": summaries}
+
+
+metrics = Metrics()
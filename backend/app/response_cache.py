@@ -0,0 +1,192 @@
+import os
+import math
+import time
+import asyncio
+import hashlib
+import logging
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import AsyncGenerator, Callable, Dict, List, Optional
+
+
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "0") == "1"
+RESPONSE_CACHE_TTL_SECONDS = int(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "3600"))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "2000"))
+RESPONSE_CACHE_MAX_CHARS = int(os.getenv("RESPONSE_CACHE_MAX_CHARS", str(20 * 1024 * 1024)))
+# cosine similarity needed for a near-duplicate hit; 0 disables embedding lookup (exact match only)
+RESPONSE_CACHE_SIMILARITY = float(os.getenv("RESPONSE_CACHE_SIMILARITY", "0"))
+RESPONSE_CACHE_EMBED_MODEL = os.getenv("RESPONSE_CACHE_EMBED_MODEL", "models/text-embedding-004")
+RESPONSE_CACHE_EMBED_TIMEOUT_SECONDS = float(os.getenv("RESPONSE_CACHE_EMBED_TIMEOUT_SECONDS", "1.5"))
+RESPONSE_CACHE_SEMANTIC_CANDIDATES = int(os.getenv("RESPONSE_CACHE_SEMANTIC_CANDIDATES", "256"))
+# replay pacing: characters per token event and delay between events
+RESPONSE_CACHE_REPLAY_CHARS = int(os.getenv("RESPONSE_CACHE_REPLAY_CHARS", "24"))
+RESPONSE_CACHE_REPLAY_INTERVAL_MS = int(os.getenv("RESPONSE_CACHE_REPLAY_INTERVAL_MS", "15"))
+# model routes whose answer is what the requested model's prompt normally gets; a reply from a degraded route
+# (slow, circuit_open, "+fallback") is not stored, since the lookup is keyed by the requested model
+CACHEABLE_ROUTES = ("requested", "short_prompt")
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Case-fold, NFKC-normalize and collapse whitespace; trailing punctuation does not change the answer."""
+    text = unicodedata.normalize("NFKC", prompt or "").casefold()
+    return " ".join(text.split()).rstrip(" ?!.")
+
+
+def cache_key(model: str, prompt: str, system_context: Optional[str] = None) -> str:
+    ctx_hash = hashlib.sha256((system_context or "").encode("utf-8")).hexdigest()
+    raw = f"{model}\x00{normalize_prompt(prompt)}\x00{ctx_hash}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _cosine(a: List[float], b: List[float]) -> float:
+    dot = sum(x * y for x, y in zip(a, b))
+    na = math.sqrt(sum(x * x for x in a))
+    nb = math.sqrt(sum(y * y for y in b))
+    return dot / (na * nb) if na and nb else 0.0
+
+
+def _gemini_embed(text: str) -> List[float]:
+    from .chat import _get_genai
+    result = _get_genai().embed_content(model=RESPONSE_CACHE_EMBED_MODEL, content=text)
+    return list(result["embedding"])
+
+
+class ResponseCache:
+    """Process-local TTL + LRU cache of completed answers.
+
+    Entries are keyed by (model, normalized prompt, system context hash). When
+    RESPONSE_CACHE_SIMILARITY is set, misses fall back to comparing the prompt embedding against the
+    most recent entries with the same model and system context. Size is bounded both by entry count
+    and by total cached characters.
+    """
+
+    def __init__(self, ttl: int = RESPONSE_CACHE_TTL_SECONDS, max_entries: int = RESPONSE_CACHE_MAX_ENTRIES,
+                 max_chars: int = RESPONSE_CACHE_MAX_CHARS, similarity: float = RESPONSE_CACHE_SIMILARITY,
+                 embedder: Optional[Callable[[str], List[float]]] = None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_chars = max_chars
+        self.similarity = similarity
+        self.embedder = embedder or _gemini_embed
+        self._data: "OrderedDict[str, Dict]" = OrderedDict()
+        self._chars = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+
+    async def _embed(self, prompt: str) -> Optional[List[float]]:
+        if self.similarity <= 0:
+            return None
+        try:
+            return await asyncio.wait_for(asyncio.to_thread(self.embedder, normalize_prompt(prompt)), RESPONSE_CACHE_EMBED_TIMEOUT_SECONDS)
+        except Exception as e:
+            logging.warning(f"Response cache embedding failed: {e}")
+            return None
+
+    def _evict(self, key: str):
+        entry = self._data.pop(key)
+        self._chars -= len(entry["text"])
+
+    def _get_exact(self, key: str) -> Optional[Dict]:
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        if entry["expires"] < time.time():
+            self._evict(key)
+            return None
+        self._data.move_to_end(key)
+        return entry
+
+    def _get_similar(self, model: str, ctx_hash: str, vector: List[float]) -> Optional[Dict]:
+        now = time.time()
+        best, best_score = None, self.similarity
+        for i, (key, entry) in enumerate(reversed(self._data.items())):
+            if i >= RESPONSE_CACHE_SEMANTIC_CANDIDATES:
+                break
+            if entry["expires"] < now or entry["model"] != model or entry["ctx"] != ctx_hash or not entry.get("vector"):
+                continue
+            score = _cosine(vector, entry["vector"])
+            if score >= best_score:
+                best, best_score = (key, entry), score
+        if best is None:
+            return None
+        self._data.move_to_end(best[0])
+        return best[1]
+
+    async def lookup(self, model: str, prompt: str, system_context: Optional[str] = None) -> Dict:
+        """Return {"text", "match": "exact"|"semantic", "vector"} on a hit, or {"text": None, "vector"} on a miss.
+
+        The prompt embedding (if computed) is returned so a subsequent store() need not embed again.
+        """
+        key = cache_key(model, prompt, system_context)
+        with self._lock:
+            entry = self._get_exact(key)
+            if entry is not None:
+                self.hits += 1
+                return {"text": entry["text"], "match": "exact", "vector": None}
+        vector = await self._embed(prompt)
+        if vector is not None:
+            ctx_hash = hashlib.sha256((system_context or "").encode("utf-8")).hexdigest()
+            with self._lock:
+                entry = self._get_similar(model, ctx_hash, vector)
+                if entry is not None:
+                    self.hits += 1
+                    self.semantic_hits += 1
+                    return {"text": entry["text"], "match": "semantic", "vector": vector}
+        with self._lock:
+            self.misses += 1
+        return {"text": None, "vector": vector}
+
+    def store(self, model: str, prompt: str, system_context: Optional[str], text: str, vector: Optional[List[float]] = None):
+        if self.ttl <= 0 or not text or len(text) > self.max_chars:
+            return
+        key = cache_key(model, prompt, system_context)
+        entry = {
+            "text": text,
+            "model": model,
+            "ctx": hashlib.sha256((system_context or "").encode("utf-8")).hexdigest(),
+            "vector": vector,
+            "expires": time.time() + self.ttl,
+        }
+        with self._lock:
+            if key in self._data:
+                self._evict(key)
+            self._data[key] = entry
+            self._chars += len(text)
+            while len(self._data) > self.max_entries or self._chars > self.max_chars:
+                self._evict(next(iter(self._data)))
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {"entries": len(self._data), "chars": self._chars, "hits": self.hits, "semantic_hits": self.semantic_hits, "misses": self.misses}
+
+
+async def replay(text: str, chunk_chars: int = RESPONSE_CACHE_REPLAY_CHARS, interval_ms: int = RESPONSE_CACHE_REPLAY_INTERVAL_MS) -> AsyncGenerator[str, None]:
+    """Yield a cached answer in word-aligned chunks at a steady pace, shaped like a live token stream."""
+    pos = 0
+    while pos < len(text):
+        end = min(len(text), pos + chunk_chars)
+        if end < len(text):
+            space = text.rfind(" ", pos + 1, end + 1)
+            if space > pos:
+                end = space + 1
+        yield text[pos:end]
+        pos = end
+        if pos < len(text) and interval_ms > 0:
+            await asyncio.sleep(interval_ms / 1000.0)
+
+
+_cache: Optional[ResponseCache] = None
+
+
+def get_response_cache() -> ResponseCache:
+    global _cache
+    if _cache is None:
+        _cache = ResponseCache()
+    return _cache
+
+
+def response_cache_stats() -> Dict:
+    return get_response_cache().stats() if RESPONSE_CACHE_ENABLED else {"enabled": False}
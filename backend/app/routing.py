@@ -0,0 +1,157 @@
+import os
+import time
+import asyncio
+import logging
+import threading
+from typing import AsyncGenerator, Callable, Dict, Optional, Tuple
+
+try:
+    from backend.services.resilience import BulkheadFullError, CircuitOpenError, get_breaker
+except Exception:
+    from services.resilience import BulkheadFullError, CircuitOpenError, get_breaker
+
+from .logs import log_event
+from .metrics import metrics
+
+
+ROUTING_FALLBACK_MODEL = os.getenv("ROUTING_FALLBACK_MODEL", "gemini-2.0-flash")
+# prompts up to this many characters go to the fallback (fast) model; 0 disables the policy
+ROUTING_SHORT_PROMPT_CHARS = int(os.getenv("ROUTING_SHORT_PROMPT_CHARS", "0"))
+# a model whose smoothed time-to-first-token exceeds this is bypassed; 0 disables
+ROUTING_SLOW_TTFT_MS = float(os.getenv("ROUTING_SLOW_TTFT_MS", "0"))
+# give up on the primary if it has not produced a first token by then, and fall back
+ROUTING_FIRST_TOKEN_TIMEOUT_SECONDS = float(os.getenv("ROUTING_FIRST_TOKEN_TIMEOUT_SECONDS", "20"))
+ROUTING_EWMA_ALPHA = float(os.getenv("ROUTING_EWMA_ALPHA", "0.2"))
+ROUTING_MIN_SAMPLES = 5
+ROUTING_PROBE_EVERY = 20
+
+
+class _ModelStats:
+    def __init__(self):
+        self.ttft_ms: Optional[float] = None
+        self.error_rate = 0.0
+        self.samples = 0
+        self.bypassed = 0
+
+    def observe(self, ok: bool, ttft_ms: Optional[float] = None):
+        a = ROUTING_EWMA_ALPHA
+        self.samples += 1
+        self.error_rate = (1 - a) * self.error_rate + a * (0.0 if ok else 1.0)
+        if ttft_ms is not None:
+            self.ttft_ms = ttft_ms if self.ttft_ms is None else (1 - a) * self.ttft_ms + a * ttft_ms
+
+
+class ModelRouter:
+    """Chooses which model serves a chat generation and falls back when it misbehaves.
+
+    Per model it keeps an EWMA of time-to-first-token and error rate plus a circuit breaker
+    ("model:<name>"). A request is moved to the fallback model when its model's breaker is open, when
+    its smoothed TTFT is above ROUTING_SLOW_TTFT_MS, or, by policy, when the prompt is short. Once
+    streaming, a primary that fails or stalls before its first token is replaced by the fallback
+    transparently; after the first token errors are surfaced as before.
+    """
+
+    def __init__(self, fallback_model: str = ROUTING_FALLBACK_MODEL):
+        self.fallback_model = fallback_model
+        self._stats: Dict[str, _ModelStats] = {}
+        self._lock = threading.Lock()
+
+    def _stats_for(self, model: str) -> _ModelStats:
+        with self._lock:
+            return self._stats.setdefault(model, _ModelStats())
+
+    def choose(self, model: str, prompt: str) -> Tuple[str, str]:
+        """Return (model, reason) for a new generation."""
+        if model == self.fallback_model:
+            return model, "requested"
+        if ROUTING_SHORT_PROMPT_CHARS and len(prompt) <= ROUTING_SHORT_PROMPT_CHARS:
+            return self.fallback_model, "short_prompt"
+        stats = self._stats_for(model)
+        if ROUTING_SLOW_TTFT_MS and stats.samples >= ROUTING_MIN_SAMPLES and (stats.ttft_ms or 0) > ROUTING_SLOW_TTFT_MS:
+            stats.bypassed += 1
+            # every Nth request still goes to the slow model so its EWMA can recover
+            if stats.bypassed % ROUTING_PROBE_EVERY:
+                return self.fallback_model, "slow"
+        if not get_breaker(f"model:{model}").allow():
+            return self.fallback_model, "circuit_open"
+        return model, "requested"
+
+    def record(self, model: str, ok: bool, ttft_ms: Optional[float] = None):
+        self._stats_for(model).observe(ok, ttft_ms)
+        breaker = get_breaker(f"model:{model}")
+        breaker.record_success() if ok else breaker.record_failure()
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            items = list(self._stats.items())
+        return {
+            model: {
+                "ttft_ms_ewma": round(s.ttft_ms, 1) if s.ttft_ms is not None else None,
+                "error_rate_ewma": round(s.error_rate, 3),
+                "samples": s.samples,
+                "breaker": get_breaker(f"model:{model}").state,
+            }
+            for model, s in items
+        }
+
+    async def stream(self, prompt: str, model: str, system_context: Optional[str],
+                     stream_fn: Callable[..., AsyncGenerator[str, None]], route: Dict) -> AsyncGenerator[str, None]:
+        """Stream tokens from the routed model, falling back before the first token if needed.
+
+        `route` is filled in with {"requested", "model", "reason"} so the caller can label metrics
+        and persist which model actually answered.
+        """
+        chosen, reason = self.choose(model, prompt)
+        route.update({"requested": model, "model": chosen, "reason": reason})
+        candidates = [chosen] if chosen == self.fallback_model else [chosen, self.fallback_model]
+        for i, candidate in enumerate(candidates):
+            if i:
+                route.update({"model": candidate, "reason": route["reason"] + "+fallback"})
+            started = time.time()
+            gen = stream_fn(prompt, candidate, system_context=system_context)
+            recorded = False
+            try:
+                try:
+                    first = await asyncio.wait_for(gen.__anext__(), ROUTING_FIRST_TOKEN_TIMEOUT_SECONDS)
+                except StopAsyncIteration:
+                    self.record(candidate, True, (time.time() - started) * 1000)
+                    recorded = True
+                    break
+                except (BulkheadFullError, CircuitOpenError):
+                    # rejected by this worker's Gemini guard before reaching the model: load, not a model failure,
+                    # and the fallback model sits behind the same guard
+                    await gen.aclose()
+                    raise
+                except Exception as e:
+                    self.record(candidate, False)
+                    recorded = True
+                    await gen.aclose()
+                    if i + 1 < len(candidates):
+                        logging.warning(f"Model {candidate} failed before first token ({type(e).__name__}: {e}); falling back to {candidates[i + 1]}")
+                        metrics.inc("model_fallbacks", model=candidate, to=candidates[i + 1], error=type(e).__name__)
+                        continue
+                    raise
+                self.record(candidate, True, (time.time() - started) * 1000)
+                recorded = True
+            finally:
+                if not recorded and i == 0 and reason == "requested" and candidate != self.fallback_model:
+                    # rejected before reaching the model or cancelled while waiting for it (client gone, shutdown):
+                    # no verdict on the model, but a half-open trial admitted by choose() must be handed back
+                    get_breaker(f"model:{candidate}").release_trial()
+            self._log_route(route)
+            yield first
+            try:
+                async for token in gen:
+                    yield token
+            except Exception:
+                self.record(candidate, False)
+                raise
+            return
+        self._log_route(route)
+
+    def _log_route(self, route: Dict):
+        metrics.inc("model_routes", requested=route.get("requested"), model=route.get("model"), reason=route.get("reason"))
+        log_event("model_route", **route)
+
+
+router = ModelRouter()
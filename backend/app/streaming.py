@@ -0,0 +1,203 @@
+import os
+import asyncio
+from collections import deque
+from typing import AsyncGenerator, AsyncIterator, Dict, Optional
+
+from .metrics import metrics
+
+
+SSE_DISCONNECT_CHECK_MS = int(os.getenv("SSE_DISCONNECT_CHECK_MS", "1000"))
+# backlog above which the writer reports the client as slow (once per stream)
+SSE_SLOW_CLIENT_BYTES = int(os.getenv("SSE_SLOW_CLIENT_BYTES", str(64 * 1024)))
+# per-worker cap on concurrent chat streams; beyond it new streams get 503 + Retry-After
+STREAM_MAX_CONCURRENT = int(os.getenv("STREAM_MAX_CONCURRENT", "500"))
+STREAM_RETRY_AFTER_SECONDS = int(os.getenv("STREAM_RETRY_AFTER_SECONDS", "5"))
+# on shutdown, how long in-flight streams and background jobs may keep running so they finish and persist
+STREAM_DRAIN_SECONDS = float(os.getenv("STREAM_DRAIN_SECONDS", "45"))
+
+_TOKEN_PREFIX = 'event: token\ndata: {"text": "'
+_TOKEN_SUFFIX = '"}\n\n'
+
+
+def _token_text(chunk: str) -> Optional[str]:
+    """The (already JSON-escaped) text of a token event, or None for any other event."""
+    if chunk.startswith(_TOKEN_PREFIX) and chunk.endswith(_TOKEN_SUFFIX):
+        return chunk[len(_TOKEN_PREFIX):-len(_TOKEN_SUFFIX)]
+    return None
+
+
+class SSEWriter:
+    """Decouples an SSE producer from the client connection.
+
+    The producer pushes complete SSE chunks and never waits on the socket. Chunks queue up while the
+    response is blocked sending to a slow client, and consecutive token events in the backlog are
+    merged into one, so a slow reader gets fewer, larger events while a fast reader still sees every
+    token as it is produced. Disconnects are detected by a timer rather than on every token; after
+    one, pushes are dropped and the producer carries on, so the answer still completes in history.
+    """
+
+    def __init__(self, request=None, check_interval_ms: int = SSE_DISCONNECT_CHECK_MS):
+        self.request = request
+        self.check_interval = check_interval_ms / 1000.0
+        self._queue: deque = deque()
+        self._last_is_token = False
+        self._wakeup = asyncio.Event()
+        self._finished = False
+        self.disconnected = False
+        self.backlog_bytes = 0
+        self.max_backlog_bytes = 0
+        self.events_in = 0
+        self.events_out = 0
+        self._slow_reported = False
+
+    def push(self, chunk: str):
+        if self.disconnected or self._finished:
+            return
+        self.events_in += 1
+        text = _token_text(chunk)
+        if text is not None and self._last_is_token and self._queue:
+            # merge into the pending token event instead of queueing another one
+            prev = self._queue.pop()
+            self._queue.append(prev[:-len(_TOKEN_SUFFIX)] + text + _TOKEN_SUFFIX)
+            self.backlog_bytes += len(text)
+        else:
+            self._queue.append(chunk)
+            self.backlog_bytes += len(chunk)
+        self._last_is_token = text is not None
+        if self.backlog_bytes > self.max_backlog_bytes:
+            self.max_backlog_bytes = self.backlog_bytes
+            if self.backlog_bytes > SSE_SLOW_CLIENT_BYTES and not self._slow_reported:
+                self._slow_reported = True
+                metrics.inc("sse_slow_clients")
+        self._wakeup.set()
+
+    def finish(self):
+        self._finished = True
+        self._wakeup.set()
+
+    async def pump(self, source: AsyncIterator[str]):
+        """Drain a producer into the writer; meant to run as a background task."""
+        try:
+            async for chunk in source:
+                self.push(chunk)
+        finally:
+            self.finish()
+
+    async def _watch_disconnect(self):
+        while not self._finished and not self.disconnected:
+            await asyncio.sleep(self.check_interval)
+            try:
+                if self.request is not None and await self.request.is_disconnected():
+                    self._mark_disconnected()
+            except Exception:
+                pass
+
+    def _mark_disconnected(self):
+        if self.disconnected:
+            return
+        self.disconnected = True
+        self._queue.clear()
+        self.backlog_bytes = 0
+        metrics.inc("sse_client_disconnects")
+        self._wakeup.set()
+
+    async def events(self) -> AsyncGenerator[str, None]:
+        """The response body: yields queued chunks until the producer finishes or the client leaves."""
+        watcher = asyncio.create_task(self._watch_disconnect()) if self.request is not None else None
+        try:
+            while True:
+                if not self._queue:
+                    if self._finished or self.disconnected:
+                        return
+                    self._wakeup.clear()
+                    await self._wakeup.wait()
+                    continue
+                chunk = self._queue.popleft()
+                if not self._queue:
+                    self._last_is_token = False
+                self.backlog_bytes = max(0, self.backlog_bytes - len(chunk))
+                self.events_out += 1
+                yield chunk
+        except (asyncio.CancelledError, GeneratorExit):
+            # the server noticed the disconnect first (response cancelled)
+            self._mark_disconnected()
+            raise
+        finally:
+            if watcher is not None:
+                watcher.cancel()
+            if self.events_in:
+                metrics.observe("sse_backlog_max_bytes", self.max_backlog_bytes)
+                metrics.observe("sse_coalesce_ratio", self.events_out / self.events_in)
+
+
+class StreamCapacityError(RuntimeError):
+    """Raised when a worker is at its stream limit or draining for shutdown."""
+
+    def __init__(self, limit: int, retry_after: int, draining: bool = False):
+        reason = "shutting down" if draining else f"at capacity ({limit} concurrent streams)"
+        super().__init__(f"This server is {reason}; retry shortly")
+        self.limit = limit
+        self.retry_after = retry_after
+        self.draining = draining
+
+
+class StreamSlot:
+    def __init__(self, admission: "StreamAdmission"):
+        self._admission = admission
+        self._released = False
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self._admission._release()
+
+    async def track(self, source: AsyncIterator[str]) -> AsyncGenerator[str, None]:
+        """Pass `source` through, releasing the slot when it ends however it ends."""
+        try:
+            async for chunk in source:
+                yield chunk
+        finally:
+            self.release()
+
+
+class StreamAdmission:
+    """Per-worker admission control for long-lived streams.
+
+    A slot is held from admission until the stream's generation has finished (not just until the
+    client went away), so the count reflects real upstream and persistence work. Once closed for
+    shutdown nothing new is admitted; draining the admitted streams is up to the task registry.
+    """
+
+    def __init__(self, limit: int = STREAM_MAX_CONCURRENT, retry_after: int = STREAM_RETRY_AFTER_SECONDS):
+        self.limit = limit
+        self.retry_after = retry_after
+        self.active = 0
+        self.peak = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.draining = False
+
+    def acquire(self) -> StreamSlot:
+        if self.draining or self.active >= self.limit:
+            self.rejected += 1
+            metrics.inc("stream_admission", result="draining" if self.draining else "rejected")
+            raise StreamCapacityError(self.limit, self.retry_after, self.draining)
+        self.active += 1
+        self.admitted += 1
+        self.peak = max(self.peak, self.active)
+        metrics.inc("stream_admission", result="admitted")
+        return StreamSlot(self)
+
+    def _release(self):
+        self.active -= 1
+
+    def close(self):
+        """Stop admitting new streams (worker shutdown); admitted ones run on."""
+        self.draining = True
+
+    def stats(self) -> Dict:
+        return {"active": self.active, "peak": self.peak, "limit": self.limit, "admitted": self.admitted,
+                "rejected": self.rejected, "draining": self.draining}
+
+
+stream_admission = StreamAdmission()
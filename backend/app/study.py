@@ -0,0 +1,321 @@
+import os
+import re
+import json
+import time
+import asyncio
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import AsyncGenerator, Dict, List, Optional, Tuple
+
+try:
+    from backend.services import tracing
+except Exception:
+    from services import tracing
+
+from .metrics import metrics
+from .response_cache import normalize_prompt
+
+
+STUDY_DEFAULT_CARDS = int(os.getenv("STUDY_DEFAULT_CARDS", "10"))
+STUDY_MAX_CARDS = int(os.getenv("STUDY_MAX_CARDS", "60"))
+# decks larger than this are generated as parallel chunks, each streamed to the client when ready
+STUDY_CHUNK_CARDS = int(os.getenv("STUDY_CHUNK_CARDS", "10"))
+STUDY_CHUNK_CONCURRENCY = int(os.getenv("STUDY_CHUNK_CONCURRENCY", "4"))
+# generated decks are shared across users by normalized topic (process-local, then Firestore)
+STUDY_CACHE_TTL_SECONDS = int(os.getenv("STUDY_CACHE_TTL_SECONDS", str(7 * 86400)))
+STUDY_CACHE_MAX_ENTRIES = int(os.getenv("STUDY_CACHE_MAX_ENTRIES", "500"))
+STUDY_CACHE_COLLECTION = "study_cache"
+
+MAX_FRONT_CHARS = 300
+MAX_BACK_CHARS = 1200
+
+_SYSTEM = "You are a precise teacher writing flashcards. Answer with JSON only."
+_FIELD_ALIASES = {
+    "front": ("front", "question", "q", "term", "prompt"),
+    "back": ("back", "answer", "a", "definition", "explanation"),
+}
+_TRAILING_COMMA_RE = re.compile(r",\s*([\]}])")
+
+
+class StudyError(RuntimeError):
+    """The model could not produce a usable deck."""
+
+
+def topic_key(topic: str, model: str) -> str:
+    return hashlib.sha256(f"{model}\x00{normalize_prompt(topic)}".encode("utf-8")).hexdigest()
+
+
+def _card(item) -> Optional[Dict]:
+    if not isinstance(item, dict):
+        return None
+    fields = {}
+    for field, names in _FIELD_ALIASES.items():
+        value = next((item[n] for n in names if isinstance(item.get(n), (str, int, float)) and str(item[n]).strip()), None)
+        if value is None:
+            return None
+        fields[field] = " ".join(str(value).split())
+    return {"front": fields["front"][:MAX_FRONT_CHARS], "back": fields["back"][:MAX_BACK_CHARS]}
+
+
+def parse_cards(text: str) -> List[Dict]:
+    """Read flashcards from a model reply, repairing the common ways JSON output goes wrong.
+
+    Tolerates prose and code fences around the array, trailing commas, an object wrapping the array
+    ({"cards": [...]}), alternative field names (question/answer, term/definition) and a reply cut
+    off mid-array, in which case every complete card before the cut is kept. Raises ValueError when
+    nothing usable is found.
+    """
+    text = (text or "").strip()
+    start = text.find("[")
+    if start == -1:
+        start = text.find("{")
+    if start == -1:
+        raise ValueError("no JSON in model output")
+    body = _TRAILING_COMMA_RE.sub(r"\1", text[start:])
+    items = None
+    decoder = json.JSONDecoder()
+    try:
+        parsed, _ = decoder.raw_decode(body)
+        if isinstance(parsed, dict):
+            parsed = next((v for v in parsed.values() if isinstance(v, list)), [parsed])
+        items = parsed if isinstance(parsed, list) else None
+    except ValueError:
+        pass
+    if items is None:
+        # truncated or otherwise broken array: salvage each object that still decodes on its own
+        items = []
+        pos = body.find("{", 1 if body.startswith("{") else 0)
+        while pos != -1:
+            try:
+                obj, end = decoder.raw_decode(body, pos)
+                items.append(obj)
+                pos = body.find("{", end)
+            except ValueError:
+                pos = body.find("{", pos + 1)
+    cards = [c for c in (_card(i) for i in items) if c]
+    if not cards:
+        raise ValueError("model output contained no usable cards")
+    return cards
+
+
+def dedupe(cards: List[Dict], seen: Optional[set] = None) -> List[Dict]:
+    seen = set() if seen is None else seen
+    out = []
+    for card in cards:
+        key = normalize_prompt(card["front"])
+        if key not in seen:
+            seen.add(key)
+            out.append(card)
+    return out
+
+
+class DeckCache:
+    """Generated decks by (model, normalized topic): an in-process LRU in front of a shared Firestore copy.
+
+    A cached deck serves any request for at most as many cards as it holds; a request for more
+    generates a fresh, larger deck, which then replaces the cached one.
+    """
+
+    def __init__(self, ttl: int = STUDY_CACHE_TTL_SECONDS, max_entries: int = STUDY_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._data: "OrderedDict[str, Tuple[float, List[Dict]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+
+    def _local(self, key: str) -> Optional[List[Dict]]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or item[0] < time.time():
+                self._data.pop(key, None)
+                return None
+            self._data.move_to_end(key)
+            return item[1]
+
+    def _remember(self, key: str, cards: List[Dict], expires: float):
+        with self._lock:
+            current = self._data.get(key)
+            if current is not None and current[0] >= time.time() and len(current[1]) > len(cards):
+                return
+            self._data[key] = (expires, cards)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    async def get(self, key: str, count: int) -> Optional[List[Dict]]:
+        cards = self._local(key)
+        if cards is not None and len(cards) >= count:
+            self.hits += 1
+            return cards[:count]
+        try:
+            from .main import get_fs
+            snap = await asyncio.to_thread(get_fs().collection(STUDY_CACHE_COLLECTION).document(key).get)
+            data = snap.to_dict() if snap.exists else None
+        except Exception as e:
+            logging.warning(f"Study cache read failed: {e}")
+            data = None
+        if data and data.get("expiresAt", 0) >= time.time() and len(data.get("cards") or []) >= count:
+            self._remember(key, data["cards"], data["expiresAt"])
+            self.shared_hits += 1
+            return data["cards"][:count]
+        self.misses += 1
+        return None
+
+    async def put(self, key: str, topic: str, model: str, cards: List[Dict]):
+        expires = time.time() + self.ttl
+        self._remember(key, cards, expires)
+        try:
+            from .main import get_fs
+            ref = get_fs().collection(STUDY_CACHE_COLLECTION).document(key)
+
+            def write():
+                snap = ref.get()
+                if snap.exists and len((snap.to_dict() or {}).get("cards") or []) > len(cards) and (snap.to_dict() or {}).get("expiresAt", 0) >= time.time():
+                    return
+                ref.set({"topic": topic, "model": model, "cards": cards, "expiresAt": expires})
+
+            await asyncio.to_thread(write)
+        except Exception as e:
+            logging.warning(f"Study cache write failed: {e}")
+
+    def stats(self) -> Dict:
+        with self._lock:
+            entries = len(self._data)
+        return {"entries": entries, "hits": self.hits, "shared_hits": self.shared_hits, "misses": self.misses}
+
+
+deck_cache = DeckCache()
+# topic key -> future of the deck being generated, so concurrent requests for a topic share one generation
+_inflight: Dict[str, asyncio.Future] = {}
+
+
+def _chunk_prompt(topic: str, count: int, part: int, parts: int) -> str:
+    scope = ""
+    if parts > 1:
+        scope = (f" This is part {part + 1} of {parts} of a larger deck: parts go from fundamentals to advanced"
+                 f" material, so cover only the slice of the topic that belongs to part {part + 1} and do not repeat"
+                 f" basics covered by earlier parts.")
+    return (
+        f"Write {count} study flashcards about the topic below.{scope} Reply with only a JSON array of objects with "
+        f'"front" (a question or term) and "back" (a concise, correct answer) string fields.\n\nTopic: {topic}'
+    )
+
+
+async def _complete(prompt: str, model: str) -> str:
+    from .chat import _gemini_token_stream
+    from .routing import router
+    return "".join([t async for t in router.stream(prompt, model, _SYSTEM, _gemini_token_stream, {})])
+
+
+async def _generate_chunk(topic: str, count: int, part: int, parts: int, model: str) -> List[Dict]:
+    with tracing.span("study.chunk", part=part, cards=count):
+        text = await _complete(_chunk_prompt(topic, count, part, parts), model)
+        try:
+            cards = parse_cards(text)
+        except ValueError as e:
+            # one model-side repair: hand the broken reply back and ask for valid JSON only
+            metrics.inc("study_repairs")
+            with tracing.span("study.repair"):
+                fixed = await _complete(
+                    f"The following was meant to be a JSON array of flashcards with \"front\" and \"back\" fields but is "
+                    f"invalid ({e}). Reply with only the corrected JSON array.\n\n{text[:8000]}", model)
+            cards = parse_cards(fixed)
+        return cards[:count]
+
+
+async def generate(topic: str, count: int, model: str) -> AsyncGenerator[List[Dict], None]:
+    """Generate a deck of `count` cards, yielding each chunk's new (deduplicated) cards as it finishes."""
+    parts = max(1, -(-count // STUDY_CHUNK_CARDS))
+    sizes = [count // parts + (1 if i < count % parts else 0) for i in range(parts)]
+    sem = asyncio.Semaphore(max(1, STUDY_CHUNK_CONCURRENCY))
+
+    async def run(i: int) -> List[Dict]:
+        async with sem:
+            return await _generate_chunk(topic, sizes[i], i, parts, model)
+
+    tasks = [asyncio.create_task(run(i)) for i in range(parts)]
+    seen: set = set()
+    errors = []
+    produced = 0
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            try:
+                cards = await next_done
+            except Exception as e:
+                # a failed chunk leaves the deck short rather than failing the cards already delivered
+                metrics.inc("study_chunks", outcome="error")
+                errors.append(e)
+                continue
+            metrics.inc("study_chunks", outcome="ok")
+            fresh = dedupe(cards, seen)
+            produced += len(fresh)
+            if fresh:
+                yield fresh
+    finally:
+        for t in tasks:
+            t.cancel()
+    if not produced:
+        raise StudyError(f"Could not generate flashcards: {errors[0] if errors else 'empty deck'}")
+
+
+async def _save_deck(uid: str, topic: str, model: str, cards: List[Dict], cached: bool) -> str:
+    from .main import get_fs, server_timestamp
+    ref = get_fs().collection("users").document(uid).collection("decks").document()
+    await asyncio.to_thread(ref.set, {
+        "topic": topic, "model": model, "cards": cards, "count": len(cards), "cached": cached,
+        "createdAt": server_timestamp(), "updatedAt": server_timestamp(),
+    })
+    return ref.id
+
+
+async def deck_events(uid: str, topic: str, count: int, model: str) -> AsyncGenerator[Dict, None]:
+    """Produce a deck for `topic` as tool events: "cards" batches as they are ready, then the saved deck.
+
+    Decks come from the topic cache when a large enough one exists; otherwise concurrent requests for
+    the same topic in this worker share a single generation. Every deck is saved under the user.
+    """
+    topic = " ".join(topic.split())
+    count = max(1, min(STUDY_MAX_CARDS, count))
+    key = topic_key(topic, model)
+
+    cards = await deck_cache.get(key, count)
+    cached = cards is not None
+    if cards is None and key in _inflight:
+        # someone is generating this topic right now; wait for their deck instead of generating another
+        try:
+            deck = await asyncio.shield(_inflight[key])
+            if len(deck) >= count:
+                cards, cached = deck[:count], True
+        except Exception:
+            pass
+    metrics.inc("study_cache_lookups", result="hit" if cached else "miss")
+
+    if cards is not None:
+        yield {"type": "cards", "cards": cards, "ready": len(cards), "total": count}
+    else:
+        future = asyncio.get_running_loop().create_future()
+        _inflight[key] = future
+        cards = []
+        try:
+            async for batch in generate(topic, count, model):
+                cards.extend(batch)
+                yield {"type": "cards", "cards": batch, "ready": len(cards), "total": count}
+            future.set_result(cards)
+        except BaseException as e:
+            future.set_exception(e if isinstance(e, Exception) else StudyError("generation cancelled"))
+            future.exception()  # followers may not be waiting; never report it as unretrieved
+            raise
+        finally:
+            _inflight.pop(key, None)
+        await deck_cache.put(key, topic, model, cards)
+
+    deck_id = await _save_deck(uid, topic, model, cards, cached)
+    yield {"type": "result", "deck_id": deck_id, "topic": topic, "flashcards": cards, "cached": cached}
+
+
+def study_stats() -> Dict:
+    return {**deck_cache.stats(), "generating": len(_inflight)}
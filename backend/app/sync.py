@@ -0,0 +1,113 @@
+import os
+import json
+import time
+import base64
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+
+SYNC_PAGE_SIZE = int(os.getenv("SYNC_PAGE_SIZE", "200"))
+# fresh cursors start this far in the past so writes whose server timestamp lags our clock are not missed
+SYNC_CLOCK_SKEW_SECONDS = float(os.getenv("SYNC_CLOCK_SKEW_SECONDS", "5"))
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(ts: datetime, key: str = "") -> str:
+    raw = json.dumps({"t": ts.astimezone(timezone.utc).isoformat(), "k": key}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        data = json.loads(raw)
+        ts = datetime.fromisoformat(data["t"])
+        if ts.tzinfo is None:
+            ts = ts.replace(tzinfo=timezone.utc)
+        return ts, str(data.get("k") or "")
+    except Exception as e:
+        raise InvalidCursor(f"invalid sync cursor: {e}")
+
+
+def fresh_cursor() -> str:
+    """Cursor for a client that has just loaded the full state (e.g. via /bootstrap)."""
+    return encode_cursor(datetime.fromtimestamp(time.time() - SYNC_CLOCK_SKEW_SECONDS, tz=timezone.utc))
+
+
+def _ts(value) -> Optional[datetime]:
+    if isinstance(value, datetime):
+        return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+    return None
+
+
+class HistorySync:
+    """Delta sync of a user's history: chats, messages and chat tombstones changed after a cursor.
+
+    Every change is ordered by (updatedAt, key) where key is "<kind>:<document path>", so documents
+    written in the same batch (identical server timestamps) are still returned exactly once across
+    pages. The cursor is opaque to clients: an encoded (updatedAt, key) of the last change returned.
+
+    Messages are found with a collection-group query on `uid` + `updatedAt`, so only messages that
+    carry a `uid` field are synced; that needs a composite index (see RUNBOOK).
+    """
+
+    def __init__(self, fs, uid: str, page_size: int = SYNC_PAGE_SIZE):
+        self.fs = fs
+        self.uid = uid
+        self.page_size = page_size
+
+    def _sources(self):
+        user = self.fs.collection("users").document(self.uid)
+        return (
+            ("chat", user.collection("chats")),
+            ("tombstone", user.collection("tombstones")),
+            ("message", self.fs.collection_group("messages").where("uid", "==", self.uid)),
+        )
+
+    def _changed(self, kind: str, query, since: Tuple[datetime, str], want: int) -> List[Tuple[datetime, str, object]]:
+        """Up to `want` changes of one kind strictly after `since`, in (updatedAt, key) order."""
+        out = []
+        last = None
+        while len(out) < want:
+            q = query.where("updatedAt", ">=", since[0]).order_by("updatedAt").limit(want)
+            if last is not None:
+                q = q.start_after(last)
+            page = list(q.stream())
+            for snap in page:
+                ts = _ts((snap.to_dict() or {}).get("updatedAt"))
+                key = f"{kind}:{snap.reference.path}"
+                if ts is None or (ts, key) <= since:
+                    # same timestamp as the cursor and already delivered
+                    continue
+                out.append((ts, key, snap))
+            if len(page) < want:
+                break
+            last = page[-1]
+        out.sort(key=lambda x: (x[0], x[1]))
+        return out[:want]
+
+    def changes(self, cursor: str) -> Dict:
+        since = decode_cursor(cursor)
+        want = self.page_size + 1
+        merged = []
+        for kind, query in self._sources():
+            merged.extend((ts, key, kind, snap) for ts, key, snap in self._changed(kind, query, since, want))
+        merged.sort(key=lambda x: (x[0], x[1]))
+        has_more = len(merged) > self.page_size
+        merged = merged[:self.page_size]
+
+        chats, messages, deleted = [], [], []
+        for ts, key, kind, snap in merged:
+            data = snap.to_dict() or {}
+            if kind == "chat":
+                chats.append({"id": snap.id, **data})
+            elif kind == "tombstone":
+                deleted.append({"chat_id": snap.id, "status": data.get("status"), "updatedAt": data.get("updatedAt")})
+            else:
+                data.pop("uid", None)
+                messages.append({"id": snap.id, "chat_id": data.pop("chatId", None) or snap.reference.parent.parent.id, **data})
+        next_cursor = encode_cursor(merged[-1][0], merged[-1][1]) if merged else cursor
+        return {"chats": chats, "messages": messages, "deleted": deleted, "cursor": next_cursor, "has_more": has_more}
@@ -1,72 +1,460 @@
-from fastapi import APIRouter
+import os
+import json
+import time
+import asyncio
+import logging
+import unicodedata
+from collections import OrderedDict
+from typing import AsyncGenerator, Callable, Dict, List, Optional, Tuple
+
+from fastapi import APIRouter, Request
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
 
+try:
+    from backend.services.resilience import BulkheadFullError, CircuitOpenError, get_dependency
+    from backend.services import tracing
+except Exception:
+    from services.resilience import BulkheadFullError, CircuitOpenError, get_dependency
+    from services import tracing
+
+from .health import prober
+from .lifecycle import ShuttingDownError, registry as task_registry
+from .metrics import metrics
+
+# invoke routes; main.py mounts these behind Firebase auth
 router = APIRouter(prefix="/tools", tags=["tools"])
+# read-only routes that stay public (uptime checks, dashboards)
+public_router = APIRouter(prefix="/tools", tags=["tools"])
+
+TOOL_CACHE_MAX_ENTRIES = int(os.getenv("TOOL_CACHE_MAX_ENTRIES", "512"))
+# how often the image tool checks whether its generation job has finished
+TOOL_IMAGE_POLL_SECONDS = float(os.getenv("TOOL_IMAGE_POLL_SECONDS", "1"))
+# /tools/invoke/batch: items per request, and how many of them run at once (per-tool limits still apply)
+TOOL_BATCH_MAX_ITEMS = int(os.getenv("TOOL_BATCH_MAX_ITEMS", "50"))
+TOOL_BATCH_CONCURRENCY = int(os.getenv("TOOL_BATCH_CONCURRENCY", "6"))
+
+# An event handler yields dicts with a "type": "progress" / "delta" (incremental text) while it works
+# and exactly one "result" at the end, whose other keys are the tool's response payload.
+ToolHandler = Callable[[str, Dict, str], AsyncGenerator[Dict, None]]
+
 
 class ToolRequest(BaseModel):
     tool: str
     prompt: str
+    options: Dict = {}
+    # stream progress and partial output as SSE instead of returning one JSON response
+    stream: bool = False
 
-@router.post("/invoke")
-async def invoke_tool(request: ToolRequest):
-    """Invoke a tool with the given prompt"""
-    
-    if request.tool == "canvas":
-        return {
-            "success": True,
-            "result": "Canvas tool invoked. This is a placeholder response.",
-        }
-    
-    elif request.tool == "study":
-        return {
-            "success": True,
-            "flashcards": [
-                {"front": f"What is {request.prompt}?", "back": f"{request.prompt} is..."},
-                {"front": f"Key concepts of {request.prompt}", "back": "Main concepts are..."},
-            ],
-        }
-    
-    elif request.tool == "image":
-        return {
-            "success": True,
-            "image_url": "placeholder",
-            "message": "Image generation API not configured. This is a placeholder.",
-        }
-    
-    elif request.tool == "video":
-        return {
-            "success": True,
-            "video_url": "placeholder",
-            "status": "processing",
-            "message": "Video generation API not configured. This is a placeholder.",
-        }
-    
-    elif request.tool == "search":
+
+class BatchToolRequest(BaseModel):
+    requests: List[ToolRequest]
+    # lower the batch's own parallelism below TOOL_BATCH_CONCURRENCY
+    concurrency: Optional[int] = None
+
+
+class ToolError(Exception):
+    """A tool invocation that failed in a way the client should see (code, message, HTTP status)."""
+
+    def __init__(self, code: str, message: str, status_code: int = 400, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.code = code
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class _ResultCache:
+    """TTL + LRU cache of tool results keyed by (tool, normalized prompt, options)."""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._data: "OrderedDict[Tuple, Tuple[float, Dict]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(tool: str, prompt: str, options: Dict) -> Tuple:
+        text = " ".join(unicodedata.normalize("NFKC", prompt).casefold().split())
+        return (tool, text, json.dumps(options, sort_keys=True, default=str))
+
+    def get(self, key: Tuple) -> Optional[Dict]:
+        item = self._data.get(key)
+        if item is None or item[0] < time.time():
+            if item is not None:
+                del self._data[key]
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return item[1]
+
+    def put(self, key: Tuple, result: Dict, ttl: float):
+        self._data[key] = (time.time() + ttl, result)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+
+    def stats(self) -> Dict:
+        return {"entries": len(self._data), "hits": self.hits, "misses": self.misses}
+
+
+class Tool:
+    """A registered tool: its handler plus the limits it runs under and the dependencies it needs."""
+
+    def __init__(self, name: str, handler: ToolHandler, *, max_concurrent: int, timeout_seconds: float,
+                 cache_seconds: float, dependencies: List[str], env_keys: List[str], description: str):
+        self.name = name
+        self.handler = handler
+        self.max_concurrent = max_concurrent
+        self.timeout_seconds = timeout_seconds
+        self.cache_seconds = cache_seconds
+        self.dependencies = dependencies
+        self.env_keys = env_keys
+        self.description = description
+        self.in_flight = 0
+        self._sem = asyncio.Semaphore(max_concurrent)
+
+    def health(self) -> Dict:
+        """Availability from live state: configuration, the background prober and each dependency's breaker."""
+        probes = prober.snapshot()
+        deps = {}
+        status = "active"
+        missing = [k for k in self.env_keys if not os.getenv(k)]
+        for name in self.dependencies:
+            snap = get_dependency(name).snapshot()
+            probe = probes.get(name) or {}
+            deps[name] = {"breaker": snap["state"], "in_flight": snap["in_flight"], "probe_ok": probe.get("ok")}
+            if snap["state"] == "open" or (probe.get("configured") and probe.get("checked_at") and not probe.get("ok")):
+                status = "down"
+            elif snap["state"] == "half_open" and status == "active":
+                status = "degraded"
+        if missing:
+            status = "unconfigured"
+        elif self.in_flight >= self.max_concurrent and status == "active":
+            status = "busy"
         return {
-            "success": True,
-            "results": [
-                {
-                    "title": "Search Result 1",
-                    "url": "https://example.com",
-                    "snippet": "This is a placeholder search result.",
-                },
-                {
-                    "title": "Search Result 2",
-                    "url": "https://example.com",
-                    "snippet": "Tavily API not configured. Using mock data.",
-                },
-            ],
+            "available": status in ("active", "degraded", "busy"),
+            "status": status,
+            "description": self.description,
+            "in_flight": self.in_flight,
+            "max_concurrent": self.max_concurrent,
+            "timeout_seconds": self.timeout_seconds,
+            "dependencies": deps,
+            **({"missing_env_vars": missing} if missing else {}),
         }
-    
-    return {"success": False, "error": "Unknown tool"}
 
-@router.get("/health")
+
+def _env(name: str, key: str, default: float) -> float:
+    return float(os.getenv(f"TOOL_{name.upper()}_{key}", str(default)))
+
+
+class ToolRegistry:
+    """Dispatches tool invocations to registered async handlers.
+
+    Each tool runs under its own concurrency limit (callers wait for a slot, within the timeout), an
+    overall timeout covering the whole invocation, and an optional result cache. Limits can be
+    overridden with TOOL_<NAME>_MAX_CONCURRENT / TOOL_<NAME>_TIMEOUT_SECONDS / TOOL_<NAME>_CACHE_SECONDS.
+    """
+
+    def __init__(self):
+        self._tools: Dict[str, Tool] = {}
+        self.cache = _ResultCache(TOOL_CACHE_MAX_ENTRIES)
+
+    def register(self, name: str, *, max_concurrent: int, timeout_seconds: float, cache_seconds: float = 0,
+                 dependencies: Optional[List[str]] = None, env_keys: Optional[List[str]] = None, description: str = ""):
+        def decorator(handler: ToolHandler) -> ToolHandler:
+            self._tools[name] = Tool(
+                name,
+                handler,
+                max_concurrent=int(_env(name, "MAX_CONCURRENT", max_concurrent)),
+                timeout_seconds=_env(name, "TIMEOUT_SECONDS", timeout_seconds),
+                cache_seconds=_env(name, "CACHE_SECONDS", cache_seconds),
+                dependencies=dependencies or [],
+                env_keys=env_keys or [],
+                description=description,
+            )
+            return handler
+        return decorator
+
+    def get(self, name: str) -> Tool:
+        tool = self._tools.get(name)
+        if tool is None:
+            raise ToolError("UNKNOWN_TOOL", f"Unknown tool: {name}", 404)
+        return tool
+
+    async def events(self, name: str, prompt: str, options: Dict, uid: str) -> AsyncGenerator[Dict, None]:
+        """Run a tool and yield its events; the last one is the "result" (with "cached") or a ToolError is raised."""
+        tool = self.get(name)
+        if not (prompt or "").strip():
+            raise ToolError("INVALID_INPUT", "prompt required")
+        cache_key = self.cache.key(name, prompt, options) if tool.cache_seconds > 0 else None
+        if cache_key is not None:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                metrics.inc("tool_invocations", tool=name, outcome="cached")
+                yield {"type": "result", **cached, "cached": True}
+                return
+
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        deadline = started + tool.timeout_seconds
+        try:
+            await asyncio.wait_for(tool._sem.acquire(), tool.timeout_seconds)
+        except asyncio.TimeoutError:
+            metrics.inc("tool_invocations", tool=name, outcome="busy")
+            raise ToolError("TOOL_BUSY", f"Too many {name} requests in progress; retry shortly", 429, retry_after=1)
+        tool.in_flight += 1
+        # the span is only made current around each step: this generator may be resumed from other contexts
+        span = tracing.start_span(f"tool.{name}")
+        outcome = "error"
+        gen = tool.handler(prompt, options, uid)
+        try:
+            while True:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    raise asyncio.TimeoutError()
+                try:
+                    with tracing.use_span(span):
+                        event = await asyncio.wait_for(gen.__anext__(), remaining)
+                except StopAsyncIteration:
+                    break
+                if event.get("type") == "result":
+                    result = {k: v for k, v in event.items() if k != "type"}
+                    if cache_key is not None:
+                        self.cache.put(cache_key, result, tool.cache_seconds)
+                    outcome = "ok"
+                    yield {"cached": False, **event}
+                else:
+                    yield event
+        except asyncio.TimeoutError:
+            outcome = "timeout"
+            raise ToolError("TOOL_TIMEOUT", f"{name} did not finish within {tool.timeout_seconds:.0f}s", 504)
+        except ToolError as e:
+            span.record_exception(e)
+            raise
+        except (CircuitOpenError, BulkheadFullError, ShuttingDownError) as e:
+            outcome = "unavailable"
+            raise ToolError("TOOL_UNAVAILABLE", str(e), 503, retry_after=max(1, int(getattr(e, "retry_after", 1))))
+        except Exception as e:
+            span.record_exception(e)
+            logging.warning(f"Tool {name} failed: {type(e).__name__}: {e}")
+            raise ToolError("TOOL_FAILED", str(e), 502)
+        finally:
+            tool.in_flight -= 1
+            tool._sem.release()
+            await gen.aclose()
+            span.set_attribute("outcome", outcome)
+            span.end()
+            metrics.inc("tool_invocations", tool=name, outcome=outcome)
+            metrics.observe("tool_ms", (loop.time() - started) * 1000, tool=name)
+
+    async def invoke(self, name: str, prompt: str, options: Dict, uid: str) -> Dict:
+        result = None
+        async for event in self.events(name, prompt, options, uid):
+            if event.get("type") == "result":
+                result = event
+        if result is None:
+            raise ToolError("TOOL_FAILED", f"{name} returned no result", 502)
+        return {"success": True, "tool": name, **{k: v for k, v in result.items() if k != "type"}}
+
+    def health(self) -> Dict:
+        return {name: tool.health() for name, tool in self._tools.items()}
+
+
+tools = ToolRegistry()
+
+
+def _error_response(e: ToolError) -> JSONResponse:
+    headers = {"Retry-After": str(int(e.retry_after))} if e.retry_after else None
+    return JSONResponse(status_code=e.status_code, content={"success": False, "error": str(e), "code": e.code}, headers=headers)
+
+
+def _sse(event: Dict) -> str:
+    return f"event: {event.get('type', 'progress')}\ndata: {json.dumps({k: v for k, v in event.items() if k != 'type'})}\n\n"
+
+
+@router.post("/invoke")
+async def invoke_tool(body: ToolRequest, request: Request):
+    """Invoke a tool with the given prompt; with `stream: true`, progress and partial output arrive as SSE."""
+    uid = request.state.user["uid"]
+    if not body.stream:
+        try:
+            return await tools.invoke(body.tool, body.prompt, body.options, uid)
+        except ToolError as e:
+            return _error_response(e)
+
+    try:
+        tools.get(body.tool)
+    except ToolError as e:
+        return _error_response(e)
+
+    async def event_stream():
+        try:
+            async for event in tools.events(body.tool, body.prompt, body.options, uid):
+                yield _sse(event)
+        except ToolError as e:
+            yield _sse({"type": "error", "code": e.code, "message": str(e)})
+        yield _sse({"type": "done"})
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+
+@router.post("/invoke/batch")
+async def invoke_tool_batch(body: BatchToolRequest, request: Request):
+    """Invoke many tools concurrently and stream one NDJSON line per item as it completes.
+
+    Each line is the item's /tools/invoke response plus its `index` in the request; a final
+    {"done": true, ...} line summarizes the batch. Identical items (same tool, normalized prompt and
+    options) run once and share the result, but only for tools whose results are cacheable; items for
+    other tools (image, video, study) each run on their own.
+    """
+    uid = request.state.user["uid"]
+    items = body.requests
+    if not items:
+        return _error_response(ToolError("INVALID_INPUT", "requests must not be empty"))
+    if len(items) > TOOL_BATCH_MAX_ITEMS:
+        return _error_response(ToolError("BATCH_TOO_LARGE", f"At most {TOOL_BATCH_MAX_ITEMS} requests per batch", 413))
+    limit = max(1, min(TOOL_BATCH_CONCURRENCY, body.concurrency or TOOL_BATCH_CONCURRENCY))
+    sem = asyncio.Semaphore(limit)
+    metrics.observe("tool_batch_size", len(items))
+
+    async def run(group: List[int]) -> Tuple[List[int], Dict]:
+        item = items[group[0]]
+        async with sem:
+            try:
+                return group, await tools.invoke(item.tool, item.prompt, item.options, uid)
+            except ToolError as e:
+                return group, {"success": False, "tool": item.tool, "error": str(e), "code": e.code}
+
+    async def lines():
+        started = time.time()
+        groups: Dict[Tuple, List[int]] = {}
+        for i, item in enumerate(items):
+            tool = tools._tools.get(item.tool)
+            if tool is not None and tool.cache_seconds > 0:
+                groups.setdefault(tools.cache.key(item.tool, item.prompt, item.options), []).append(i)
+            else:
+                # side effects or per-call output (a job, a saved deck): duplicates are separate requests
+                groups[("item", i)] = [i]
+        # tracked so a shutdown drains the batch instead of dropping it mid-stream
+        tasks = [task_registry.spawn(run(group), "tool_batch") for group in groups.values()]
+        succeeded = 0
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                group, out = await next_done
+                for i in group:
+                    succeeded += bool(out.get("success"))
+                    yield json.dumps({"index": i, **out}, default=str) + "\n"
+            yield json.dumps({"done": True, "total": len(items), "succeeded": succeeded, "failed": len(items) - succeeded,
+                              "seconds": round(time.time() - started, 3)}) + "\n"
+        finally:
+            # client went away mid-batch: stop the work nobody will read
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+@public_router.get("/health")
 async def tools_health():
-    """Check tool availability"""
-    return {
-        "canvas": {"available": True, "status": "active"},
-        "study": {"available": True, "status": "active"},
-        "image": {"available": True, "status": "mock"},
-        "video": {"available": True, "status": "mock"},
-        "search": {"available": True, "status": "mock"},
-    }
+    """Tool availability derived from configuration, dependency probes and circuit breakers"""
+    return tools.health()
+
+
+def _model(options: Dict) -> str:
+    from .main import ALLOWED_MODELS
+    model = options.get("model") or os.getenv("DEFAULT_MODEL", "gemini-2.0-flash")
+    if model not in ALLOWED_MODELS:
+        raise ToolError("MODEL_NOT_ALLOWED", f"Model {model} is not permitted")
+    return model
+
+
+async def _gemini_text(prompt: str, options: Dict, system_context: str) -> AsyncGenerator[str, None]:
+    """Stream tokens from the routed Gemini model, with the same fallback as chat."""
+    from .chat import _gemini_token_stream
+    from .routing import router as model_router
+    model = _model(options)
+    async for token in model_router.stream(prompt, model, system_context, _gemini_token_stream, {}):
+        yield token
+
+
+@tools.register("search", max_concurrent=8, timeout_seconds=20, cache_seconds=300, dependencies=["tavily"],
+                env_keys=["TAVILY_API_KEY"], description="Web search with reranked results")
+async def search_tool(prompt: str, options: Dict, uid: str):
+    try:
+        from backend.services.search import multi_search
+    except Exception:
+        from services.search import multi_search
+    from .main import check_and_increment_grounding_quota
+    # the same per-user Tavily quota as grounded chat, charged once per invocation before the fan-out
+    if not await asyncio.to_thread(check_and_increment_grounding_quota, uid):
+        raise ToolError("QUOTA_EXCEEDED", "Grounded queries quota exceeded", 429, retry_after=3600 - time.time() % 3600)
+    yield {"type": "progress", "status": "searching"}
+    results = await multi_search(prompt, recency_days=options.get("recency_days"))
+    yield {"type": "result", "results": results}
+
+
+# not cached by the registry: results carry a per-user deck_id, and decks are cached by topic in app.study
+@tools.register("study", max_concurrent=4, timeout_seconds=90, dependencies=["gemini"],
+                env_keys=["GEMINI_API_KEY"], description="Flashcard decks generated by Gemini")
+async def study_tool(prompt: str, options: Dict, uid: str):
+    from .study import STUDY_DEFAULT_CARDS, StudyError, deck_events
+    events = deck_events(uid, prompt, int(options.get("count") or STUDY_DEFAULT_CARDS), _model(options))
+    try:
+        async for event in events:
+            yield event
+    except StudyError as e:
+        raise ToolError("INVALID_MODEL_OUTPUT", str(e), 502)
+
+
+@tools.register("canvas", max_concurrent=4, timeout_seconds=120, dependencies=["gemini"],
+                env_keys=["GEMINI_API_KEY"], description="Long-form writing drafted by Gemini")
+async def canvas_tool(prompt: str, options: Dict, uid: str):
+    text = []
+    async for token in _gemini_text(prompt, options, "You are a writing assistant. Produce a well-structured long-form draft in Markdown."):
+        text.append(token)
+        yield {"type": "delta", "text": token}
+    yield {"type": "result", "result": "".join(text)}
+
+
+def _job_body(prompt: str, options: Dict) -> Dict:
+    body = {k: options[k] for k in ("chat_id", "request_id", "model") if options.get(k)}
+    return {**body, "prompt": prompt}
+
+
+def _job_result(resp: JSONResponse) -> Dict:
+    content = json.loads(resp.body)
+    if resp.status_code != 200:
+        error = content.get("error") or {}
+        raise ToolError(error.get("code", "TOOL_FAILED"), error.get("message", "generation failed"), resp.status_code)
+    return content
+
+
+@tools.register("image", max_concurrent=4, timeout_seconds=150, dependencies=["nano_banana", "firestore"],
+                env_keys=["NANO_BANANA_API_KEY"], description="Image generation via the image job system")
+async def image_tool(prompt: str, options: Dict, uid: str):
+    from .main import message_doc_ref, start_image_job
+    job = _job_result(await start_image_job(uid, _job_body(prompt, options)))
+    yield {"type": "progress", "status": "generating", "chat_id": job["chat_id"], "message_id": job["message_id"]}
+    # the job runs in the background and records its outcome on the message; wait for it
+    ref = message_doc_ref(uid, job["chat_id"], job["message_id"])
+    while True:
+        snap = await asyncio.to_thread(ref.get)
+        data = (snap.to_dict() or {}) if snap.exists else {}
+        status = data.get("status")
+        if status in ("done", "error"):
+            break
+        await asyncio.sleep(TOOL_IMAGE_POLL_SECONDS)
+    if status == "error":
+        raise ToolError("GENERATION_FAILED", data.get("error") or "image generation failed", 502)
+    yield {"type": "result", "chat_id": job["chat_id"], "message_id": job["message_id"], "images": data.get("images") or []}
+
+
+@tools.register("video", max_concurrent=2, timeout_seconds=30, dependencies=["veo", "firestore"],
+                env_keys=["VEO_API_KEY"], description="Video generation via the video job system")
+async def video_tool(prompt: str, options: Dict, uid: str):
+    from .main import start_video_job
+    job = _job_result(await start_video_job(uid, _job_body(prompt, options)))
+    # rendering takes minutes; hand back the job to poll rather than holding the invocation open
+    yield {"type": "result", "status": "queued", "job_id": job["job_id"], "chat_id": job["chat_id"],
+           "message_id": job["message_id"], "status_url": f"/video/status/{job['job_id']}"}
@@ -1,10 +1,47 @@
-bind = '0.0.0.0:8000'
-# Worker count tuned for CPU; allow override via ENV var GUNICORN_WORKERS
 import multiprocessing, os
-workers = int(os.getenv("GUNICORN_WORKERS", str(max(2, multiprocessing.cpu_count() * 2))))
-worker_class = 'uvicorn.workers.UvicornWorker'
-# Graceful timeouts to allow streams to finish; keep shorter than platform hard timeout
+
+from uvicorn.workers import UvicornWorker
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+# Streaming serving mode: most requests are SSE connections idling on Gemini, so a worker spends its
+# time waiting, not computing. One worker per core (not 2x) with high per-worker connection
+# concurrency; the per-worker stream cap is STREAM_MAX_CONCURRENT (503 + Retry-After beyond it).
+workers = int(os.getenv("GUNICORN_WORKERS", str(max(2, multiprocessing.cpu_count()))))
+# For the async worker this is a heartbeat timeout (a worker whose event loop is blocked this long is
+# restarted), not a per-request limit, so long streams are unaffected by it.
 timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
-graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "30"))
+# How long in-flight streams get to finish on reload/shutdown. Uvicorn first waits up to
+# STREAM_DRAIN_SECONDS for open connections, then the app's shutdown hook waits up to
+# STREAM_DRAIN_SECONDS again for streams and background jobs, and SHUTDOWN_FLUSH_SECONDS more for
+# leftovers to mark themselves interrupted; this must cover all of it or the worker is killed.
+stream_drain_seconds = float(os.getenv("STREAM_DRAIN_SECONDS", "45"))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", str(int(2 * stream_drain_seconds + 10))))
 keepalive = int(os.getenv("GUNICORN_KEEPALIVE", "5"))
-preload_app = False
+# Pending TCP connections queued by the kernel during bursts of new streams
+backlog = int(os.getenv("GUNICORN_BACKLOG", "2048"))
+# Import the app once in the master and fork workers from it. Firebase and Gemini clients are
+# created lazily inside each worker (startup hook / first use), never in the master.
+preload_app = os.getenv("GUNICORN_PRELOAD", "1") == "1"
+
+
+class StreamingUvicornWorker(UvicornWorker):
+    # uvloop + httptools when installed (uvicorn[standard]); plain asyncio + h11 otherwise
+    CONFIG_KWARGS = {
+        "loop": "auto",
+        "http": "auto",
+        "timeout_graceful_shutdown": int(stream_drain_seconds),
+    }
+
+
+worker_class = StreamingUvicornWorker
+
+
+def post_fork(server, worker):
+    # Drop any Firebase app the master may have initialized so the worker builds its own gRPC
+    # channels instead of reusing file descriptors shared across fork().
+    import sys
+    firebase_admin = sys.modules.get("firebase_admin")
+    if firebase_admin is not None and firebase_admin._apps:
+        firebase_admin._apps.clear()
+    server.log.info("Worker spawned (pid: %s)", worker.pid)
+
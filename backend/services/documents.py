@@ -0,0 +1,190 @@
+import io
+import os
+import asyncio
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, List, Optional
+
+try:
+    from backend.services.rerank import CHARS_PER_TOKEN, bm25_scores, tokenize
+except Exception:
+    from services.rerank import CHARS_PER_TOKEN, bm25_scores, tokenize
+
+
+DOCUMENT_EXTRACT_WORKERS = int(os.getenv("DOCUMENT_EXTRACT_WORKERS", "2"))
+# text beyond this many characters is dropped at extraction time
+DOCUMENT_MAX_CHARS = int(os.getenv("DOCUMENT_MAX_CHARS", "2000000"))
+DOCUMENT_CHUNK_TOKENS = int(os.getenv("DOCUMENT_CHUNK_TOKENS", "300"))
+ATTACHMENT_CONTEXT_TOKENS = int(os.getenv("ATTACHMENT_CONTEXT_TOKENS", "3000"))
+
+ATTACHMENT_CONTEXT_HEADER = "The user attached the following files. Excerpts relevant to their request are below, labeled by file and page; use them when answering questions about the files."
+
+
+def extractable(content_type: str) -> bool:
+    ctype = (content_type or "").split(";")[0].strip().lower()
+    return ctype == "application/pdf" or ctype.startswith("text/")
+
+
+def _decode(data: bytes) -> str:
+    if data.startswith((b"\xff\xfe", b"\xfe\xff")):
+        return data.decode("utf-16", errors="replace")
+    try:
+        return data.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        return data.decode("cp1252", errors="replace")
+
+
+def _pdf_pages(data: bytes) -> List[str]:
+    from pypdf import PdfReader
+    reader = PdfReader(io.BytesIO(data))
+    pages = []
+    for page in reader.pages:
+        try:
+            pages.append(page.extract_text() or "")
+        except Exception:
+            # one unreadable page (bad font program, broken content stream) should not lose the rest
+            pages.append("")
+    return pages
+
+
+def chunk_pages(pages: List[str], chunk_tokens: int = DOCUMENT_CHUNK_TOKENS) -> List[Dict]:
+    """Split page texts into chunks of about `chunk_tokens`, never spanning pages.
+
+    Paragraphs are packed together while they fit; a paragraph longer than a chunk is cut at word
+    boundaries. Returns [{"page": n (1-based), "text"}] in document order.
+    """
+    limit = max(1, chunk_tokens) * CHARS_PER_TOKEN
+    chunks = []
+    for number, page in enumerate(pages, start=1):
+        current = ""
+        for para in page.split("\n\n"):
+            para = " ".join(para.split())
+            while para:
+                if current and len(current) + 2 + len(para) <= limit:
+                    current = f"{current}\n\n{para}"
+                    para = ""
+                    continue
+                if current:
+                    chunks.append({"page": number, "text": current})
+                    current = ""
+                if len(para) <= limit:
+                    current, para = para, ""
+                else:
+                    cut = para.rfind(" ", 0, limit)
+                    cut = cut if cut > limit // 2 else limit
+                    chunks.append({"page": number, "text": para[:cut].strip()})
+                    para = para[cut:].strip()
+        if current:
+            chunks.append({"page": number, "text": current})
+    return chunks
+
+
+def extract_document(data: bytes, content_type: str) -> Dict:
+    """Extract a PDF or text file's text and split it into page-level chunks.
+
+    Runs in a worker process. Text files are split into pages on form feeds. Returns
+    {"pages", "chars", "truncated", "chunks", "error"}; on failure (including pypdf not being
+    installed for a PDF) "chunks" is empty and "error" says why.
+    """
+    ctype = (content_type or "").split(";")[0].strip().lower()
+    try:
+        if ctype == "application/pdf":
+            pages = _pdf_pages(data)
+        else:
+            pages = _decode(data).split("\f")
+    except ImportError:
+        return {"pages": 0, "chars": 0, "truncated": False, "chunks": [], "error": "PDF support (pypdf) is not installed"}
+    except Exception as e:
+        return {"pages": 0, "chars": 0, "truncated": False, "chunks": [], "error": f"{type(e).__name__}: {e}"}
+
+    kept, total, truncated = [], 0, False
+    for page in pages:
+        if total + len(page) > DOCUMENT_MAX_CHARS:
+            kept.append(page[:DOCUMENT_MAX_CHARS - total])
+            truncated = True
+            break
+        kept.append(page)
+        total += len(page)
+    return {"pages": len(pages), "chars": sum(len(p) for p in kept), "truncated": truncated, "chunks": chunk_pages(kept), "error": None}
+
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # spawn rather than fork: workers must not inherit the parent's gRPC/Firebase state
+        _pool = ProcessPoolExecutor(max_workers=DOCUMENT_EXTRACT_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+
+def _discard_pool(pool: ProcessPoolExecutor):
+    """Shut down a broken pool (its surviving workers and management thread) so the next call starts a fresh one."""
+    global _pool
+    pool.shutdown(wait=False, cancel_futures=True)
+    if _pool is pool:
+        _pool = None
+
+
+async def extract(data: bytes, content_type: str) -> Dict:
+    """Run extract_document in the process pool so PDF parsing never blocks the event loop."""
+    pool = _get_pool()
+    try:
+        return await asyncio.get_running_loop().run_in_executor(pool, extract_document, data, content_type)
+    except BrokenProcessPool as e:
+        # a worker died (killed, out of memory on a hostile PDF): every pending job in this pool fails the same way
+        logging.warning(f"Document extraction pool broke, replacing it: {e}")
+        _discard_pool(pool)
+        error = e
+    except Exception as e:
+        # this document only; the pool itself is fine
+        logging.warning(f"Document extraction failed: {e}")
+        error = e
+    return {"pages": 0, "chars": 0, "truncated": False, "chunks": [], "error": f"{type(error).__name__}: {error}"}
+
+
+def shutdown_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def select_chunks(query: str, docs: List[Dict], *, token_budget: int = ATTACHMENT_CONTEXT_TOKENS) -> List[Dict]:
+    """Pick the chunks of the attached documents most relevant to `query` within a token budget.
+
+    `docs` is [{"name", "chunks", "tokens"}] where "tokens" holds each chunk's tokenized text. When
+    everything fits it is all returned; otherwise chunks are taken best BM25 score first (earlier
+    chunks win ties, so a query with no matching terms gets each document's opening) and skipped
+    when they would overflow the budget. The result is in document order:
+    [{"name", "page", "text", "score"}].
+    """
+    flat = [(d, i) for d in docs for i in range(len(d["chunks"]))]
+    budget = token_budget * CHARS_PER_TOKEN
+    if sum(len(d["chunks"][i]["text"]) for d, i in flat) <= budget:
+        picked = list(range(len(flat)))
+        scores = [0.0] * len(flat)
+    else:
+        scores = bm25_scores(tokenize(query), [d["tokens"][i] for d, i in flat])
+        picked, used = [], 0
+        for n in sorted(range(len(flat)), key=lambda n: (-scores[n], n)):
+            size = len(flat[n][0]["chunks"][flat[n][1]]["text"])
+            if used + size <= budget:
+                picked.append(n)
+                used += size
+        picked.sort()
+    out = []
+    for n in picked:
+        d, i = flat[n]
+        out.append({"name": d["name"], "page": d["chunks"][i]["page"], "text": d["chunks"][i]["text"], "score": round(scores[n], 4)})
+    return out
+
+
+def build_attachment_context(selected: List[Dict]) -> str:
+    parts = [ATTACHMENT_CONTEXT_HEADER]
+    for c in selected:
+        parts.append(f"[{c['name']}, page {c['page']}]\n{c['text']}")
+    return "\n\n".join(parts)
@@ -0,0 +1,157 @@
+import io
+import os
+import asyncio
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Optional
+
+
+IMAGE_THUMB_MAX_SIDE = int(os.getenv("IMAGE_THUMB_MAX_SIDE", "256"))
+IMAGE_WEB_MAX_SIDE = int(os.getenv("IMAGE_WEB_MAX_SIDE", "1280"))
+IMAGE_DERIVATIVE_QUALITY = int(os.getenv("IMAGE_DERIVATIVE_QUALITY", "75"))
+IMAGE_DERIVATIVE_WORKERS = int(os.getenv("IMAGE_DERIVATIVE_WORKERS", "2"))
+
+EXTENSIONS = {
+    "image/jpeg": "jpg",
+    "image/png": "png",
+    "image/webp": "webp",
+    "image/avif": "avif",
+    "image/gif": "gif",
+}
+
+
+def sniff_content_type(data: bytes, fallback: Optional[str] = None) -> str:
+    """Detect the image type from magic bytes; providers do not always send a usable Content-Type."""
+    head = data[:16]
+    if head.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    if head[4:12] in (b"ftypavif", b"ftypavis"):
+        return "image/avif"
+    if head[:6] in (b"GIF87a", b"GIF89a"):
+        return "image/gif"
+    ctype = (fallback or "").split(";")[0].strip().lower()
+    return ctype if ctype.startswith("image/") else "image/jpeg"
+
+
+def extension_for(content_type: str) -> str:
+    return EXTENSIONS.get(content_type, "img")
+
+
+def make_derivatives(data: bytes) -> Dict:
+    """Decode an image and encode thumbnail and web-sized variants.
+
+    Runs in a worker process. Each size is encoded as WebP and, when the Pillow build supports it,
+    AVIF; JPEG is used only if neither encoder is available. Variants that would not be smaller than
+    the original are skipped. Returns {"width", "height", "variants": [...]}, with no variants when
+    Pillow is not installed or the image cannot be decoded.
+    """
+    try:
+        from PIL import Image, ImageOps, features
+    except ImportError:
+        return {"width": None, "height": None, "variants": []}
+    try:
+        src = Image.open(io.BytesIO(data))
+        src = ImageOps.exif_transpose(src)
+    except Exception:
+        return {"width": None, "height": None, "variants": []}
+
+    formats = []
+    if features.check("avif"):
+        formats.append(("AVIF", "image/avif"))
+    if features.check("webp"):
+        formats.append(("WEBP", "image/webp"))
+    if not formats:
+        formats.append(("JPEG", "image/jpeg"))
+
+    out = []
+    for name, max_side in (("thumb", IMAGE_THUMB_MAX_SIDE), ("web", IMAGE_WEB_MAX_SIDE)):
+        img = src.copy()
+        if max(img.size) > max_side:
+            img.thumbnail((max_side, max_side), Image.LANCZOS)
+        for fmt, ctype in formats:
+            frame = img
+            if fmt == "JPEG" and frame.mode not in ("RGB", "L"):
+                frame = frame.convert("RGB")
+            elif frame.mode not in ("RGB", "RGBA", "L", "LA"):
+                frame = frame.convert("RGBA")
+            buf = io.BytesIO()
+            try:
+                frame.save(buf, fmt, quality=IMAGE_DERIVATIVE_QUALITY)
+            except Exception:
+                continue
+            encoded = buf.getvalue()
+            if len(encoded) >= len(data):
+                continue
+            out.append({"name": name, "contentType": ctype, "width": frame.width, "height": frame.height, "size": len(encoded), "data": encoded})
+    return {"width": src.width, "height": src.height, "variants": out}
+
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # spawn rather than fork: workers must not inherit the parent's gRPC/Firebase state
+        _pool = ProcessPoolExecutor(max_workers=IMAGE_DERIVATIVE_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+
+def _discard_pool(pool: ProcessPoolExecutor):
+    """Shut down a broken pool (its surviving workers and management thread) so the next call starts a fresh one."""
+    global _pool
+    pool.shutdown(wait=False, cancel_futures=True)
+    if _pool is pool:
+        _pool = None
+
+
+async def generate_derivatives(data: bytes) -> Dict:
+    """Run make_derivatives in the process pool so decoding/encoding never blocks the event loop."""
+    pool = _get_pool()
+    try:
+        return await asyncio.get_running_loop().run_in_executor(pool, make_derivatives, data)
+    except BrokenProcessPool as e:
+        # a worker died (killed, out of memory): every pending job in this pool fails the same way
+        logging.warning(f"Image derivative pool broke, replacing it: {e}")
+        _discard_pool(pool)
+    except Exception as e:
+        # this image only; the pool itself is fine
+        logging.warning(f"Image derivative generation failed: {e}")
+    return {"width": None, "height": None, "variants": []}
+
+
+def shutdown_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def pick_variant(image: Dict, width: Optional[int] = None, accept: Optional[str] = None) -> Dict:
+    """Choose the smallest stored rendition of an image entry that is adequate for the request.
+
+    Candidates are the original plus its variants whose format the client accepts; among those at
+    least `width` pixels wide the fewest bytes win. If none is wide enough, the widest candidate is
+    returned. Without a width the request is treated as a full view and thumbnails are excluded.
+    """
+    accept = (accept or "").lower()
+    candidates = [image]
+    for v in image.get("variants") or []:
+        ctype = v.get("contentType")
+        if ctype in ("image/avif", "image/webp") and ctype not in accept:
+            continue
+        candidates.append(v)
+    if not width:
+        candidates = [c for c in candidates if c.get("name") != "thumb"]
+    else:
+        wide = [c for c in candidates if (c.get("width") or 0) >= width or c is image and not c.get("width")]
+        if not wide:
+            return max(candidates, key=lambda c: c.get("width") or 0)
+        candidates = wide
+    return min(candidates, key=lambda c: c.get("size") or float("inf"))
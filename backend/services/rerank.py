@@ -0,0 +1,136 @@
+import math
+import os
+import re
+from collections import Counter
+from typing import Dict, List, Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+
+RERANK_MAX_PER_DOMAIN = int(os.getenv("RERANK_MAX_PER_DOMAIN", "2"))
+GROUNDING_CONTEXT_TOKENS = int(os.getenv("GROUNDING_CONTEXT_TOKENS", "1500"))
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Rough chars-per-token ratio used to size the grounding context without a tokenizer
+CHARS_PER_TOKEN = 4
+
+GROUNDING_CONTEXT_HEADER = "You have access to the following web search results. Cite sources using [n] markers where n is the index. Use only these sources for factual claims and never invent URLs."
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+_STOPWORDS = frozenset(
+    "a an and are as at be but by for from has have how i in is it its of on or that the this to was were what when where which who why will with you your".split()
+)
+_TRACKING_PARAMS = ("utm_", "fbclid", "gclid", "mc_cid", "mc_eid", "ref", "ref_src")
+
+
+def tokenize(text: str) -> List[str]:
+    return [t for t in _TOKEN_RE.findall((text or "").lower()) if t not in _STOPWORDS]
+
+
+def canonical_url(url: str) -> str:
+    """Normalize a URL for duplicate detection: no scheme, www., fragment, tracking params or trailing slash."""
+    try:
+        parts = urlsplit((url or "").strip())
+    except ValueError:
+        return (url or "").strip().lower()
+    host = (parts.hostname or "").lower()
+    if host.startswith("www."):
+        host = host[4:]
+    path = parts.path.rstrip("/")
+    query = [(k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True) if not k.lower().startswith(_TRACKING_PARAMS)]
+    q = urlencode(sorted(query))
+    return f"{host}{path}" + (f"?{q}" if q else "")
+
+
+def domain_of(url: str) -> str:
+    return canonical_url(url).split("/", 1)[0].split("?", 1)[0]
+
+
+def bm25_scores(query_tokens: List[str], docs: List[List[str]]) -> List[float]:
+    """Okapi BM25 of each tokenized document against the query, with IDF computed over `docs`."""
+    n = len(docs)
+    if not n or not query_tokens:
+        return [0.0] * n
+    avgdl = (sum(len(d) for d in docs) / n) or 1.0
+    freqs = [Counter(d) for d in docs]
+    terms = set(query_tokens)
+    df = {t: sum(1 for f in freqs if t in f) for t in terms}
+    idf = {t: math.log(1 + (n - df[t] + 0.5) / (df[t] + 0.5)) for t in terms}
+    scores = []
+    for doc, f in zip(docs, freqs):
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * len(doc) / avgdl)
+        score = 0.0
+        for t in query_tokens:
+            tf = f.get(t)
+            if tf:
+                score += idf[t] * tf * (BM25_K1 + 1) / (tf + norm)
+        scores.append(score)
+    return scores
+
+
+def rerank(query: str, results: List[Dict], *, max_results: Optional[int] = None, max_per_domain: int = RERANK_MAX_PER_DOMAIN) -> List[Dict]:
+    """Score results against the query with BM25 over title+snippet, drop duplicates and re-index.
+
+    Duplicates (same canonical URL) keep the best-scoring copy, at most `max_per_domain` results are
+    kept per domain, and ties fall back to the newest published_date, then provider order.
+    """
+    docs = [tokenize(f"{r.get('title') or ''} {r.get('snippet') or ''}") for r in results]
+    scores = bm25_scores(tokenize(query), docs)
+    order = sorted(
+        range(len(results)),
+        key=lambda i: (-scores[i], _negated_date(results[i].get("published_date")), i),
+    )
+
+    seen_urls = set()
+    per_domain: Dict[str, int] = {}
+    out = []
+    for i in order:
+        r = results[i]
+        url_key = canonical_url(r.get("url") or "")
+        if url_key and url_key in seen_urls:
+            continue
+        domain = domain_of(r.get("url") or "")
+        if domain and per_domain.get(domain, 0) >= max_per_domain:
+            continue
+        seen_urls.add(url_key)
+        if domain:
+            per_domain[domain] = per_domain.get(domain, 0) + 1
+        out.append({**r, "score": round(scores[i], 4)})
+        if max_results and len(out) >= max_results:
+            break
+
+    for idx, r in enumerate(out, start=1):
+        r["index"] = idx
+    return out
+
+
+def _negated_date(pd) -> str:
+    # sort key so that newer ISO dates come first and undated results last among equal scores
+    if not pd:
+        return "￿"
+    return "".join(chr(0xFFFF - ord(c)) for c in str(pd))
+
+
+def build_grounding_context(results: List[Dict], *, token_budget: int = GROUNDING_CONTEXT_TOKENS) -> str:
+    """Pack numbered result summaries (best first) into the system context within a token budget.
+
+    The last result that does not fit whole has its snippet cut at a word boundary; results after
+    the budget is exhausted are left out (their citations are still stored on the message).
+    """
+    budget = token_budget * CHARS_PER_TOKEN - len(GROUNDING_CONTEXT_HEADER)
+    lines = [GROUNDING_CONTEXT_HEADER]
+    for r in results:
+        pd = r.get("published_date")
+        pd_str = f" ({pd})" if pd else ""
+        prefix = f"[{r.get('index')}] {r.get('title')}{pd_str}: "
+        snippet = (r.get("snippet") or "").strip()
+        room = budget - len(prefix) - 1
+        if room <= 0:
+            break
+        if len(snippet) > room:
+            cut = snippet[:room].rsplit(" ", 1)[0]
+            if len(cut) < 40:
+                break
+            snippet = cut + "…"
+        lines.append(prefix + snippet)
+        budget -= len(lines[-1]) + 1
+    return "\n".join(lines)
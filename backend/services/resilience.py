@@ -0,0 +1,315 @@
+import os
+import time
+import asyncio
+import threading
+from contextlib import asynccontextmanager, contextmanager
+from typing import Dict, Optional
+
+
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RECOVERY_SECONDS = float(os.getenv("BREAKER_RECOVERY_SECONDS", "30"))
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised when a call is rejected because the dependency's breaker is open."""
+
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"{name} is temporarily unavailable (circuit open, retry in {retry_after:.0f}s)")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class BulkheadFullError(RuntimeError):
+    """Raised when a dependency already has its maximum number of calls in flight."""
+
+    def __init__(self, name: str, limit: int):
+        super().__init__(f"{name} is at capacity ({limit} concurrent calls); try again shortly")
+        self.name = name
+        self.limit = limit
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker.
+
+    After `failure_threshold` consecutive failures the breaker opens and rejects calls for
+    `recovery_seconds`; then a single trial call is let through (half-open). Its success closes the
+    breaker, its failure re-opens it for another recovery period. Thread-safe, so it can guard calls
+    made from worker threads as well as the event loop.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = BREAKER_FAILURE_THRESHOLD, recovery_seconds: float = BREAKER_RECOVERY_SECONDS):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_seconds = recovery_seconds
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+        self.total_failures = 0
+        self.total_rejections = 0
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == OPEN and time.time() - self._opened_at >= self.recovery_seconds:
+                return HALF_OPEN
+            return self._state
+
+    def allow(self) -> bool:
+        """Whether a call may proceed now. In half-open state only one trial call is admitted."""
+        with self._lock:
+            if self._state == CLOSED:
+                return True
+            if self._state == OPEN and time.time() - self._opened_at < self.recovery_seconds:
+                self.total_rejections += 1
+                return False
+            if self._trial_in_flight:
+                self.total_rejections += 1
+                return False
+            self._state = HALF_OPEN
+            self._trial_in_flight = True
+            return True
+
+    def check(self):
+        """Like allow(), but raises CircuitOpenError instead of returning False."""
+        if not self.allow():
+            raise CircuitOpenError(self.name, self.retry_after())
+
+    def retry_after(self) -> float:
+        with self._lock:
+            return max(0.0, self.recovery_seconds - (time.time() - self._opened_at)) if self._state != CLOSED else 0.0
+
+    def record_success(self):
+        with self._lock:
+            self._state = CLOSED
+            self._failures = 0
+            self._trial_in_flight = False
+
+    def release_trial(self):
+        """End a half-open trial whose outcome says nothing about the dependency (e.g. it was cancelled)."""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.total_failures += 1
+            self._failures += 1
+            self._trial_in_flight = False
+            if self._state == HALF_OPEN or self._failures >= self.failure_threshold:
+                self._state = OPEN
+                self._opened_at = time.time()
+
+    def snapshot(self) -> Dict:
+        state = self.state
+        return {
+            "state": state,
+            "consecutive_failures": self._failures,
+            "total_failures": self.total_failures,
+            "rejections": self.total_rejections,
+            "retry_after_seconds": round(self.retry_after(), 1) if state == OPEN else 0,
+        }
+
+
+class AdaptiveTimeout:
+    """Timeout derived from observed latency, like TCP's retransmission timeout.
+
+    Keeps a smoothed latency and mean deviation of successful calls and returns
+    srtt + 4 * rttvar, clamped to [min_seconds, max_seconds]. Until enough samples are seen the
+    configured default is used, so a cold dependency keeps its previous behaviour.
+    """
+
+    MIN_SAMPLES = 10
+
+    def __init__(self, default_seconds: float, min_seconds: float, max_seconds: float):
+        self.default_seconds = default_seconds
+        self.min_seconds = min_seconds
+        self.max_seconds = max_seconds
+        self._srtt: Optional[float] = None
+        self._rttvar = 0.0
+        self.samples = 0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float):
+        with self._lock:
+            self.samples += 1
+            if self._srtt is None:
+                self._srtt, self._rttvar = seconds, seconds / 2
+            else:
+                self._rttvar = 0.75 * self._rttvar + 0.25 * abs(self._srtt - seconds)
+                self._srtt = 0.875 * self._srtt + 0.125 * seconds
+
+    def current(self) -> float:
+        with self._lock:
+            if self.samples < self.MIN_SAMPLES or self._srtt is None:
+                return self.default_seconds
+            return min(self.max_seconds, max(self.min_seconds, self._srtt + 4 * self._rttvar))
+
+
+class Dependency:
+    """Circuit breaker + concurrency bulkhead + adaptive timeout for one external dependency.
+
+    Use `async with dep.slot():` around async calls and `with dep.slot_sync():` around blocking calls
+    made from worker threads; both reject immediately when the breaker is open (CircuitOpenError) or
+    when `max_concurrent` calls are already in flight (BulkheadFullError), and record the outcome.
+    Pass `dep.timeout()` as the call's own timeout so slow dependencies are cut off at a bound that
+    follows their real latency rather than a fixed worst case.
+    """
+
+    def __init__(self, name: str, *, max_concurrent: int, timeout_seconds: float, min_timeout_seconds: float,
+                 max_timeout_seconds: Optional[float] = None, failure_threshold: Optional[int] = None,
+                 recovery_seconds: Optional[float] = None):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.breaker = get_breaker(name, failure_threshold, recovery_seconds)
+        self.adaptive = AdaptiveTimeout(timeout_seconds, min_timeout_seconds, max_timeout_seconds or timeout_seconds)
+        self._in_flight = 0
+        self._lock = threading.Lock()
+
+    def timeout(self) -> float:
+        return self.adaptive.current()
+
+    def available(self) -> bool:
+        """Cheap pre-check for request handlers: False while the breaker is open."""
+        return self.breaker.state != OPEN
+
+    def _enter(self):
+        with self._lock:
+            if self._in_flight >= self.max_concurrent:
+                raise BulkheadFullError(self.name, self.max_concurrent)
+            self._in_flight += 1
+        try:
+            self.breaker.check()
+        except CircuitOpenError:
+            with self._lock:
+                self._in_flight -= 1
+            raise
+        return time.time()
+
+    def _exit(self, started: float, ok: Optional[bool]):
+        with self._lock:
+            self._in_flight -= 1
+        if ok is None:
+            self.breaker.release_trial()
+        elif ok:
+            self.adaptive.observe(time.time() - started)
+            self.breaker.record_success()
+        else:
+            self.breaker.record_failure()
+
+    def record(self, ok: bool, seconds: Optional[float] = None):
+        """Report the outcome of a call made without a slot (e.g. a health probe)."""
+        if ok:
+            if seconds is not None:
+                self.adaptive.observe(seconds)
+            self.breaker.record_success()
+        else:
+            self.breaker.record_failure()
+
+    @asynccontextmanager
+    async def slot(self):
+        started = self._enter()
+        ok = False
+        try:
+            yield
+            ok = True
+        except (asyncio.CancelledError, GeneratorExit):
+            # the caller gave up (client disconnected, stream closed early): neither a success nor a failure
+            ok = None
+            raise
+        finally:
+            self._exit(started, ok)
+
+    @contextmanager
+    def slot_sync(self):
+        started = self._enter()
+        ok = False
+        try:
+            yield
+            ok = True
+        finally:
+            self._exit(started, ok)
+
+    def snapshot(self) -> Dict:
+        return {
+            **self.breaker.snapshot(),
+            "in_flight": self._in_flight,
+            "max_concurrent": self.max_concurrent,
+            "timeout_seconds": round(self.timeout(), 2),
+        }
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(name: str, failure_threshold: Optional[int] = None, recovery_seconds: Optional[float] = None) -> CircuitBreaker:
+    """Process-wide breaker for a named dependency, created on first use."""
+    with _breakers_lock:
+        b = _breakers.get(name)
+        if b is None:
+            b = CircuitBreaker(
+                name,
+                failure_threshold if failure_threshold is not None else BREAKER_FAILURE_THRESHOLD,
+                recovery_seconds if recovery_seconds is not None else BREAKER_RECOVERY_SECONDS,
+            )
+            _breakers[name] = b
+        return b
+
+
+def breaker_states() -> Dict[str, Dict]:
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    return {b.name: b.snapshot() for b in breakers}
+
+
+def _env_int(name: str, default: int) -> int:
+    return int(os.getenv(name, str(default)))
+
+
+def _env_float(name: str, default: float) -> float:
+    return float(os.getenv(name, str(default)))
+
+
+# name -> (max concurrent calls, default timeout, min adaptive timeout, max adaptive timeout)
+_DEFAULTS = {
+    "tavily": (16, 15.0, 2.0, 15.0),
+    "nano_banana": (8, 120.0, 20.0, 120.0),
+    "veo": (8, 30.0, 5.0, 30.0),
+    # the slot is held for a whole chat stream, so the cap follows the stream admission limit, with
+    # headroom for tool and study generations that are not admitted as streams
+    "gemini": (int(os.getenv("STREAM_MAX_CONCURRENT", "500")) + 64, 60.0, 10.0, 60.0),
+    "firestore": (256, 30.0, 5.0, 30.0),
+}
+
+_dependencies: Dict[str, Dependency] = {}
+_dependencies_lock = threading.Lock()
+
+
+def get_dependency(name: str) -> Dependency:
+    """Process-wide Dependency guard, configured from <NAME>_MAX_CONCURRENT / <NAME>_TIMEOUT_SECONDS /
+    <NAME>_MIN_TIMEOUT_SECONDS env vars with per-dependency defaults."""
+    with _dependencies_lock:
+        dep = _dependencies.get(name)
+        if dep is None:
+            limit, timeout, min_timeout, max_timeout = _DEFAULTS.get(name, (32, 30.0, 5.0, 30.0))
+            prefix = name.upper()
+            dep = Dependency(
+                name,
+                max_concurrent=_env_int(f"{prefix}_MAX_CONCURRENT", limit),
+                timeout_seconds=_env_float(f"{prefix}_TIMEOUT_SECONDS", timeout),
+                min_timeout_seconds=_env_float(f"{prefix}_MIN_TIMEOUT_SECONDS", min_timeout),
+                max_timeout_seconds=_env_float(f"{prefix}_TIMEOUT_SECONDS", max_timeout),
+            )
+            _dependencies[name] = dep
+        return dep
+
+
+def dependency_states() -> Dict[str, Dict]:
+    with _dependencies_lock:
+        deps = list(_dependencies.values())
+    return {d.name: d.snapshot() for d in deps}
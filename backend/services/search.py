@@ -1,12 +1,81 @@
 import os
+import re
+import time
+import asyncio
+import threading
 import requests
+from collections import OrderedDict
 from typing import List, Dict, Optional
 
+from .rerank import rerank, tokenize
+from .resilience import get_dependency
+from . import tracing
+
 
 TAVILY_ENDPOINT = os.getenv("TAVILY_ENDPOINT", "https://api.tavily.example/search")
 TAVILY_API_KEY = os.getenv("TAVILY_API_KEY")
 TAVILY_SEARCH_DEPTH = os.getenv("TAVILY_SEARCH_DEPTH", "advanced")
 TAVILY_MAX_RESULTS = int(os.getenv("TAVILY_MAX_RESULTS", "5"))
+# Candidates requested from the provider before reranking down to TAVILY_MAX_RESULTS
+TAVILY_CANDIDATE_RESULTS = int(os.getenv("TAVILY_CANDIDATE_RESULTS", str(max(10, TAVILY_MAX_RESULTS * 2))))
+
+SEARCH_CACHE_TTL_SECONDS = int(os.getenv("SEARCH_CACHE_TTL_SECONDS", "300"))
+SEARCH_CACHE_MAX_ENTRIES = int(os.getenv("SEARCH_CACHE_MAX_ENTRIES", "512"))
+
+# Query planning for long grounded prompts
+SEARCH_FANOUT_MIN_CHARS = int(os.getenv("SEARCH_FANOUT_MIN_CHARS", "240"))
+SEARCH_MAX_SUBQUERIES = int(os.getenv("SEARCH_MAX_SUBQUERIES", "4"))
+SEARCH_FANOUT_CONCURRENCY = int(os.getenv("SEARCH_FANOUT_CONCURRENCY", "3"))
+SEARCH_FANOUT_MAX_RESULTS = int(os.getenv("SEARCH_FANOUT_MAX_RESULTS", "8"))
+SEARCH_SUBQUERY_MAX_CHARS = int(os.getenv("SEARCH_SUBQUERY_MAX_CHARS", "300"))
+
+
+class _SearchCache:
+    """Thread-safe TTL + LRU cache of reranked results keyed by (normalized query, recency_days)."""
+
+    def __init__(self, ttl: int, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._data: "OrderedDict[tuple, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(query: str, recency_days: Optional[int]) -> tuple:
+        return (" ".join(query.lower().split()), recency_days)
+
+    def get(self, key: tuple) -> Optional[List[Dict]]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or item[0] < time.time():
+                if item is not None:
+                    del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return [dict(r) for r in item[1]]
+
+    def put(self, key: tuple, results: List[Dict]):
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            self._data[key] = (time.time() + self.ttl, [dict(r) for r in results])
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {"entries": len(self._data), "hits": self.hits, "misses": self.misses}
+
+
+_cache = _SearchCache(SEARCH_CACHE_TTL_SECONDS, SEARCH_CACHE_MAX_ENTRIES)
+
+
+def search_cache_stats() -> Dict:
+    return _cache.stats()
 
 
 def _normalize_result(raw: Dict, index: int) -> Dict:
@@ -29,24 +98,41 @@ def _normalize_result(raw: Dict, index: int) -> Dict:
 def web_search(query: str, *, recency_days: Optional[int] = None) -> List[Dict]:
     """Run a web search via Tavily API and return a deterministic list of SearchResult dicts.
 
-    Each result: {title, url, snippet, published_date, source, index}
+    Provider candidates are reranked against the query (BM25 over title+snippet) and deduplicated
+    by canonical URL before being cut to TAVILY_MAX_RESULTS.
+
+    Each result: {title, url, snippet, published_date, source, index, score}
     """
     if not TAVILY_API_KEY:
         raise RuntimeError("TAVILY_API_KEY not configured")
 
-    payload = {"q": query, "depth": TAVILY_SEARCH_DEPTH, "max_results": TAVILY_MAX_RESULTS}
+    cache_key = _cache.key(query, recency_days)
+    cached = _cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    payload = {"q": query, "depth": TAVILY_SEARCH_DEPTH, "max_results": TAVILY_CANDIDATE_RESULTS}
     if recency_days:
         payload["recency_days"] = recency_days
 
     headers = {"Authorization": f"Bearer {TAVILY_API_KEY}", "Content-Type": "application/json"}
+    dep = get_dependency("tavily")
     try:
-        r = requests.post(TAVILY_ENDPOINT, json=payload, headers=headers, timeout=15)
+        # fails fast while the breaker is open or too many searches are in flight
+        with dep.slot_sync(), tracing.span("search.tavily", kind="client", depth=TAVILY_SEARCH_DEPTH) as span:
+            parent = tracing.traceparent()
+            if parent:
+                headers["traceparent"] = parent
+            r = requests.post(TAVILY_ENDPOINT, json=payload, headers=headers, timeout=dep.timeout())
+            span.set_attribute("http.status_code", r.status_code)
+            if r.status_code != 200:
+                raise RuntimeError(f"Tavily API returned status {r.status_code}")
+    except RuntimeError:
+        # includes CircuitOpenError / BulkheadFullError, whose messages are shown to the user as is
+        raise
     except Exception as e:
         raise RuntimeError(f"Tavily request failed: {e}")
 
-    if r.status_code != 200:
-        raise RuntimeError(f"Tavily API returned status {r.status_code}")
-
     try:
         data = r.json()
     except Exception:
@@ -55,17 +141,84 @@ def web_search(query: str, *, recency_days: Optional[int] = None) -> List[Dict]:
     raw_results = data.get("results") or data.get("items") or []
 
     results = []
-    for i, item in enumerate(raw_results[:TAVILY_MAX_RESULTS], start=1):
+    for i, item in enumerate(raw_results[:TAVILY_CANDIDATE_RESULTS], start=1):
         results.append(_normalize_result(item, i))
 
-    # Deterministic ordering: sort by published_date (newest first) then by title
-    def _key(x):
-        pd = x.get("published_date") or ""
-        return (pd, x.get("title") or "")
+    # Deterministic ordering by relevance to the query; rerank re-indexes from 1
+    results = rerank(query, results, max_results=TAVILY_MAX_RESULTS)
+    _cache.put(cache_key, results)
+    return results
+
 
-    results = sorted(results, key=_key, reverse=True)
-    # Re-index deterministically
-    for idx, r in enumerate(results, start=1):
-        r["index"] = idx
+_SENTENCE_RE = re.compile(r"[^.?!;\n]+[.?!;]?")
 
-    return results
+
+def plan_queries(prompt: str, *, max_queries: int = SEARCH_MAX_SUBQUERIES) -> List[str]:
+    """Split a long prompt into a few focused search queries.
+
+    Short prompts are searched verbatim. Longer prompts are split into sentences; sentences with at
+    least three content terms are candidates, questions and term-dense sentences win, near-duplicate
+    candidates are dropped, and the chosen queries keep their order in the prompt.
+    """
+    prompt = (prompt or "").strip()
+    if len(prompt) <= SEARCH_FANOUT_MIN_CHARS or max_queries <= 1:
+        return [_clip(prompt)]
+
+    candidates = []
+    for pos, m in enumerate(_SENTENCE_RE.finditer(prompt)):
+        text = " ".join(m.group(0).split())
+        terms = set(tokenize(text))
+        if len(terms) < 3:
+            continue
+        score = len(terms) + (3 if text.endswith("?") else 0)
+        candidates.append((score, pos, text, terms))
+
+    chosen = []
+    for score, pos, text, terms in sorted(candidates, key=lambda c: (-c[0], c[1])):
+        if any(len(terms & t) / len(terms | t) > 0.6 for _, _, _, t in chosen):
+            continue
+        chosen.append((score, pos, text, terms))
+        if len(chosen) >= max_queries:
+            break
+
+    if not chosen:
+        return [_clip(prompt)]
+    return [_clip(text) for _, _, text, _ in sorted(chosen, key=lambda c: c[1])]
+
+
+def _clip(text: str) -> str:
+    if len(text) <= SEARCH_SUBQUERY_MAX_CHARS:
+        return text
+    return text[:SEARCH_SUBQUERY_MAX_CHARS].rsplit(" ", 1)[0]
+
+
+async def multi_search(prompt: str, *, recency_days: Optional[int] = None, max_concurrency: int = SEARCH_FANOUT_CONCURRENCY) -> List[Dict]:
+    """Search a prompt via one or more planned sub-queries and merge the results.
+
+    Sub-queries run concurrently (at most `max_concurrency` provider calls at once) and each goes
+    through web_search, so each hits the search cache on its own. Merged results are reranked against
+    the whole prompt, which also drops duplicates found by several sub-queries. Fails only if every
+    sub-query fails.
+    """
+    queries = plan_queries(prompt)
+    with tracing.span("search.multi", queries=len(queries)):
+        if len(queries) == 1:
+            return await asyncio.to_thread(web_search, queries[0], recency_days=recency_days)
+
+        sem = asyncio.Semaphore(max(1, max_concurrency))
+
+        async def run(q: str):
+            async with sem:
+                return await asyncio.to_thread(web_search, q, recency_days=recency_days)
+
+        outcomes = await asyncio.gather(*(run(q) for q in queries), return_exceptions=True)
+    merged = []
+    errors = []
+    for out in outcomes:
+        if isinstance(out, BaseException):
+            errors.append(out)
+        else:
+            merged.extend(out)
+    if errors and len(errors) == len(outcomes):
+        raise errors[0]
+    return rerank(prompt, merged, max_results=SEARCH_FANOUT_MAX_RESULTS)
@@ -0,0 +1,221 @@
+import os
+import abc
+import hmac
+import json
+import time
+import hashlib
+import tempfile
+from datetime import timedelta
+from typing import Dict, Iterator, Optional
+from urllib.parse import quote
+
+
+STORAGE_LOCAL_ROOT = os.getenv("STORAGE_LOCAL_ROOT", os.path.join(tempfile.gettempdir(), "gemini-storage"))
+STORAGE_PUBLIC_BASE_URL = os.getenv("STORAGE_PUBLIC_BASE_URL", "")
+STORAGE_SIGNING_SECRET = os.getenv("STORAGE_SIGNING_SECRET") or os.getenv("JWT_SECRET") or ""
+STORAGE_CHUNK_SIZE = 64 * 1024
+
+
+class StorageBackend(abc.ABC):
+    """Blob storage keyed by slash-separated paths such as attachments/{uid}/{id}/{filename}.
+
+    Methods are blocking; call them from worker threads (asyncio.to_thread) inside request handlers.
+    """
+
+    @abc.abstractmethod
+    def put(self, key: str, data: bytes, content_type: str) -> Dict:
+        """Store bytes under key and return {"storagePath", "url", "size", "contentType"}."""
+        ...
+
+    @abc.abstractmethod
+    def get(self, key: str) -> bytes:
+        ...
+
+    @abc.abstractmethod
+    def stat(self, key: str) -> Optional[Dict]:
+        """Return {"size", "contentType"} or None if the object does not exist."""
+        ...
+
+    @abc.abstractmethod
+    def stream(self, key: str, start: int = 0, end: Optional[int] = None, chunk_size: int = STORAGE_CHUNK_SIZE) -> Iterator[bytes]:
+        """Yield the bytes in [start, end] (inclusive, like HTTP ranges) in chunks."""
+        ...
+
+    @abc.abstractmethod
+    def delete(self, key: str) -> bool:
+        ...
+
+    @abc.abstractmethod
+    def signed_url(self, key: str, expires_in: int = 3600) -> str:
+        ...
+
+    def local_path(self, key: str) -> Optional[str]:
+        """Filesystem path of the object when it can be served zero-copy, else None."""
+        return None
+
+
+class FirebaseStorageBackend(StorageBackend):
+    def __init__(self, bucket_name: str):
+        self.bucket_name = bucket_name
+        self._bucket = None
+
+    @property
+    def bucket(self):
+        if self._bucket is None:
+            from firebase_admin import storage
+            self._bucket = storage.bucket(self.bucket_name)
+        return self._bucket
+
+    def put(self, key: str, data: bytes, content_type: str) -> Dict:
+        blob = self.bucket.blob(key)
+        blob.upload_from_string(data, content_type=content_type)
+        return {"storagePath": key, "url": blob.public_url, "size": len(data), "contentType": content_type}
+
+    def get(self, key: str) -> bytes:
+        return self.bucket.blob(key).download_as_bytes()
+
+    def stat(self, key: str) -> Optional[Dict]:
+        blob = self.bucket.get_blob(key)
+        if blob is None:
+            return None
+        return {"size": blob.size, "contentType": blob.content_type or "application/octet-stream"}
+
+    def stream(self, key: str, start: int = 0, end: Optional[int] = None, chunk_size: int = STORAGE_CHUNK_SIZE) -> Iterator[bytes]:
+        blob = self.bucket.blob(key)
+        if end is None:
+            st = self.stat(key)
+            end = (st["size"] if st else 0) - 1
+        pos = start
+        while pos <= end:
+            stop = min(end, pos + chunk_size * 16 - 1)
+            yield blob.download_as_bytes(start=pos, end=stop)
+            pos = stop + 1
+
+    def delete(self, key: str) -> bool:
+        try:
+            self.bucket.blob(key).delete()
+            return True
+        except Exception:
+            return False
+
+    def signed_url(self, key: str, expires_in: int = 3600) -> str:
+        return self.bucket.blob(key).generate_signed_url(version="v4", expiration=timedelta(seconds=expires_in))
+
+
+class LocalStorageBackend(StorageBackend):
+    """Filesystem storage under a root directory, sharded as {root}/ab/cd/{sha256(key)}.
+
+    Writes go to a temp file in the target directory and are renamed into place, so readers never
+    see partial objects. A JSON sidecar keeps the original key and content type.
+    """
+
+    def __init__(self, root: str = STORAGE_LOCAL_ROOT):
+        self.root = root
+
+    def _path(self, key: str) -> str:
+        digest = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.root, digest[:2], digest[2:4], digest)
+
+    def _write_atomic(self, dest: str, data: bytes):
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(dest), prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, dest)
+        except Exception:
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+            raise
+
+    def put(self, key: str, data: bytes, content_type: str) -> Dict:
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._write_atomic(path, data)
+        meta = {"key": key, "contentType": content_type, "size": len(data), "createdAt": time.time()}
+        self._write_atomic(path + ".json", json.dumps(meta).encode("utf-8"))
+        return {"storagePath": key, "url": f"{STORAGE_PUBLIC_BASE_URL}/storage/{quote(key)}", "size": len(data), "contentType": content_type}
+
+    def get(self, key: str) -> bytes:
+        with open(self._path(key), "rb") as f:
+            return f.read()
+
+    def stat(self, key: str) -> Optional[Dict]:
+        path = self._path(key)
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return None
+        content_type = "application/octet-stream"
+        try:
+            with open(path + ".json", "rb") as f:
+                content_type = json.loads(f.read()).get("contentType") or content_type
+        except (OSError, ValueError):
+            pass
+        return {"size": size, "contentType": content_type}
+
+    def stream(self, key: str, start: int = 0, end: Optional[int] = None, chunk_size: int = STORAGE_CHUNK_SIZE) -> Iterator[bytes]:
+        fd = os.open(self._path(key), os.O_RDONLY)
+        try:
+            if end is None:
+                end = os.fstat(fd).st_size - 1
+            pos = start
+            while pos <= end:
+                chunk = os.pread(fd, min(chunk_size, end - pos + 1), pos)
+                if not chunk:
+                    break
+                pos += len(chunk)
+                yield chunk
+        finally:
+            os.close(fd)
+
+    def delete(self, key: str) -> bool:
+        path = self._path(key)
+        removed = False
+        for p in (path, path + ".json"):
+            try:
+                os.unlink(p)
+                removed = True
+            except FileNotFoundError:
+                pass
+        return removed
+
+    def signed_url(self, key: str, expires_in: int = 3600) -> str:
+        if not STORAGE_SIGNING_SECRET:
+            raise RuntimeError("STORAGE_SIGNING_SECRET not configured")
+        expires = int(time.time()) + expires_in
+        return f"{STORAGE_PUBLIC_BASE_URL}/storage/{quote(key)}?expires={expires}&sig={sign_key(key, expires)}"
+
+    def local_path(self, key: str) -> Optional[str]:
+        path = self._path(key)
+        return path if os.path.exists(path) else None
+
+
+def sign_key(key: str, expires: int) -> str:
+    return hmac.new(STORAGE_SIGNING_SECRET.encode("utf-8"), f"{key}:{expires}".encode("utf-8"), hashlib.sha256).hexdigest()
+
+
+def verify_signature(key: str, expires: Optional[str], sig: Optional[str]) -> bool:
+    """Validate a local signed URL. Always False when no signing secret is configured."""
+    if not STORAGE_SIGNING_SECRET or not expires or not sig:
+        return False
+    try:
+        exp = int(expires)
+    except ValueError:
+        return False
+    if exp < time.time():
+        return False
+    return hmac.compare_digest(sign_key(key, exp), sig)
+
+
+_backend: Optional[StorageBackend] = None
+
+
+def get_storage() -> StorageBackend:
+    """Firebase Storage when FIREBASE_STORAGE_BUCKET is set, else the local filesystem backend."""
+    global _backend
+    if _backend is None:
+        bucket_name = os.getenv("FIREBASE_STORAGE_BUCKET")
+        _backend = FirebaseStorageBackend(bucket_name) if bucket_name else LocalStorageBackend()
+    return _backend
@@ -0,0 +1,378 @@
+import os
+import json
+import time
+import queue
+import random
+import atexit
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+
+# "none" (ids only, nothing recorded), "file" (OTLP/JSON lines) or "otlp" (OTLP/HTTP JSON to a collector)
+TRACE_EXPORTER = os.getenv("TRACE_EXPORTER", "none").lower()
+TRACE_FILE = os.getenv("TRACE_FILE", "traces.jsonl")
+TRACE_OTLP_ENDPOINT = os.getenv("TRACE_OTLP_ENDPOINT", "http://localhost:4318/v1/traces")
+TRACE_SERVICE_NAME = os.getenv("TRACE_SERVICE_NAME", "gemini-clone-backend")
+# Fraction of new traces recorded; requests carrying a W3C traceparent follow the caller's decision
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.05"))
+TRACE_QUEUE_SIZE = int(os.getenv("TRACE_QUEUE_SIZE", "4096"))
+TRACE_EXPORT_BATCH = int(os.getenv("TRACE_EXPORT_BATCH", "512"))
+TRACE_EXPORT_INTERVAL_SECONDS = float(os.getenv("TRACE_EXPORT_INTERVAL_SECONDS", "2"))
+
+_KINDS = {"internal": 1, "server": 2, "client": 3}
+
+
+class Span:
+    """One timed operation in a trace, recorded in OpenTelemetry's data model.
+
+    Only sampled spans exist as Span objects; everything under an unsampled trace is the shared
+    no-op span, so untraced requests pay a context lookup per instrumented call and nothing else.
+    """
+
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "kind", "start_ns", "end_ns", "attributes", "status", "events")
+    sampled = True
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str], kind: str = "internal", attributes: Optional[Dict] = None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = _new_id(64)
+        self.parent_id = parent_id
+        self.kind = kind
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attributes = {k: v for k, v in (attributes or {}).items() if v is not None}
+        self.status = None
+        self.events = []
+
+    def set_attribute(self, key: str, value):
+        if value is not None:
+            self.attributes[key] = value
+
+    def record_exception(self, exc: BaseException):
+        self.status = ("error", f"{type(exc).__name__}: {exc}")
+        self.events.append({"name": "exception", "time": time.time_ns(), "attributes": {"exception.type": type(exc).__name__, "exception.message": str(exc)}})
+
+    def end(self):
+        if self.end_ns is None:
+            self.end_ns = time.time_ns()
+            _exporter.enqueue(self)
+
+
+class _UnsampledSpan:
+    """Stand-in for spans of unsampled traces: carries the trace id (for logs and clients), records nothing."""
+
+    __slots__ = ("trace_id", "span_id")
+    sampled = False
+
+    def __init__(self, trace_id: str = "", span_id: str = ""):
+        self.trace_id = trace_id
+        self.span_id = span_id
+
+    def set_attribute(self, key: str, value):
+        pass
+
+    def record_exception(self, exc: BaseException):
+        pass
+
+    def end(self):
+        pass
+
+
+NOOP = _UnsampledSpan()
+_current: contextvars.ContextVar = contextvars.ContextVar("trace_span", default=NOOP)
+
+
+def _new_id(bits: int) -> str:
+    return f"{random.getrandbits(bits):0{bits // 4}x}"
+
+
+def _parse_traceparent(header: Optional[str]):
+    # version-traceid-parentid-flags
+    try:
+        version, trace_id, parent_id, flags = header.strip().split("-")
+        if len(trace_id) != 32 or len(parent_id) != 16 or int(trace_id, 16) == 0:
+            return None
+        return trace_id, parent_id, bool(int(flags, 16) & 1)
+    except Exception:
+        return None
+
+
+def enabled() -> bool:
+    return TRACE_EXPORTER in ("file", "otlp")
+
+
+def start_trace(name: str, traceparent: Optional[str] = None, **attributes):
+    """Start the root span of a request, continuing the caller's trace when a traceparent is given."""
+    parent = _parse_traceparent(traceparent) if traceparent else None
+    if parent:
+        trace_id, parent_id, sampled = parent
+    else:
+        trace_id, parent_id, sampled = _new_id(128), None, random.random() < TRACE_SAMPLE_RATE
+    if not (sampled and enabled()):
+        return _UnsampledSpan(trace_id, _new_id(64))
+    _exporter.started += 1
+    return Span(name, trace_id, parent_id, "server", attributes)
+
+
+def start_span(name: str, kind: str = "internal", **attributes):
+    """Start a child of the current span without making it current; the caller must end() it."""
+    parent = _current.get()
+    if not parent.sampled:
+        return parent
+    return Span(name, parent.trace_id, parent.span_id, kind, attributes)
+
+
+@contextmanager
+def use_span(span):
+    """Make `span` the parent of spans started in this context (and in tasks/threads spawned from it)."""
+    token = _current.set(span)
+    try:
+        yield span
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def span(name: str, kind: str = "internal", **attributes):
+    """Time a block as a child span of the current one; exceptions are recorded and re-raised."""
+    parent = _current.get()
+    if not parent.sampled:
+        yield parent
+        return
+    s = Span(name, parent.trace_id, parent.span_id, kind, attributes)
+    token = _current.set(s)
+    try:
+        yield s
+    except BaseException as e:
+        s.record_exception(e)
+        raise
+    finally:
+        _current.reset(token)
+        s.end()
+
+
+def current_span():
+    return _current.get()
+
+
+def current_trace_id() -> Optional[str]:
+    return _current.get().trace_id or None
+
+
+def traceparent() -> Optional[str]:
+    """W3C traceparent header for outgoing calls made in the current span."""
+    s = _current.get()
+    if not s.trace_id:
+        return None
+    return f"00-{s.trace_id}-{s.span_id}-{'01' if s.sampled else '00'}"
+
+
+def _value(v) -> Dict:
+    if isinstance(v, bool):
+        return {"boolValue": v}
+    if isinstance(v, int):
+        return {"intValue": str(v)}
+    if isinstance(v, float):
+        return {"doubleValue": v}
+    return {"stringValue": str(v)}
+
+
+def _attrs(d: Dict) -> List[Dict]:
+    return [{"key": k, "value": _value(v)} for k, v in d.items()]
+
+
+def _otlp_span(s: Span) -> Dict:
+    out = {
+        "traceId": s.trace_id,
+        "spanId": s.span_id,
+        "name": s.name,
+        "kind": _KINDS.get(s.kind, 1),
+        "startTimeUnixNano": str(s.start_ns),
+        "endTimeUnixNano": str(s.end_ns),
+        "attributes": _attrs(s.attributes),
+        "status": {"code": 2, "message": s.status[1]} if s.status else {"code": 0},
+    }
+    if s.parent_id:
+        out["parentSpanId"] = s.parent_id
+    if s.events:
+        out["events"] = [{"name": e["name"], "timeUnixNano": str(e["time"]), "attributes": _attrs(e["attributes"])} for e in s.events]
+    return out
+
+
+def otlp_payload(spans: List[Span]) -> Dict:
+    """An OTLP ExportTraceServiceRequest in its JSON encoding, as read by the OpenTelemetry Collector."""
+    return {"resourceSpans": [{
+        "resource": {"attributes": _attrs({"service.name": TRACE_SERVICE_NAME, "process.pid": os.getpid()})},
+        "scopeSpans": [{"scope": {"name": "app.tracing"}, "spans": [_otlp_span(s) for s in spans]}],
+    }]}
+
+
+class _Exporter:
+    """Batches finished spans off the request path and writes them from a daemon thread.
+
+    The queue is bounded: when the exporter falls behind, spans are dropped and counted rather than
+    blocking the event loop. The thread is started lazily in each process, so gunicorn workers forked
+    from a preloaded master each run their own.
+    """
+
+    def __init__(self):
+        self._queue: "queue.Queue[Span]" = queue.Queue(maxsize=TRACE_QUEUE_SIZE)
+        self._thread: Optional[threading.Thread] = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self.started = 0
+        self.exported = 0
+        self.dropped = 0
+        self.errors = 0
+
+    def enqueue(self, s: Span):
+        if self._pid != os.getpid():
+            self._start()
+        try:
+            self._queue.put_nowait(s)
+        except queue.Full:
+            self.dropped += 1
+
+    def _start(self):
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = queue.Queue(maxsize=TRACE_QUEUE_SIZE)
+            self._stop = threading.Event()
+            self._thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+            self._thread.start()
+            self._pid = os.getpid()
+            atexit.register(self.shutdown)
+
+    def _drain(self, limit: int) -> List[Span]:
+        batch = []
+        while len(batch) < limit:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while not self._stop.wait(TRACE_EXPORT_INTERVAL_SECONDS):
+            self.flush()
+
+    def flush(self):
+        while True:
+            batch = self._drain(TRACE_EXPORT_BATCH)
+            if not batch:
+                return
+            try:
+                self._write(batch)
+                self.exported += len(batch)
+            except Exception as e:
+                self.errors += 1
+                logging.warning(f"Trace export failed ({len(batch)} spans dropped): {e}")
+
+    def _write(self, batch: List[Span]):
+        payload = otlp_payload(batch)
+        if TRACE_EXPORTER == "file":
+            with open(TRACE_FILE, "a") as f:
+                f.write(json.dumps(payload) + "\n")
+        elif TRACE_EXPORTER == "otlp":
+            import requests
+            r = requests.post(TRACE_OTLP_ENDPOINT, json=payload, timeout=5)
+            if r.status_code >= 300:
+                raise RuntimeError(f"collector returned {r.status_code}")
+
+    def shutdown(self):
+        if self._pid != os.getpid():
+            return
+        self._stop.set()
+        self.flush()
+
+    def stats(self) -> Dict:
+        return {
+            "exporter": TRACE_EXPORTER,
+            "sample_rate": TRACE_SAMPLE_RATE,
+            "traces_sampled": self.started,
+            "spans_exported": self.exported,
+            "spans_dropped": self.dropped,
+            "export_errors": self.errors,
+            "queued": self._queue.qsize(),
+        }
+
+
+_exporter = _Exporter()
+
+
+def flush():
+    _exporter.flush()
+
+
+def stats() -> Dict:
+    return _exporter.stats()
+
+
+def instrument(cls, methods, prefix: str, kind: str = "client", path_attr: str = "path"):
+    """Wrap `cls.<method>` so each call made inside a sampled trace records a `<prefix>.<method>` span.
+
+    Outside sampled traces the wrapper only checks the current span. Methods returning an iterator
+    (query streams) are timed until the iterator is exhausted.
+    """
+    for name in methods:
+        original = getattr(cls, name, None)
+        if original is None or getattr(original, "_traced", False):
+            continue
+
+        def make(original, name):
+            def wrapper(self, *args, **kwargs):
+                parent = _current.get()
+                if not parent.sampled:
+                    return original(self, *args, **kwargs)
+                s = Span(f"{prefix}.{name}", parent.trace_id, parent.span_id, kind, {"db.system": prefix, "db.operation": name})
+                path = getattr(self, path_attr, None)
+                if isinstance(path, str):
+                    s.set_attribute("db.path", path)
+                try:
+                    result = original(self, *args, **kwargs)
+                except BaseException as e:
+                    s.record_exception(e)
+                    s.end()
+                    raise
+                if name == "stream":
+                    return _timed_iter(result, s)
+                s.end()
+                return result
+            wrapper._traced = True
+            wrapper.__name__ = original.__name__
+            wrapper.__doc__ = original.__doc__
+            return wrapper
+
+        setattr(cls, name, make(original, name))
+
+
+def _timed_iter(it, s: Span):
+    try:
+        n = 0
+        for item in it:
+            n += 1
+            yield item
+        s.set_attribute("db.rows", n)
+    except BaseException as e:
+        s.record_exception(e)
+        raise
+    finally:
+        s.end()
+
+
+def instrument_firestore():
+    """Trace every Firestore RPC: document reads/writes, queries, batch and transaction commits."""
+    if not enabled():
+        return
+    from google.cloud.firestore_v1 import batch, client, collection, document, query, transaction
+    instrument(document.DocumentReference, ("get", "create", "set", "update", "delete"), "firestore")
+    instrument(collection.CollectionReference, ("add", "get", "stream"), "firestore")
+    instrument(query.Query, ("get", "stream"), "firestore")
+    instrument(transaction.Transaction, ("get", "get_all", "_commit"), "firestore", path_attr="_id")
+    instrument(batch.WriteBatch, ("commit",), "firestore")
+    instrument(client.Client, ("get_all",), "firestore")
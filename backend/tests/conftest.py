@@ -0,0 +1,29 @@
+import os
+import sys
+
+import pytest
+
+# tests import the backend the same way the app does when started from backend/ (app.*, services.*)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from fake_firestore import FakeFirestore  # noqa: E402  (pytest puts this directory on sys.path)
+
+
+@pytest.fixture
+def fs():
+    return FakeFirestore()
+
+
+@pytest.fixture
+def storage(tmp_path):
+    from services.storage import LocalStorageBackend
+    return LocalStorageBackend(str(tmp_path / "storage"))
+
+
+@pytest.fixture
+def app_fs(fs, storage, monkeypatch):
+    """Point app.main at the fake Firestore and a temporary local storage root."""
+    from app import main
+    monkeypatch.setattr(main, "get_fs", lambda: fs)
+    monkeypatch.setattr(main, "get_storage", lambda: storage)
+    return fs
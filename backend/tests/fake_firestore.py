@@ -0,0 +1,261 @@
+"""In-memory stand-in for the parts of the Firestore client the backend uses.
+
+Covers documents, collections, collection groups, queries (where / order_by / limit / offset /
+start_after, including "__name__" ordering and cursors), transactions and write batches. Writes are
+applied immediately under one lock; there are no indexes, so queries that would need one simply work.
+"""
+import datetime
+import threading
+import uuid
+
+
+def _now():
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+def _resolve(value):
+    from google.cloud.firestore_v1 import transforms
+    if value is transforms.SERVER_TIMESTAMP:
+        return _now()
+    if isinstance(value, dict):
+        return {k: _resolve(v) for k, v in value.items()}
+    return value
+
+
+def _plain(value):
+    return value.path if hasattr(value, "path") else value
+
+
+_OPS = {
+    "<": lambda a, b: a is not None and a < b,
+    "<=": lambda a, b: a is not None and a <= b,
+    "==": lambda a, b: a == b,
+    ">": lambda a, b: a is not None and a > b,
+    ">=": lambda a, b: a is not None and a >= b,
+    "!=": lambda a, b: a != b,
+    "in": lambda a, b: a in b,
+    "array_contains": lambda a, b: b in (a or []),
+}
+
+
+class Snapshot:
+    def __init__(self, ref, data):
+        self.reference = ref
+        self.id = ref.id
+        self._data = data
+        self.exists = data is not None
+
+    def to_dict(self):
+        return None if self._data is None else dict(self._data)
+
+    def get(self, field):
+        return (self._data or {}).get(field)
+
+
+class _Store:
+    def __init__(self):
+        self.docs = {}
+        self.lock = threading.RLock()
+        self.reads = 0
+
+
+class DocumentReference:
+    def __init__(self, store, path):
+        self._store = store
+        self.path = path
+        self.id = path.rsplit("/", 1)[-1]
+
+    @property
+    def parent(self):
+        return CollectionReference(self._store, self.path.rsplit("/", 1)[0])
+
+    def collection(self, name):
+        return CollectionReference(self._store, f"{self.path}/{name}")
+
+    def collections(self):
+        prefix = self.path + "/"
+        names = {p[len(prefix):].split("/")[0] for p in list(self._store.docs) if p.startswith(prefix)}
+        return [self.collection(n) for n in sorted(names)]
+
+    def get(self, transaction=None, **kwargs):
+        with self._store.lock:
+            self._store.reads += 1
+            data = self._store.docs.get(self.path)
+            return Snapshot(self, None if data is None else dict(data))
+
+    def set(self, data, merge=False):
+        with self._store.lock:
+            data = _resolve(data)
+            if merge and self.path in self._store.docs:
+                data = {**self._store.docs[self.path], **data}
+            self._store.docs[self.path] = dict(data)
+
+    def update(self, data):
+        with self._store.lock:
+            if self.path not in self._store.docs:
+                raise KeyError(f"No document to update: {self.path}")
+            self._store.docs[self.path] = {**self._store.docs[self.path], **_resolve(data)}
+
+    def delete(self):
+        with self._store.lock:
+            self._store.docs.pop(self.path, None)
+
+    def __eq__(self, other):
+        return isinstance(other, DocumentReference) and other.path == self.path
+
+    def __hash__(self):
+        return hash(self.path)
+
+
+class Query:
+    def __init__(self, store, match, filters=(), orders=(), limit=None, after=None, offset=0):
+        self._store = store
+        self._match = match
+        self._filters = list(filters)
+        self._orders = list(orders)
+        self._limit = limit
+        self._after = after
+        self._offset = offset
+
+    def _with(self, **changes):
+        q = Query(self._store, self._match, self._filters, self._orders, self._limit, self._after, self._offset)
+        for k, v in changes.items():
+            setattr(q, f"_{k}", v)
+        return q
+
+    def where(self, field=None, op=None, value=None, filter=None):
+        if filter is not None:
+            field, op, value = filter.field_path, filter.op_string, filter.value
+        return self._with(filters=self._filters + [(field, op, value)])
+
+    def order_by(self, field, direction="ASCENDING"):
+        return self._with(orders=self._orders + [(field, direction)])
+
+    def limit(self, n):
+        return self._with(limit=n)
+
+    def offset(self, n):
+        return self._with(offset=n)
+
+    def start_after(self, cursor):
+        return self._with(after=cursor)
+
+    def select(self, fields):
+        return self
+
+    @staticmethod
+    def _value(path, data, field):
+        return path if field == "__name__" else data.get(field)
+
+    def stream(self, transaction=None):
+        with self._store.lock:
+            self._store.reads += 1
+            items = [(p, dict(d)) for p, d in self._store.docs.items() if self._match(p)]
+        for field, op, value in self._filters:
+            value = _plain(value)
+            items = [(p, d) for p, d in items if (field == "__name__" or field in d) and _OPS[op](self._value(p, d, field), value)]
+        for field, direction in reversed(self._orders or [("__name__", "ASCENDING")]):
+            if field != "__name__":
+                items = [(p, d) for p, d in items if field in d]
+            items.sort(key=lambda item: self._value(item[0], item[1], field), reverse=str(direction).upper().startswith("DESC"))
+        if isinstance(self._after, dict):
+            keys = [f for f, _ in self._orders]
+            cursor = tuple(_plain(self._after.get(k)) for k in keys)
+            items = [(p, d) for p, d in items if tuple(self._value(p, d, k) for k in keys) > cursor]
+        elif self._after is not None:
+            after = self._after.reference.path
+            index = next((i for i, (p, _) in enumerate(items) if p == after), None)
+            if index is not None:
+                items = items[index + 1:]
+        items = items[self._offset:]
+        if self._limit is not None:
+            items = items[:self._limit]
+        return iter([Snapshot(DocumentReference(self._store, p), d) for p, d in items])
+
+    def get(self, transaction=None):
+        return list(self.stream())
+
+
+class CollectionReference(Query):
+    def __init__(self, store, path):
+        depth = path.count("/") + 1
+        super().__init__(store, lambda p: p.startswith(path + "/") and p.count("/") == depth)
+        self.path = path
+        self.id = path.rsplit("/", 1)[-1]
+
+    def document(self, doc_id=None):
+        return DocumentReference(self._store, f"{self.path}/{doc_id or uuid.uuid4().hex[:20]}")
+
+    def add(self, data):
+        ref = self.document()
+        ref.set(data)
+        return None, ref
+
+    def list_documents(self, page_size=None):
+        prefix = self.path + "/"
+        ids = {p[len(prefix):].split("/")[0] for p in list(self._store.docs) if p.startswith(prefix)}
+        return [self.document(i) for i in sorted(ids)]
+
+
+class WriteBatch:
+    """Both a write batch and a transaction: writes are queued and applied together."""
+
+    MAX_WRITES = 500
+
+    def __init__(self, store):
+        self._store = store
+        self._writes = []
+
+    def get(self, ref):
+        return ref.get() if isinstance(ref, DocumentReference) else ref.stream()
+
+    def set(self, ref, data, merge=False):
+        self._writes.append(lambda: ref.set(data, merge=merge))
+
+    def update(self, ref, data):
+        self._writes.append(lambda: ref.update(data))
+
+    def delete(self, ref):
+        self._writes.append(ref.delete)
+
+    def commit(self):
+        with self._store.lock:
+            if len(self._writes) > self.MAX_WRITES:
+                raise ValueError(f"batch of {len(self._writes)} writes exceeds {self.MAX_WRITES}")
+            for write in self._writes:
+                write()
+        self._writes = []
+
+    def run(self, fn):
+        with self._store.lock:
+            result = fn(self)
+            self.commit()
+            return result
+
+
+class FakeFirestore:
+    def __init__(self):
+        self._store = _Store()
+
+    @property
+    def docs(self):
+        """All documents as {path: data}."""
+        return self._store.docs
+
+    def collection(self, name):
+        return CollectionReference(self._store, name)
+
+    def collection_group(self, name):
+        return Query(self._store, lambda p: p.split("/")[-2] == name)
+
+    def document(self, path):
+        return DocumentReference(self._store, path)
+
+    def transaction(self, **kwargs):
+        return WriteBatch(self._store)
+
+    def batch(self):
+        return WriteBatch(self._store)
+
+    def collections(self):
+        return []
@@ -0,0 +1,91 @@
+import json
+from datetime import datetime, timezone
+
+from app.cleanup import CleanupEngine
+
+NOW = 1_700_000_000.0
+DAY = 86400
+
+
+def _at(ts):
+    return datetime.fromtimestamp(ts, tz=timezone.utc)
+
+
+def _engine(fs, storage, **kwargs):
+    options = dict(request_ttl_seconds=DAY, aborted_ttl_seconds=3600, media_retention_days=30,
+                   page_size=3, batch_size=2, max_writes_per_second=0, now=NOW)
+    return CleanupEngine(fs, storage, **{**options, **kwargs})
+
+
+def test_expired_requests_are_paged_across_equal_timestamps(fs, storage):
+    # seven requests share one timestamp, so every page boundary falls inside the tie
+    for i in range(7):
+        fs.document(f"users/u{i % 2}/requests/old{i}").set({"createdAt": _at(NOW - 2 * DAY)})
+    fs.document("users/u0/requests/recent").set({"createdAt": _at(NOW - 60)})
+
+    stats = _engine(fs, storage).run(["requests"])
+    assert stats == {"requests": {"deleted": 7}}
+    assert sorted(fs.docs) == ["users/u0/requests/recent"]
+
+
+def test_stuck_messages_are_marked_and_release_the_user_lock(fs, storage):
+    fs.document("users/u1/chats/c/messages/stuck").set({"status": "streaming", "createdAt": _at(NOW - 7200)})
+    fs.document("users/u1/chats/c/messages/live").set({"status": "streaming", "createdAt": _at(NOW - 60)})
+    fs.document("users/u1/chats/c/messages/done").set({"status": "done", "createdAt": _at(NOW - 7200)})
+    fs.document("users/u1/meta/state").set({"active_request_id": "r1", "active_assistant_msg_id": "stuck"})
+
+    stats = _engine(fs, storage).run(["stuck_messages"])
+    assert stats == {"stuck_messages": {"marked_error": 1, "unlocked": 1}}
+    assert fs.docs["users/u1/chats/c/messages/stuck"]["error"] == "aborted"
+    assert fs.docs["users/u1/chats/c/messages/live"]["status"] == "streaming"
+    assert fs.docs["users/u1/meta/state"]["active_assistant_msg_id"] is None
+
+
+def test_expired_images_and_attachments_lose_their_blobs(fs, storage):
+    old = _at(NOW - 40 * DAY)
+    storage.put("images/u1/a.png", b"png", "image/png")
+    storage.put("images/u1/a_thumb.webp", b"webp", "image/webp")
+    fs.document("users/u1/chats/c/messages/img").set({
+        "uid": "u1", "type": "image", "mediaExpired": False, "createdAt": old,
+        "images": [{"storagePath": "images/u1/a.png", "variants": [{"storagePath": "images/u1/a_thumb.webp"}]}],
+    })
+    # another user's image is outside the uid scope
+    fs.document("users/u2/chats/c/messages/img").set({"uid": "u2", "type": "image", "mediaExpired": False, "createdAt": old, "images": [{}]})
+    storage.put("attachments/u1/x/f.txt", b"data", "text/plain")
+    fs.document("users/u1/attachments/x").set({"storagePath": "attachments/u1/x/f.txt", "createdAt": old})
+
+    stats = _engine(fs, storage, uid="u1").run(["attachments", "images"])
+    assert stats == {"attachments": {"blobs_deleted": 1, "deleted": 1}, "images": {"blobs_deleted": 2, "expired": 1}}
+    assert fs.docs["users/u1/chats/c/messages/img"]["mediaExpired"] is True
+    assert storage.stat("images/u1/a.png") is None and storage.stat("attachments/u1/x/f.txt") is None
+    assert fs.docs["users/u2/chats/c/messages/img"]["mediaExpired"] is False
+
+    # expired images drop out of the query, so the next run reads nothing
+    reads = fs._store.reads
+    assert _engine(fs, storage, uid="u1").run(["images"]) == {}
+    assert fs._store.reads == reads + 1
+
+
+def test_dry_run_reports_without_writing(fs, storage):
+    fs.document("users/u1/requests/old").set({"createdAt": _at(NOW - 2 * DAY)})
+    stats = _engine(fs, storage, dry_run=True).run(["requests"])
+    assert stats == {"requests": {"deleted": 1}}
+    assert "users/u1/requests/old" in fs.docs
+
+
+def test_checkpoint_resumes_after_the_last_committed_document(fs, storage, tmp_path):
+    for i in range(6):
+        fs.document(f"users/u1/requests/r{i}").set({"createdAt": _at(NOW - 2 * DAY + i)})
+    checkpoint = tmp_path / "cleanup.json"
+    # an earlier run finished the video jobs and got as far as r2 before it was interrupted
+    checkpoint.write_text(json.dumps({
+        "video_jobs": {"done": True},
+        "requests": {"cursor": NOW - 2 * DAY + 2, "cursor_path": "users/u1/requests/r2"},
+    }))
+    fs.document("users/u1/video_jobs/v").set({"createdAt": _at(NOW - 40 * DAY)})
+
+    stats = _engine(fs, storage, checkpoint_path=str(checkpoint)).run(["video_jobs", "requests"])
+    assert stats == {"requests": {"deleted": 3}}
+    assert sorted(fs.docs) == ["users/u1/requests/r0", "users/u1/requests/r1", "users/u1/requests/r2", "users/u1/video_jobs/v"]
+    saved = json.loads(checkpoint.read_text())
+    assert saved["requests"]["done"] is True and saved["requests"]["cursor_path"] == "users/u1/requests/r5"
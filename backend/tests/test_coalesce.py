@@ -0,0 +1,125 @@
+import asyncio
+
+import pytest
+
+from app.coalesce import Broadcast, Coalescer, content_key, request_key
+
+
+async def _source(n: int, started: asyncio.Event, gate: asyncio.Event):
+    started.set()
+    for i in range(n):
+        await gate.wait()
+        yield f"t{i} "
+
+
+async def _collect(broadcast: Broadcast):
+    return [t async for t in broadcast.subscribe()]
+
+
+def test_late_subscriber_gets_every_token():
+    async def main():
+        started, gate = asyncio.Event(), asyncio.Event()
+        b = Broadcast()
+        b.run(_source(3, started, gate))
+        first = asyncio.create_task(_collect(b))
+        await started.wait()
+        gate.set()
+        await asyncio.sleep(0.01)
+        late = asyncio.create_task(_collect(b))
+        return await first, await late
+
+    first, late = asyncio.run(main())
+    assert first == late == ["t0 ", "t1 ", "t2 "]
+
+
+def test_one_subscriber_cancelling_keeps_the_generation_for_the_others():
+    async def main():
+        started, gate = asyncio.Event(), asyncio.Event()
+        b = Broadcast()
+        producer = b.run(_source(3, started, gate))
+        leaving = asyncio.create_task(_collect(b))
+        staying = asyncio.create_task(_collect(b))
+        await started.wait()
+        await asyncio.sleep(0)
+        assert b.subscribers == 2
+
+        leaving.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leaving
+        assert b.subscribers == 1
+        assert not producer.cancelled()
+
+        gate.set()
+        return await staying, producer
+
+    tokens, producer = asyncio.run(main())
+    assert tokens == ["t0 ", "t1 ", "t2 "]
+    assert producer.done() and not producer.cancelled()
+
+
+def test_last_subscriber_cancelling_stops_the_upstream():
+    async def main():
+        started, gate = asyncio.Event(), asyncio.Event()
+        b = Broadcast()
+        producer = b.run(_source(3, started, gate))
+        only = asyncio.create_task(_collect(b))
+        await started.wait()
+        await asyncio.sleep(0)
+
+        only.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await only
+        with pytest.raises(asyncio.CancelledError):
+            await producer
+        return b
+
+    b = asyncio.run(main())
+    assert b.subscribers == 0
+    assert b.done and b.error == "generation cancelled"
+
+
+def test_upstream_error_reaches_subscribers():
+    async def failing():
+        yield "partial"
+        raise ValueError("model exploded")
+
+    async def main():
+        b = Broadcast()
+        b.run(failing())
+        received = []
+        with pytest.raises(RuntimeError, match="model exploded"):
+            async for token in b.subscribe():
+                received.append(token)
+        return received
+
+    assert asyncio.run(main()) == ["partial"]
+
+
+def test_coalescer_joins_by_request_or_content_until_released():
+    async def main():
+        coalescer = Coalescer(window_seconds=60)
+        b = Broadcast({"chat_id": "c1", "message_id": "m1"})
+        b.track(asyncio.create_task(asyncio.sleep(0)))
+        release = coalescer.register(b, request_key("u1", "r1"), content_key("u1", "c1", "m", "What is AI?", False), None)
+
+        assert coalescer.get(request_key("u1", "r1")) is b
+        assert coalescer.get(None, content_key("u1", "c1", "m", "  what is  ai? ", False)) is b
+        assert coalescer.get(content_key("u2", "c1", "m", "What is AI?", False)) is None
+        assert coalescer.stats() == {"inflight": 1, "joined": 2}
+
+        release()
+        assert coalescer.get(request_key("u1", "r1")) is None
+        assert coalescer.stats()["inflight"] == 0
+
+    asyncio.run(main())
+
+
+def test_coalescer_skips_finished_broadcasts():
+    async def main():
+        coalescer = Coalescer()
+        b = Broadcast()
+        coalescer.register(b, request_key("u1", "r1"))
+        await b.finish()
+        assert coalescer.get(request_key("u1", "r1")) is None
+
+    asyncio.run(main())
@@ -0,0 +1,69 @@
+import asyncio
+
+from app.deletion import ChatDeleter, start_deletion
+
+
+def _chat(fs, storage, uid="u1", chat_id="c1", messages=25):
+    fs.document(f"users/{uid}/chats/{chat_id}").set({"title": "t"})
+    for i in range(messages):
+        data = {"uid": uid, "chatId": chat_id, "content": str(i), "createdAt": i}
+        fs.document(f"users/{uid}/chats/{chat_id}/messages/m{i:03d}").set(data)
+        if i % 3 == 0:
+            fs.document(f"users/{uid}/chats/{chat_id}/messages/m{i:03d}/feedback/f").set({"score": 1})
+
+
+def _attachment(fs, storage, aid, uid="u1"):
+    storage.put(f"attachments/{uid}/{aid}/f.txt", b"data", "text/plain")
+    storage.put(f"attachments/{uid}/{aid}/extracted.json", b"{}", "application/json")
+    fs.document(f"users/{uid}/attachments/{aid}").set({
+        "storagePath": f"attachments/{uid}/{aid}/f.txt",
+        "extraction": {"status": "done", "textPath": f"attachments/{uid}/{aid}/extracted.json"},
+    })
+
+
+def test_deletes_every_page_subcollection_and_image(fs, storage):
+    _chat(fs, storage)
+    storage.put("images/u1/x.png", b"png", "image/png")
+    storage.put("images/u1/x_thumb.webp", b"webp", "image/webp")
+    fs.document("users/u1/chats/c1/messages/m004").update(
+        {"images": [{"storagePath": "images/u1/x.png", "variants": [{"storagePath": "images/u1/x_thumb.webp"}]}]})
+    fs.document("users/u1/chats/other/messages/keep").set({"uid": "u1", "chatId": "other"})
+
+    tomb = start_deletion(fs, "u1", "c1")
+    assert tomb["status"] == "deleting"
+    assert not fs.document("users/u1/chats/c1").get().exists
+
+    counts = asyncio.run(ChatDeleter(fs, storage, "u1", "c1", page_size=4, batch_size=3).run())
+    assert counts == {"messages": 25, "subdocs": 9, "blobs": 2, "attachments": 0}
+    assert sorted(fs.docs) == ["users/u1/chats/other/messages/keep", "users/u1/tombstones/c1"]
+    assert fs.document("users/u1/tombstones/c1").get().to_dict()["status"] == "deleted"
+    assert storage.stat("images/u1/x.png") is None and storage.stat("images/u1/x_thumb.webp") is None
+
+
+def test_attachment_referenced_by_several_messages_is_deleted_once(fs, storage):
+    _chat(fs, storage, messages=6)
+    _attachment(fs, storage, "a1")
+    # referenced on the first page twice and again on a later page
+    for mid in ("m000", "m001", "m005"):
+        fs.document(f"users/u1/chats/c1/messages/{mid}").update({"attachments": ["a1"]})
+
+    counts = asyncio.run(ChatDeleter(fs, storage, "u1", "c1", page_size=3).run())
+    assert counts["attachments"] == 1 and counts["blobs"] == 2
+    assert not fs.document("users/u1/attachments/a1").get().exists
+    assert storage.stat("attachments/u1/a1/f.txt") is None
+
+
+def test_attachment_still_used_by_another_chat_is_kept(fs, storage):
+    _chat(fs, storage, messages=2)
+    _attachment(fs, storage, "shared")
+    _attachment(fs, storage, "own")
+    fs.document("users/u1/chats/c1/messages/m000").update({"attachments": ["shared", "own"]})
+    fs.document("users/u1/chats/other/messages/m0").set({"uid": "u1", "chatId": "other", "attachments": ["shared"]})
+    # another user's message never counts as a reference
+    fs.document("users/u2/chats/x/messages/m0").set({"uid": "u2", "chatId": "x", "attachments": ["own"]})
+
+    counts = asyncio.run(ChatDeleter(fs, storage, "u1", "c1").run())
+    assert counts["attachments"] == 1
+    assert fs.document("users/u1/attachments/shared").get().exists
+    assert storage.stat("attachments/u1/shared/f.txt") is not None
+    assert not fs.document("users/u1/attachments/own").get().exists
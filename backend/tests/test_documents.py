@@ -0,0 +1,143 @@
+import asyncio
+from concurrent.futures import Executor, Future
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+from app.attachments import ExtractionCache
+from services import documents
+from services.documents import (ATTACHMENT_CONTEXT_HEADER, build_attachment_context, chunk_pages, extract, extract_document,
+                                extractable, select_chunks)
+from services.rerank import CHARS_PER_TOKEN, tokenize
+
+
+def _doc(name, chunks):
+    return {"name": name, "chunks": chunks, "tokens": [tokenize(c["text"]) for c in chunks]}
+
+
+@pytest.mark.parametrize("ctype,expected", [
+    ("application/pdf", True), ("text/plain", True), ("text/markdown; charset=utf-8", True), ("TEXT/CSV", True),
+    ("image/png", False), ("application/zip", False), ("", False), (None, False),
+])
+def test_extractable(ctype, expected):
+    assert extractable(ctype) is expected
+
+
+@pytest.mark.parametrize("data,expected", [
+    ("naïve café".encode("utf-8"), "naïve café"),
+    ("﻿naïve".encode("utf-8"), "naïve"),
+    ("naïve".encode("utf-16"), "naïve"),
+    ("naïve café".encode("cp1252"), "naïve café"),
+])
+def test_text_decoding(data, expected):
+    assert extract_document(data, "text/plain")["chunks"][0]["text"] == expected
+
+
+def test_chunks_pack_paragraphs_and_never_span_pages():
+    pages = ["alpha beta\n\ngamma   delta", "", "epsilon"]
+    assert chunk_pages(pages, chunk_tokens=100) == [
+        {"page": 1, "text": "alpha beta\n\ngamma delta"},
+        {"page": 3, "text": "epsilon"},
+    ]
+    # a two-token (8 character) budget splits paragraphs apart
+    assert [c["text"] for c in chunk_pages(["aaa bbb\n\nccc"], chunk_tokens=2)] == ["aaa bbb", "ccc"]
+
+
+def test_long_paragraph_is_cut_at_word_boundaries():
+    words = " ".join(f"word{i}" for i in range(200))
+    chunks = chunk_pages([words], chunk_tokens=10)
+    limit = 10 * CHARS_PER_TOKEN
+    assert all(len(c["text"]) <= limit for c in chunks)
+    assert " ".join(c["text"] for c in chunks) == words
+    # an unbroken run longer than a chunk is cut hard
+    assert [len(c["text"]) for c in chunk_pages(["x" * 100], chunk_tokens=10)] == [40, 40, 20]
+
+
+def test_extract_splits_pages_on_form_feeds_and_truncates(monkeypatch):
+    out = extract_document(b"page one\fpage two\fpage three", "text/plain")
+    assert (out["pages"], out["chars"], out["truncated"], out["error"]) == (3, 26, False, None)
+    assert [c["page"] for c in out["chunks"]] == [1, 2, 3]
+
+    monkeypatch.setattr(documents, "DOCUMENT_MAX_CHARS", 12)
+    out = extract_document(b"page one\fpage two\fpage three", "text/plain")
+    assert (out["pages"], out["chars"], out["truncated"]) == (3, 12, True)
+    assert [c["text"] for c in out["chunks"]] == ["page one", "page"]
+
+
+def test_unreadable_pdf_reports_an_error():
+    pytest.importorskip("pypdf")
+    out = extract_document(b"%PDF-1.4 this is not really a pdf", "application/pdf")
+    assert out["chunks"] == [] and out["error"]
+
+
+def test_select_chunks_returns_everything_that_fits_in_order():
+    doc = _doc("a.txt", [{"page": 1, "text": "intro"}, {"page": 2, "text": "details"}])
+    assert [(c["page"], c["score"]) for c in select_chunks("anything", [doc], token_budget=100)] == [(1, 0.0), (2, 0.0)]
+
+
+def test_select_chunks_prefers_relevant_chunks_within_budget():
+    filler = "the committee met and discussed the schedule for next quarter " * 2
+    chunks = [{"page": i + 1, "text": f"{filler} section{i}"} for i in range(20)]
+    chunks[13]["text"] += " photosynthesis converts light into chemical energy"
+    chunks[4]["text"] += " photosynthesis happens in chloroplasts"
+    other = _doc("b.txt", [{"page": 1, "text": f"{filler} photosynthesis overview"}])
+    budget_tokens = 3 * len(chunks[13]["text"]) // CHARS_PER_TOKEN + 10
+
+    selected = select_chunks("How does photosynthesis work?", [_doc("a.txt", chunks), other], token_budget=budget_tokens)
+    assert {(c["name"], c["page"]) for c in selected} == {("a.txt", 5), ("a.txt", 14), ("b.txt", 1)}
+    # document order, not score order
+    assert [(c["name"], c["page"]) for c in selected] == [("a.txt", 5), ("a.txt", 14), ("b.txt", 1)]
+    assert sum(len(c["text"]) for c in selected) <= budget_tokens * CHARS_PER_TOKEN
+    assert all(c["score"] > 0 for c in selected)
+
+
+def test_select_chunks_without_matches_takes_the_opening():
+    chunks = [{"page": i + 1, "text": "lorem ipsum dolor sit amet " * 4} for i in range(10)]
+    selected = select_chunks("zebra", [_doc("a.txt", chunks)], token_budget=len(chunks[0]["text"]) * 2 // CHARS_PER_TOKEN)
+    assert [c["page"] for c in selected] == [1, 2]
+
+
+def test_build_attachment_context_labels_file_and_page():
+    context = build_attachment_context([{"name": "a.pdf", "page": 3, "text": "Body.", "score": 1.0}])
+    assert context == f"{ATTACHMENT_CONTEXT_HEADER}\n\n[a.pdf, page 3]\nBody."
+
+
+def test_extraction_cache_holds_tokens_and_evicts_lru():
+    cache = ExtractionCache(max_entries=2)
+    doc = cache.put("sha1", {"chunks": [{"page": 1, "text": "Photosynthesis in plants"}], "pages": 1, "chars": 24, "truncated": False})
+    assert doc["tokens"] == [tokenize("Photosynthesis in plants")]
+    cache.put("sha2", {"chunks": [], "pages": 0, "chars": 0, "truncated": False})
+    assert cache.get("sha1") is doc
+    cache.put("sha3", {"chunks": [], "pages": 0, "chars": 0, "truncated": False})
+    assert cache.get("sha2") is None and cache.get("sha1") is doc
+    assert cache.stats() == {"entries": 2, "hits": 2, "misses": 1}
+
+
+class _FakePool(Executor):
+    def __init__(self, error):
+        self.error = error
+        self.shutdowns = 0
+
+    def submit(self, fn, *args, **kwargs):
+        future = Future()
+        future.set_exception(self.error)
+        return future
+
+    def shutdown(self, wait=True, *, cancel_futures=False):
+        self.shutdowns += 1
+
+
+def test_job_error_keeps_the_pool(monkeypatch):
+    pool = _FakePool(MemoryError("too big"))
+    monkeypatch.setattr(documents, "_pool", pool)
+    out = asyncio.run(extract(b"x", "text/plain"))
+    assert out["chunks"] == [] and out["error"] == "MemoryError: too big"
+    assert documents._pool is pool and pool.shutdowns == 0
+
+
+def test_broken_pool_is_shut_down_and_replaced(monkeypatch):
+    pool = _FakePool(BrokenProcessPool("worker killed"))
+    monkeypatch.setattr(documents, "_pool", pool)
+    out = asyncio.run(extract(b"x", "text/plain"))
+    assert out["error"].startswith("BrokenProcessPool")
+    assert pool.shutdowns == 1 and documents._pool is None
@@ -0,0 +1,122 @@
+import asyncio
+import datetime
+import threading
+
+import httpx
+import pytest
+
+from app import history_index, main
+from app.history_index import HistoryIndex, fts_query
+
+
+def _now():
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+def _history(fs, uid="u1"):
+    fs.document(f"users/{uid}/chats/c1").set({"title": "Battery storage in Europe", "createdAt": 1, "updatedAt": _now()})
+    fs.document(f"users/{uid}/chats/c2").set({"title": "Pasta recipes", "createdAt": 2, "updatedAt": _now()})
+    fs.document(f"users/{uid}/chats/c1/messages/a").set(
+        {"uid": uid, "chatId": "c1", "role": "user", "content": "What is the grid battery capacity in Germany?", "createdAt": 1, "updatedAt": _now()})
+    fs.document(f"users/{uid}/chats/c2/messages/b").set(
+        {"uid": uid, "chatId": "c2", "role": "assistant", "content": "Cook the spaghetti al dente.", "createdAt": 2, "updatedAt": _now()})
+
+
+@pytest.mark.parametrize("text,expected", [
+    ("battery", '"battery"*'),
+    ('grid "battery" OR title:x', '"grid" AND "battery" AND "OR" AND "title" AND "x"*'),
+    ("  ?! ", None),
+    (None, None),
+])
+def test_fts_query_quotes_every_term(text, expected):
+    assert fts_query(text) == expected
+
+
+def test_upsert_search_and_delete(tmp_path):
+    index = HistoryIndex(str(tmp_path))
+    index.upsert_chat("u1", "c1", "Battery storage")
+    index.upsert_message("u1", "c1", "m1", "Compare <b>battery</b> chemistries", "user")
+    index.upsert_message("u1", "c2", "m2", "Unrelated pasta")
+
+    results = index.search("u1", "batt")["results"]
+    # a title hit outranks a content hit, and stored markup is escaped around the highlight
+    assert [(r["chat_id"], r["message_id"]) for r in results] == [("c1", None), ("c1", "m1")]
+    assert results[1]["snippet"] == "Compare &lt;b&gt;<mark>battery</mark>&lt;/b&gt; chemistries"
+    assert results[1]["title"] == "Battery storage"
+
+    index.upsert_message("u1", "c1", "m1", "Compare solar panels")
+    assert [r["message_id"] for r in index.search("u1", "battery")["results"]] == [None]
+    index.delete_chat("u1", "c1")
+    assert index.search("u1", "solar")["results"] == []
+    assert index.search("u2", "pasta") == {"results": [], "next_offset": None}
+
+
+def test_search_pages_with_next_offset(tmp_path):
+    index = HistoryIndex(str(tmp_path))
+    for i in range(5):
+        index.upsert_message("u1", "c1", f"m{i}", f"note number {i}")
+    first = index.search("u1", "note", limit=3)
+    assert len(first["results"]) == 3 and first["next_offset"] == 3
+    second = index.search("u1", "note", limit=3, offset=3)
+    assert len(second["results"]) == 2 and second["next_offset"] is None
+
+
+def test_catch_up_defers_the_backfill_then_replays_changes(fs, tmp_path, monkeypatch):
+    monkeypatch.setattr(history_index, "HISTORY_INDEX_SYNC_SECONDS", 0)
+    _history(fs)
+    index = HistoryIndex(str(tmp_path))
+
+    # nothing is scanned on the request path
+    reads = fs._store.reads
+    assert index.catch_up("u1", fs) == {"action": "backfill_pending", "rows": 0}
+    assert fs._store.reads == reads and not index.exists("u1")
+
+    assert index.backfill("u1", fs) == 4
+    assert [r["chat_id"] for r in index.search("u1", "spaghetti")["results"]] == ["c2"]
+
+    fs.document("users/u1/chats/c2/messages/b").update({"content": "Boil linguine instead", "updatedAt": _now()})
+    fs.document("users/u1/tombstones/c1").set({"chatId": "c1", "status": "deleting", "updatedAt": _now()})
+    assert index.catch_up("u1", fs)["action"] == "sync"
+    assert [r["message_id"] for r in index.search("u1", "linguine")["results"]] == ["b"]
+    assert index.search("u1", "battery")["results"] == []
+
+
+def test_stale_index_asks_for_a_rebuild(fs, tmp_path, monkeypatch):
+    monkeypatch.setattr(history_index, "HISTORY_INDEX_SYNC_SECONDS", 0)
+    index = HistoryIndex(str(tmp_path))
+    index.backfill("u1", fs)
+    monkeypatch.setattr(history_index, "HISTORY_INDEX_REBUILD_SECONDS", 0)
+    assert index.catch_up("u1", fs)["action"] == "backfill_pending"
+
+
+def test_first_search_builds_the_index_in_the_background(app_fs, tmp_path, monkeypatch):
+    _history(app_fs)
+    index = HistoryIndex(str(tmp_path))
+    monkeypatch.setattr(history_index, "_index", index)
+    main.app.dependency_overrides[main.verify_firebase_token] = lambda: {"uid": "u1"}
+    release = threading.Event()
+    backfill = index.backfill
+    monkeypatch.setattr(index, "backfill", lambda uid, fs: release.wait(5) and backfill(uid, fs))
+
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://test") as client:
+            first = await client.get("/history/search", params={"q": "battery"})
+            again = await client.get("/history/search", params={"q": "battery"})
+            # concurrent searches share one backfill
+            assert list(main._history_backfills) == ["u1"]
+            task = main._history_backfills["u1"]
+            release.set()
+            await task
+            done = await client.get("/history/search", params={"q": "battery"})
+            return first, again, done
+
+    try:
+        first, again, done = asyncio.run(run())
+    finally:
+        main.app.dependency_overrides.pop(main.verify_firebase_token, None)
+    for response in (first, again):
+        assert response.status_code == 202
+        assert response.json()["indexing"] is True and response.json()["results"] == []
+    body = done.json()
+    assert done.status_code == 200 and body["indexing"] is False
+    assert [(r["chat_id"], r["message_id"]) for r in body["results"]] == [("c1", None), ("c1", "a")]
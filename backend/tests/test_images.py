@@ -0,0 +1,122 @@
+import asyncio
+import io
+import random
+from concurrent.futures import Executor, Future
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+from services import images
+from services.images import extension_for, generate_derivatives, make_derivatives, pick_variant, sniff_content_type
+
+
+def _png(width=800, height=600) -> bytes:
+    from PIL import Image
+    rnd = random.Random(7)
+    img = Image.new("RGB", (width, height))
+    img.putdata([(rnd.randrange(256), rnd.randrange(256), rnd.randrange(256)) for _ in range(width * height)])
+    buf = io.BytesIO()
+    img.save(buf, "PNG")
+    return buf.getvalue()
+
+
+IMAGE = {
+    "storagePath": "images/u1/x.png", "contentType": "image/png", "width": 2048, "height": 1536, "size": 900_000,
+    "variants": [
+        {"name": "thumb", "contentType": "image/avif", "width": 256, "size": 6_000},
+        {"name": "thumb", "contentType": "image/webp", "width": 256, "size": 9_000},
+        {"name": "web", "contentType": "image/avif", "width": 1280, "size": 60_000},
+        {"name": "web", "contentType": "image/webp", "width": 1280, "size": 90_000},
+    ],
+}
+
+
+@pytest.mark.parametrize("head,fallback,expected", [
+    (b"\xff\xd8\xff\xe0....", None, "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n....", "image/jpeg", "image/png"),
+    (b"RIFF\x00\x00\x00\x00WEBPVP8 ", None, "image/webp"),
+    (b"\x00\x00\x00\x1cftypavif", None, "image/avif"),
+    (b"GIF89a....", None, "image/gif"),
+    (b"????", "image/heic; q=1", "image/heic"),
+    (b"????", "application/octet-stream", "image/jpeg"),
+])
+def test_sniff_content_type(head, fallback, expected):
+    assert sniff_content_type(head, fallback) == expected
+
+
+def test_extension_for():
+    assert extension_for("image/webp") == "webp"
+    assert extension_for("image/heic") == "img"
+
+
+@pytest.mark.parametrize("width,accept,expected", [
+    (200, "image/avif,image/webp,*/*", ("thumb", "image/avif")),
+    (200, "image/webp,*/*", ("thumb", "image/webp")),
+    (200, "*/*", (None, "image/png")),
+    (1000, "image/avif,image/webp", ("web", "image/avif")),
+    (1600, "image/avif,image/webp", (None, "image/png")),
+    # no width: a full view, never a thumbnail
+    (None, "image/webp", ("web", "image/webp")),
+    (None, "", (None, "image/png")),
+])
+def test_pick_variant(width, accept, expected):
+    chosen = pick_variant(IMAGE, width, accept)
+    assert (chosen.get("name"), chosen["contentType"]) == expected
+
+
+def test_pick_variant_falls_back_to_widest():
+    image = {"contentType": "image/png", "width": 300, "size": 50_000,
+             "variants": [{"name": "thumb", "contentType": "image/webp", "width": 256, "size": 4_000}]}
+    assert pick_variant(image, 2000, "image/webp") is image
+    assert pick_variant({"contentType": "image/png"}, 500, "") == {"contentType": "image/png"}
+
+
+def test_make_derivatives_encodes_smaller_variants():
+    pytest.importorskip("PIL")
+    data = _png()
+    out = make_derivatives(data)
+    assert (out["width"], out["height"]) == (800, 600)
+    names = {v["name"] for v in out["variants"]}
+    assert names == {"thumb", "web"}
+    for v in out["variants"]:
+        assert v["size"] == len(v["data"]) < len(data)
+        assert max(v["width"], v["height"]) <= (images.IMAGE_THUMB_MAX_SIDE if v["name"] == "thumb" else images.IMAGE_WEB_MAX_SIDE)
+    assert make_derivatives(b"not an image") == {"width": None, "height": None, "variants": []}
+
+
+class _FakePool(Executor):
+    def __init__(self, error):
+        self.error = error
+        self.shutdowns = 0
+
+    def submit(self, fn, *args, **kwargs):
+        future = Future()
+        future.set_exception(self.error)
+        return future
+
+    def shutdown(self, wait=True, *, cancel_futures=False):
+        self.shutdowns += 1
+
+
+def test_job_error_keeps_the_pool(monkeypatch):
+    pool = _FakePool(ValueError("decoder crashed on this file"))
+    monkeypatch.setattr(images, "_pool", pool)
+    assert asyncio.run(generate_derivatives(b"x")) == {"width": None, "height": None, "variants": []}
+    assert images._pool is pool and pool.shutdowns == 0
+
+
+def test_broken_pool_is_shut_down_and_replaced(monkeypatch):
+    pool = _FakePool(BrokenProcessPool("worker killed"))
+    monkeypatch.setattr(images, "_pool", pool)
+    assert asyncio.run(generate_derivatives(b"x"))["variants"] == []
+    assert pool.shutdowns == 1 and images._pool is None
+
+
+def test_generates_in_a_worker_process(monkeypatch):
+    pytest.importorskip("PIL")
+    monkeypatch.setattr(images, "_pool", None)
+    try:
+        out = asyncio.run(generate_derivatives(_png(400, 300)))
+    finally:
+        images.shutdown_pool()
+    assert (out["width"], out["height"]) == (400, 300) and out["variants"]
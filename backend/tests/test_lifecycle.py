@@ -0,0 +1,59 @@
+import asyncio
+
+import pytest
+
+from app.lifecycle import ShuttingDownError, TaskRegistry
+
+
+def test_drains_follow_up_tasks_spawned_during_shutdown():
+    registry = TaskRegistry()
+    persisted = []
+
+    async def persist():
+        await asyncio.sleep(0.05)
+        persisted.append("grounding")
+
+    async def stream():
+        await asyncio.sleep(0.05)
+        # finishing a stream schedules more background work, like the chat endpoint does
+        registry.spawn(persist(), "persist_grounding")
+
+    async def main():
+        registry.spawn(stream(), "stream")
+        return await registry.shutdown(timeout=2, flush_timeout=1)
+
+    summary = asyncio.run(main())
+    assert persisted == ["grounding"]
+    assert summary["tracked"] == {"stream": 1, "persist_grounding": 1}
+    assert summary["drained"] == summary["tracked"] and summary["interrupted"] == {}
+    assert registry.finished == {"stream": 1, "persist_grounding": 1}
+
+
+def test_cancels_what_is_left_after_the_window_and_lets_it_flush():
+    registry = TaskRegistry()
+    flushed = []
+
+    async def stuck():
+        try:
+            await asyncio.sleep(60)
+        except asyncio.CancelledError:
+            flushed.append("interrupted")
+            raise
+
+    async def main():
+        registry.spawn(stuck(), "stream")
+        registry.spawn(asyncio.sleep(0), "index")
+        return await registry.shutdown(timeout=0.1, flush_timeout=1)
+
+    summary = asyncio.run(main())
+    assert flushed == ["interrupted"]
+    assert summary["interrupted"] == {"stream": 1} and summary["drained"] == {"index": 1}
+    assert summary["unflushed"] == 0 and summary["seconds"] < 1
+
+
+def test_stops_accepting_work():
+    registry = TaskRegistry()
+    registry.check_accepting()
+    asyncio.run(registry.shutdown(timeout=0))
+    with pytest.raises(ShuttingDownError):
+        registry.check_accepting()
@@ -0,0 +1,69 @@
+import asyncio
+import json
+import logging
+import queue
+
+from app import logs
+from app.logs import JsonFormatter, _parse_rates, _QueueHandler, bind, bound, current, reset
+
+
+def _record(msg, level=logging.INFO, args=None, **fields):
+    record = logging.LogRecord("root", level, __file__, 1, msg, args, None)
+    record.fields = fields
+    return record
+
+
+def test_parse_rates_skips_malformed_entries():
+    assert _parse_rates("model_route=0.1, request = 0.5,bad,x=y,") == {"model_route": 0.1, "request": 0.5}
+
+
+def test_context_binding_nests_and_reaches_spawned_tasks():
+    with bound(request_id="r1", uid=None):
+        token = bind(chat_id="c1")
+        assert current() == {"request_id": "r1", "chat_id": "c1"}
+        reset(token)
+
+        async def spawned():
+            return current()
+
+        assert asyncio.run(spawned()) == {"request_id": "r1"}
+    assert current() == {}
+
+
+def test_handler_captures_context_and_message_when_logged():
+    q = queue.Queue()
+    handler = _QueueHandler(q, {})
+    args = ["first"]
+    with bound(request_id="r1"):
+        handler.emit(_record("value is %s", args=(args,)))
+    args.append("mutated later")
+    record = q.get_nowait()
+    assert record.msg == "value is ['first']" and record.args is None
+    assert record.ctx == {"request_id": "r1"}
+
+
+def test_sampling_keeps_warnings_and_flagged_records(monkeypatch):
+    q = queue.Queue()
+    handler = _QueueHandler(q, {"model_route": 0.0, "request": 1.0})
+    monkeypatch.setattr(logs.random, "random", lambda: 0.5)
+    for record in (_record("model_route"), _record("model_route", always=True), _record("model_route", logging.WARNING),
+                   _record("request"), _record("other")):
+        handler.emit(record)
+    assert q.qsize() == 4 and handler.sampled_out == 1
+
+
+def test_full_queue_drops_instead_of_blocking():
+    q = queue.Queue(maxsize=1)
+    handler = _QueueHandler(q, {})
+    for _ in range(3):
+        handler.emit(_record("event"))
+    assert q.qsize() == 1 and handler.dropped == 2
+
+
+def test_json_formatter_merges_context_and_fields():
+    record = _record("chat_done", tokens=12, model=None, always=True)
+    record.ctx = {"request_id": "r1", "uid": "u1"}
+    out = json.loads(JsonFormatter().format(record))
+    assert {k: out[k] for k in ("level", "logger", "event", "request_id", "uid", "tokens")} == {
+        "level": "INFO", "logger": "root", "event": "chat_done", "request_id": "r1", "uid": "u1", "tokens": 12}
+    assert "model" not in out and "always" not in out and out["ts"].endswith("+00:00")
@@ -0,0 +1,78 @@
+import pytest
+
+from services.rerank import (CHARS_PER_TOKEN, GROUNDING_CONTEXT_HEADER, bm25_scores, build_grounding_context, canonical_url,
+                             domain_of, rerank, tokenize)
+
+
+def test_tokenize_lowercases_and_drops_stopwords():
+    assert tokenize("What is the Grid-Battery capacity in 2024?") == ["grid", "battery", "capacity", "2024"]
+    assert tokenize(None) == []
+
+
+@pytest.mark.parametrize("url,expected", [
+    ("https://www.Example.com/a/b/?utm_source=x&id=2&fbclid=y#top", "example.com/a/b?id=2"),
+    ("http://example.com/a/b", "example.com/a/b"),
+    ("https://example.com/?b=2&a=1", "example.com?a=1&b=2"),
+])
+def test_canonical_url(url, expected):
+    assert canonical_url(url) == expected
+
+
+def test_domain_of():
+    assert domain_of("https://www.news.example.org/story?id=1") == "news.example.org"
+
+
+def test_bm25_favours_rare_terms_and_shorter_documents():
+    docs = [tokenize("battery battery storage"), tokenize("storage costs"), tokenize("battery storage in a very long document about many other things")]
+    scores = bm25_scores(tokenize("battery storage"), docs)
+    assert scores[0] > scores[2] > scores[1] > 0
+    assert bm25_scores([], docs) == [0.0, 0.0, 0.0]
+    assert bm25_scores(["x"], []) == []
+
+
+def test_bm25_ignores_terms_in_every_document_less_than_rare_ones():
+    docs = [tokenize("solar panel"), tokenize("solar farm"), tokenize("solar roof")]
+    scores = bm25_scores(tokenize("solar farm"), docs)
+    assert scores.index(max(scores)) == 1 and scores[0] == scores[2]
+
+
+def test_rerank_orders_dedupes_and_caps_domains():
+    results = [
+        {"title": "Cooking", "snippet": "pasta", "url": "https://a.com/1"},
+        {"title": "Battery storage", "snippet": "grid battery", "url": "https://a.com/2"},
+        {"title": "Battery storage copy", "snippet": "grid battery", "url": "https://www.a.com/2/?utm_source=feed"},
+        {"title": "Battery news", "snippet": "battery", "url": "https://a.com/3"},
+        {"title": "Battery elsewhere", "snippet": "battery", "url": "https://b.com/1"},
+    ]
+    out = rerank("grid battery", results, max_per_domain=2)
+    assert [r["url"] for r in out] == ["https://a.com/2", "https://a.com/3", "https://b.com/1"]
+    assert [r["index"] for r in out] == [1, 2, 3]
+    assert out[0]["score"] >= out[1]["score"] > 0
+    assert len(rerank("grid battery", results, max_results=1)) == 1
+
+
+def test_rerank_breaks_ties_by_newest_date_then_provider_order():
+    results = [
+        {"title": "x", "url": "https://a.com/old", "published_date": "2023-01-01"},
+        {"title": "x", "url": "https://b.com/undated"},
+        {"title": "x", "url": "https://c.com/new", "published_date": "2024-05-01"},
+        {"title": "x", "url": "https://d.com/undated"},
+    ]
+    assert [r["url"] for r in rerank("unrelated", results)] == ["https://c.com/new", "https://a.com/old", "https://b.com/undated", "https://d.com/undated"]
+
+
+def test_grounding_context_fits_the_budget():
+    results = [{"index": i, "title": f"Result {i}", "snippet": "word " * 100, "published_date": "2024-01-01" if i == 1 else None}
+               for i in range(1, 6)]
+    context = build_grounding_context(results, token_budget=150)
+    lines = context.split("\n")
+    assert lines[0] == GROUNDING_CONTEXT_HEADER
+    assert lines[1].startswith("[1] Result 1 (2024-01-01): word")
+    assert len(context) <= 150 * CHARS_PER_TOKEN
+    # the last result that fits is cut at a word boundary, the rest are left out
+    assert lines[-1].endswith("word…") and len(lines) < 6
+
+
+def test_grounding_context_keeps_short_results_whole():
+    context = build_grounding_context([{"index": 1, "title": "T", "snippet": " short snippet "}])
+    assert context == f"{GROUNDING_CONTEXT_HEADER}\n[1] T: short snippet"
@@ -0,0 +1,141 @@
+import asyncio
+import uuid
+
+import pytest
+
+from services import resilience
+from services.resilience import CLOSED, HALF_OPEN, OPEN, BulkheadFullError, CircuitBreaker, CircuitOpenError, Dependency
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(resilience.time, "time", clock)
+    return clock
+
+
+def _dependency(max_concurrent: int, **kwargs) -> Dependency:
+    # breakers are registered by name process-wide, so each test gets its own
+    return Dependency(f"test-{uuid.uuid4().hex}", max_concurrent=max_concurrent, timeout_seconds=5,
+                      min_timeout_seconds=1, **kwargs)
+
+
+def test_breaker_opens_then_half_opens_then_closes(clock):
+    breaker = CircuitBreaker("t", failure_threshold=3, recovery_seconds=30)
+    for _ in range(2):
+        breaker.record_failure()
+    assert breaker.state == CLOSED and breaker.allow()
+
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    assert not breaker.allow()
+    with pytest.raises(CircuitOpenError) as exc:
+        breaker.check()
+    assert exc.value.retry_after == pytest.approx(30)
+
+    clock.now += 30
+    assert breaker.state == HALF_OPEN
+    assert breaker.allow()
+    # only one trial call while half-open
+    assert not breaker.allow()
+
+    breaker.record_success()
+    assert breaker.state == CLOSED
+    assert breaker.allow() and breaker.allow()
+    assert breaker.snapshot()["consecutive_failures"] == 0
+
+
+def test_failed_trial_reopens_breaker(clock):
+    breaker = CircuitBreaker("t", failure_threshold=1, recovery_seconds=10)
+    breaker.record_failure()
+    clock.now += 10
+    assert breaker.allow()
+
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    assert not breaker.allow()
+    clock.now += 10
+    assert breaker.state == HALF_OPEN
+
+
+def test_released_trial_lets_the_next_call_try(clock):
+    breaker = CircuitBreaker("t", failure_threshold=1, recovery_seconds=10)
+    breaker.record_failure()
+    clock.now += 10
+    assert breaker.allow()
+    breaker.release_trial()
+    assert breaker.state == HALF_OPEN
+    assert breaker.allow()
+
+
+def test_bulkhead_rejects_beyond_max_concurrent():
+    dep = _dependency(2)
+
+    async def main():
+        entered = asyncio.Event()
+        release = asyncio.Event()
+
+        async def hold():
+            async with dep.slot():
+                entered.set()
+                await release.wait()
+
+        holders = [asyncio.create_task(hold()) for _ in range(2)]
+        await entered.wait()
+        await asyncio.sleep(0)
+        with pytest.raises(BulkheadFullError):
+            async with dep.slot():
+                pass
+        assert dep.snapshot()["in_flight"] == 2
+        release.set()
+        await asyncio.gather(*holders)
+
+    asyncio.run(main())
+    # rejections are load, not failures: the breaker stays closed and the slots are free again
+    assert dep.breaker.state == CLOSED
+    assert dep.breaker.total_failures == 0
+    assert dep.snapshot()["in_flight"] == 0
+    with dep.slot_sync():
+        pass
+
+
+def test_open_breaker_rejects_without_taking_a_slot(clock):
+    dep = _dependency(1, failure_threshold=1, recovery_seconds=30)
+    with pytest.raises(RuntimeError):
+        with dep.slot_sync():
+            raise RuntimeError("upstream down")
+    assert dep.breaker.state == OPEN
+    with pytest.raises(CircuitOpenError):
+        with dep.slot_sync():
+            pass
+    assert dep.snapshot()["in_flight"] == 0
+
+
+def test_cancelled_call_is_neither_success_nor_failure(clock):
+    dep = _dependency(1, failure_threshold=1, recovery_seconds=5)
+    dep.record(False)
+    clock.now += 5
+
+    async def main():
+        async def trial():
+            async with dep.slot():
+                await asyncio.sleep(10)
+
+        task = asyncio.create_task(trial())
+        await asyncio.sleep(0)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(main())
+    assert dep.breaker.total_failures == 1
+    assert dep.breaker.state == HALF_OPEN
+    assert dep.breaker.allow()
@@ -0,0 +1,99 @@
+import asyncio
+
+from app import response_cache
+from app.response_cache import CACHEABLE_ROUTES, ResponseCache, cache_key, normalize_prompt, replay
+
+
+def _letters(text):
+    vector = [0.0] * 26
+    for c in text:
+        if "a" <= c <= "z":
+            vector[ord(c) - 97] += 1
+    return vector
+
+
+def test_normalize_prompt_and_key():
+    assert normalize_prompt("  What IS   AI?? ") == "what is ai"
+    assert normalize_prompt("ｗｈａｔ is AI.") == "what is ai"
+    assert cache_key("m", "What is AI?", None) == cache_key("m", "what is ai", "")
+    assert cache_key("m", "What is AI?") != cache_key("other", "What is AI?")
+    assert cache_key("m", "What is AI?", "ctx a") != cache_key("m", "What is AI?", "ctx b")
+
+
+def test_exact_hit_is_scoped_to_model_and_context():
+    cache = ResponseCache(ttl=60, similarity=0)
+
+    async def main():
+        assert (await cache.lookup("m", "What is AI?", "ctx"))["text"] is None
+        cache.store("m", "What is AI?", "ctx", "An answer.")
+        hit = await cache.lookup("m", "what is ai", "ctx")
+        other_model = await cache.lookup("n", "what is ai", "ctx")
+        other_ctx = await cache.lookup("m", "what is ai", "other")
+        return hit, other_model, other_ctx
+
+    hit, other_model, other_ctx = asyncio.run(main())
+    assert hit == {"text": "An answer.", "match": "exact", "vector": None}
+    assert other_model["text"] is None and other_ctx["text"] is None
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 3
+
+
+def test_semantic_hit_above_threshold_only():
+    cache = ResponseCache(ttl=60, similarity=0.95, embedder=_letters)
+
+    async def main():
+        miss = await cache.lookup("m", "what is ai")
+        cache.store("m", "what is ai", None, "An answer.", miss["vector"])
+        near = await cache.lookup("m", "what is ia")
+        far = await cache.lookup("m", "totally different question")
+        other_model = await cache.lookup("n", "what is ia")
+        return miss, near, far, other_model
+
+    miss, near, far, other_model = asyncio.run(main())
+    assert miss["text"] is None and miss["vector"] is not None
+    assert near["text"] == "An answer." and near["match"] == "semantic"
+    assert far["text"] is None and other_model["text"] is None
+
+
+def test_embedding_failure_degrades_to_exact_match():
+    def broken(text):
+        raise RuntimeError("embedding service down")
+
+    cache = ResponseCache(ttl=60, similarity=0.9, embedder=broken)
+    cache.store("m", "what is ai", None, "An answer.")
+    assert asyncio.run(cache.lookup("m", "What is AI?"))["text"] == "An answer."
+    assert asyncio.run(cache.lookup("m", "what is ia")) == {"text": None, "vector": None}
+
+
+def test_expiry_and_size_bounds(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(response_cache.time, "time", lambda: now[0])
+    cache = ResponseCache(ttl=10, max_entries=2, max_chars=10, similarity=0)
+    cache.store("m", "a", None, "12345")
+    cache.store("m", "b", None, "12345")
+    cache.store("m", "c", None, "123")
+    # "a" is evicted to stay within 10 characters; answers larger than the bound are never stored
+    cache.store("m", "d", None, "x" * 11)
+    assert cache.stats()["entries"] == 2 and cache.stats()["chars"] == 8
+    assert asyncio.run(cache.lookup("m", "a"))["text"] is None
+    assert asyncio.run(cache.lookup("m", "b"))["text"] == "12345"
+
+    now[0] += 11
+    assert asyncio.run(cache.lookup("m", "b"))["text"] is None
+    assert cache.stats()["chars"] == 3
+
+
+def test_degraded_routes_are_not_cacheable():
+    assert "requested" in CACHEABLE_ROUTES and "short_prompt" in CACHEABLE_ROUTES
+    for reason in ("slow", "circuit_open", "requested+fallback", "short_prompt+fallback"):
+        assert reason not in CACHEABLE_ROUTES
+
+
+def test_replay_chunks_at_word_boundaries():
+    async def main():
+        return [c async for c in replay("the quick brown fox jumps over the lazy dog", chunk_chars=10, interval_ms=0)]
+
+    chunks = asyncio.run(main())
+    assert "".join(chunks) == "the quick brown fox jumps over the lazy dog"
+    # a chunk may take the space just past the limit so the next one starts on a word
+    assert all(len(c) <= 11 for c in chunks)
+    assert all(c.endswith(" ") for c in chunks[:-1])
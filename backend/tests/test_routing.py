@@ -0,0 +1,120 @@
+import asyncio
+import uuid
+
+import pytest
+
+from app import routing
+from app.routing import ModelRouter
+from services.resilience import CLOSED, HALF_OPEN, OPEN, BulkheadFullError, get_breaker
+
+
+def _models():
+    # model breakers are process-wide and keyed by name, so each test uses fresh model names
+    suffix = uuid.uuid4().hex[:8]
+    return f"primary-{suffix}", f"fallback-{suffix}"
+
+
+def _half_open(model: str):
+    breaker = get_breaker(f"model:{model}", failure_threshold=1, recovery_seconds=0)
+    breaker.record_failure()
+    assert breaker.state == HALF_OPEN
+    return breaker
+
+
+def _stream_fn(behaviour):
+    calls = []
+
+    async def stream(prompt, model, system_context=None):
+        calls.append(model)
+        action = behaviour.get(model, "ok")
+        if action == "fail":
+            raise RuntimeError(f"{model} down")
+        if action == "bulkhead":
+            raise BulkheadFullError("gemini", 1)
+        if action == "hang":
+            await asyncio.sleep(3600)
+        for token in ("a", "b"):
+            yield token
+
+    return stream, calls
+
+
+async def _consume(router, model, stream_fn, route, prompt="tell me about routing"):
+    return [t async for t in router.stream(prompt, model, None, stream_fn, route)]
+
+
+def test_failure_before_first_token_falls_back():
+    primary, fallback = _models()
+    router = ModelRouter(fallback_model=fallback)
+    stream, calls = _stream_fn({primary: "fail"})
+    route = {}
+    assert asyncio.run(_consume(router, primary, stream, route)) == ["a", "b"]
+    assert calls == [primary, fallback]
+    assert route == {"requested": primary, "model": fallback, "reason": "requested+fallback"}
+    assert router.snapshot()[primary]["error_rate_ewma"] > 0
+
+
+def test_open_breaker_and_short_prompts_route_to_fallback(monkeypatch):
+    primary, fallback = _models()
+    router = ModelRouter(fallback_model=fallback)
+    get_breaker(f"model:{primary}", failure_threshold=1, recovery_seconds=60).record_failure()
+    assert router.choose(primary, "a long enough prompt") == (fallback, "circuit_open")
+
+    other, _ = _models()
+    monkeypatch.setattr(routing, "ROUTING_SHORT_PROMPT_CHARS", 10)
+    assert router.choose(other, "hi") == (fallback, "short_prompt")
+    assert router.choose(other, "a prompt longer than ten characters") == (other, "requested")
+    assert router.choose(fallback, "hi") == (fallback, "requested")
+
+
+def test_successful_trial_closes_model_breaker():
+    primary, fallback = _models()
+    breaker = _half_open(primary)
+    router = ModelRouter(fallback_model=fallback)
+    stream, calls = _stream_fn({})
+    assert asyncio.run(_consume(router, primary, stream, {})) == ["a", "b"]
+    assert calls == [primary]
+    assert breaker.state == CLOSED
+
+
+def test_bulkhead_rejection_hands_back_the_half_open_trial():
+    primary, fallback = _models()
+    breaker = _half_open(primary)
+    router = ModelRouter(fallback_model=fallback)
+    stream, calls = _stream_fn({primary: "bulkhead"})
+    with pytest.raises(BulkheadFullError):
+        asyncio.run(_consume(router, primary, stream, {}))
+    assert calls == [primary]
+    assert breaker.total_failures == 1
+    # the next request gets the trial instead of being routed away for good
+    assert router.choose(primary, "next prompt") == (primary, "requested")
+
+
+def test_cancelled_first_token_wait_hands_back_the_half_open_trial():
+    primary, fallback = _models()
+    breaker = _half_open(primary)
+    router = ModelRouter(fallback_model=fallback)
+    stream, _ = _stream_fn({primary: "hang"})
+
+    async def main():
+        task = asyncio.create_task(_consume(router, primary, stream, {}))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(main())
+    assert breaker.state == HALF_OPEN and breaker.total_failures == 1
+    assert router.choose(primary, "next prompt") == (primary, "requested")
+
+
+def test_failed_trial_reopens_model_breaker():
+    primary, fallback = _models()
+    breaker = get_breaker(f"model:{primary}", failure_threshold=1, recovery_seconds=0.05)
+    breaker.record_failure()
+    asyncio.run(asyncio.sleep(0.06))
+    router = ModelRouter(fallback_model=fallback)
+    stream, calls = _stream_fn({primary: "fail"})
+    assert asyncio.run(_consume(router, primary, stream, {})) == ["a", "b"]
+    assert calls == [primary, fallback]
+    assert breaker.state == OPEN
@@ -0,0 +1,114 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from services import search
+from services.search import _SearchCache, multi_search, plan_queries
+
+LONG_PROMPT = (
+    "Hi there! "
+    "What is the best time to see cherry blossoms in Kyoto and Tokyo? "
+    "How much does a Japan Rail Pass cost for two adults and two children? "
+    "Which ryokan near Hakone offer private onsen baths for families? "
+    "Thanks a lot."
+)
+
+
+@pytest.fixture(autouse=True)
+def _fanout_threshold(monkeypatch):
+    monkeypatch.setattr(search, "SEARCH_FANOUT_MIN_CHARS", 100)
+
+
+def test_short_prompt_is_searched_verbatim():
+    assert plan_queries("  cherry blossom forecast kyoto  ") == ["cherry blossom forecast kyoto"]
+
+
+def test_long_prompt_is_split_into_focused_queries_in_prompt_order(monkeypatch):
+    queries = plan_queries(LONG_PROMPT, max_queries=3)
+    assert queries == [
+        "What is the best time to see cherry blossoms in Kyoto and Tokyo?",
+        "How much does a Japan Rail Pass cost for two adults and two children?",
+        "Which ryokan near Hakone offer private onsen baths for families?",
+    ]
+    assert len(plan_queries(LONG_PROMPT, max_queries=2)) == 2
+    assert plan_queries(LONG_PROMPT, max_queries=1) == [LONG_PROMPT]
+    monkeypatch.setattr(search, "SEARCH_SUBQUERY_MAX_CHARS", 40)
+    assert plan_queries(LONG_PROMPT, max_queries=1) == ["Hi there! What is the best time to see"]
+
+
+def test_near_duplicate_sentences_are_searched_once():
+    prompt = ("Compare battery storage costs in Germany today. " * 3) + ("Explain solar panel efficiency trends in Spain. " * 3)
+    assert plan_queries(prompt) == ["Compare battery storage costs in Germany today.", "Explain solar panel efficiency trends in Spain."]
+
+
+def _fake_web_search(monkeypatch, fail=()):
+    calls = []
+    lock = threading.Lock()
+    state = {"active": 0, "peak": 0}
+
+    def web_search(query, *, recency_days=None):
+        with lock:
+            calls.append(query)
+            state["active"] += 1
+            state["peak"] = max(state["peak"], state["active"])
+        time.sleep(0.02)
+        with lock:
+            state["active"] -= 1
+        if query in fail:
+            raise RuntimeError(f"provider failed for {query}")
+        words = query.lower().rstrip("?").split()
+        return [
+            {"title": query, "snippet": query, "url": f"https://{words[-1]}.example.com/"},
+            # every sub-query finds the same overview page
+            {"title": "Japan travel overview", "snippet": "japan travel", "url": "https://www.guide.org/japan/?utm_source=x"},
+        ]
+
+    monkeypatch.setattr(search, "web_search", web_search)
+    return calls, state
+
+
+def test_multi_search_fans_out_and_merges(monkeypatch):
+    calls, state = _fake_web_search(monkeypatch)
+    results = asyncio.run(multi_search(LONG_PROMPT, max_concurrency=2))
+    assert len(calls) == 3 and state["peak"] <= 2
+    urls = [r["url"] for r in results]
+    assert len(urls) == 4 and sum("guide.org" in u for u in urls) == 1
+    assert [r["index"] for r in results] == [1, 2, 3, 4]
+
+
+def test_multi_search_tolerates_some_failed_subqueries(monkeypatch):
+    queries = plan_queries(LONG_PROMPT)
+    _fake_web_search(monkeypatch, fail=queries[:-1])
+    results = asyncio.run(multi_search(LONG_PROMPT))
+    assert {r["url"] for r in results} == {"https://families.example.com/", "https://www.guide.org/japan/?utm_source=x"}
+
+    _fake_web_search(monkeypatch, fail=queries)
+    with pytest.raises(RuntimeError, match="provider failed"):
+        asyncio.run(multi_search(LONG_PROMPT))
+
+
+def test_short_prompt_makes_a_single_search(monkeypatch):
+    calls, _ = _fake_web_search(monkeypatch)
+    asyncio.run(multi_search("kyoto cherry blossoms"))
+    assert calls == ["kyoto cherry blossoms"]
+
+
+def test_search_cache_normalizes_keys_expires_and_evicts(monkeypatch):
+    cache = _SearchCache(ttl=60, max_entries=2)
+    assert cache.key("  Kyoto   Blossoms ", 7) == ("kyoto blossoms", 7)
+    cache.put(cache.key("a", None), [{"url": "u"}])
+    cache.put(cache.key("b", None), [])
+    hit = cache.get(cache.key("A", None))
+    assert hit == [{"url": "u"}]
+    # callers get copies they can annotate
+    hit[0]["index"] = 9
+    assert cache.get(cache.key("a", None)) == [{"url": "u"}]
+    cache.put(cache.key("c", None), [])
+    assert cache.get(cache.key("b", None)) is None
+
+    now = time.time()
+    monkeypatch.setattr(search.time, "time", lambda: now + 61)
+    assert cache.get(cache.key("a", None)) is None
+    assert cache.stats() == {"entries": 1, "hits": 2, "misses": 2}
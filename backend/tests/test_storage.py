@@ -0,0 +1,114 @@
+import asyncio
+
+import pytest
+from starlette.requests import Request
+
+from app import main
+from app.main import _content_disposition, _parse_range, _renders_inline, _serve_stored
+from services import storage
+from services.storage import LocalStorageBackend, sign_key, verify_signature
+
+
+@pytest.mark.parametrize("header,expected", [
+    (None, None),
+    ("", None),
+    ("items=0-10", None),
+    ("bytes=0-1,4-5", None),
+    ("bytes=0-99", (0, 99)),
+    ("bytes=10-", (10, 99)),
+    ("bytes=90-500", (90, 99)),
+    ("bytes=-10", (90, 99)),
+    ("bytes=-500", (0, 99)),
+])
+def test_parse_range(header, expected):
+    assert _parse_range(header, 100) == expected
+
+
+@pytest.mark.parametrize("header", ["bytes=100-", "bytes=50-10", "bytes=-0", "bytes=x-1", "bytes=-"])
+def test_unsatisfiable_range(header):
+    with pytest.raises(ValueError):
+        _parse_range(header, 100)
+
+
+def test_content_disposition_encodes_any_filename():
+    assert _content_disposition("inline", "report.pdf") == "inline; filename=\"report.pdf\"; filename*=UTF-8''report.pdf"
+    header = _content_disposition("attachment", "文件.pdf")
+    # headers must be Latin-1 encodable; the exact name survives percent-encoded
+    header.encode("latin-1")
+    assert header == "attachment; filename=\"__.pdf\"; filename*=UTF-8''%E6%96%87%E4%BB%B6.pdf"
+    assert _content_disposition("inline", "Résumé.pdf").startswith('inline; filename="Resume.pdf"; ')
+    header = _content_disposition("inline", 'a"b;c\r\n.txt')
+    assert 'filename="a_b_c__.txt"' in header and "\r" not in header and header.count('"') == 2
+
+
+def test_local_backend_roundtrip(tmp_path):
+    backend = LocalStorageBackend(str(tmp_path))
+    data = bytes(range(256)) * 1000
+    meta = backend.put("attachments/u1/a1/file.bin", data, "application/octet-stream")
+    assert meta["storagePath"] == "attachments/u1/a1/file.bin" and meta["size"] == len(data)
+    assert backend.get("attachments/u1/a1/file.bin") == data
+    assert backend.stat("attachments/u1/a1/file.bin") == {"size": len(data), "contentType": "application/octet-stream"}
+    assert b"".join(backend.stream("attachments/u1/a1/file.bin", chunk_size=4096)) == data
+    assert b"".join(backend.stream("attachments/u1/a1/file.bin", 1000, 70999, chunk_size=4096)) == data[1000:71000]
+    assert backend.local_path("attachments/u1/a1/file.bin").startswith(str(tmp_path))
+
+    # keys never become filesystem paths, so ../ cannot escape the root
+    backend.put("../../etc/passwd", b"x", "text/plain")
+    assert all(p.is_relative_to(tmp_path) for p in tmp_path.rglob("*"))
+
+    assert backend.delete("attachments/u1/a1/file.bin")
+    assert not backend.delete("attachments/u1/a1/file.bin")
+    assert backend.stat("attachments/u1/a1/file.bin") is None
+    assert backend.local_path("attachments/u1/a1/file.bin") is None
+
+
+def test_signed_urls(tmp_path, monkeypatch):
+    monkeypatch.setattr(storage, "STORAGE_SIGNING_SECRET", "")
+    backend = LocalStorageBackend(str(tmp_path))
+    with pytest.raises(RuntimeError):
+        backend.signed_url("images/u1/x.png")
+    assert not verify_signature("images/u1/x.png", "9999999999", "sig")
+
+    monkeypatch.setattr(storage, "STORAGE_SIGNING_SECRET", "secret")
+    url = backend.signed_url("images/u1/x.png", expires_in=60)
+    expires = url.split("expires=")[1].split("&")[0]
+    sig = url.split("sig=")[1]
+    assert verify_signature("images/u1/x.png", expires, sig)
+    assert not verify_signature("images/u1/y.png", expires, sig)
+    assert not verify_signature("images/u1/x.png", "1", sign_key("images/u1/x.png", 1))
+    assert not verify_signature("images/u1/x.png", "soon", sig)
+
+
+@pytest.mark.parametrize("ctype,inline", [
+    ("image/png", True), ("image/webp", True), ("application/pdf", True),
+    ("image/svg+xml", False), ("text/html", False), ("text/html; charset=utf-8", False),
+    ("text/plain", False), ("application/octet-stream", False), ("", False),
+])
+def test_only_images_and_pdfs_render_inline(ctype, inline):
+    assert _renders_inline(ctype) is inline
+
+
+def _serve(key, filename=None, range_header=None):
+    headers = [(b"range", range_header.encode())] if range_header else []
+    request = Request({"type": "http", "method": "GET", "path": "/", "headers": headers, "query_string": b""})
+    return asyncio.run(_serve_stored(key, request, filename=filename))
+
+
+def test_uploads_are_never_sniffed_and_html_is_downloaded(tmp_path, monkeypatch):
+    backend = LocalStorageBackend(str(tmp_path))
+    monkeypatch.setattr(main, "get_storage", lambda: backend)
+    backend.put("attachments/u1/a1/page.html", b"<script>alert(1)</script>", "text/html")
+    backend.put("images/u1/x.png", b"\x89PNG....", "image/png")
+
+    html = _serve("attachments/u1/a1/page.html", filename="页面.html")
+    assert html.headers["x-content-type-options"] == "nosniff"
+    assert html.headers["content-disposition"].startswith("attachment; ")
+    ranged = _serve("attachments/u1/a1/page.html", range_header="bytes=0-3")
+    assert ranged.status_code == 206 and ranged.headers["content-disposition"] == "attachment; filename=\"page.html\"; filename*=UTF-8''page.html"
+    assert ranged.headers["x-content-type-options"] == "nosniff"
+
+    image = _serve("images/u1/x.png")
+    assert image.headers["x-content-type-options"] == "nosniff"
+    assert "content-disposition" not in image.headers
+    assert _serve("images/u1/x.png", filename="x.png").headers["content-disposition"].startswith("inline; ")
+    assert _serve("images/u1/x.png", range_header="bytes=50-").status_code == 416
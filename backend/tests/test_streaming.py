@@ -0,0 +1,166 @@
+import asyncio
+import json
+
+import pytest
+
+from app import streaming
+from app.streaming import SSEWriter, StreamAdmission, StreamCapacityError
+
+
+def _token(text):
+    return f"event: token\ndata: {json.dumps({'text': text})}\n\n"
+
+
+def _event(name, payload):
+    return f"event: {name}\ndata: {json.dumps(payload)}\n\n"
+
+
+async def _collect(writer):
+    return [chunk async for chunk in writer.events()]
+
+
+def test_fast_reader_sees_every_token():
+    async def run():
+        writer = SSEWriter()
+        out = []
+
+        async def reader():
+            async for chunk in writer.events():
+                out.append(chunk)
+
+        task = asyncio.create_task(reader())
+        for t in ("a", "b", "c"):
+            writer.push(_token(t))
+            await asyncio.sleep(0)
+        writer.finish()
+        await task
+        return writer, out
+
+    writer, out = asyncio.run(run())
+    assert out == [_token("a"), _token("b"), _token("c")]
+    assert writer.events_in == writer.events_out == 3
+
+
+def test_backlog_merges_consecutive_tokens_only():
+    async def run():
+        writer = SSEWriter()
+        writer.push(_event("meta", {"chat_id": "c1"}))
+        for t in ('He said "hi"', " and", "\nleft"):
+            writer.push(_token(t))
+        writer.push(_event("citations", {"n": 1}))
+        writer.push(_token("!"))
+        writer.push(_token("?"))
+        writer.finish()
+        return writer, await _collect(writer)
+
+    writer, out = asyncio.run(run())
+    assert out == [_event("meta", {"chat_id": "c1"}), _token('He said "hi" and\nleft'), _event("citations", {"n": 1}), _token("!?")]
+    assert (writer.events_in, writer.events_out) == (7, 4)
+    assert writer.backlog_bytes == 0
+
+
+def test_tokens_after_a_drained_queue_start_a_new_event():
+    async def run():
+        writer = SSEWriter()
+        writer.push(_token("a"))
+        events = writer.events()
+        first = await events.__anext__()
+        writer.push(_token("b"))
+        writer.finish()
+        return [first] + [chunk async for chunk in events]
+
+    assert asyncio.run(run()) == [_token("a"), _token("b")]
+
+
+def test_slow_client_is_reported_once(monkeypatch):
+    monkeypatch.setattr(streaming, "SSE_SLOW_CLIENT_BYTES", 100)
+    reports = []
+    monkeypatch.setattr(streaming.metrics, "inc", lambda name, value=1, **labels: reports.append(name))
+    writer = SSEWriter()
+    for _ in range(50):
+        writer.push(_event("progress", {"pad": "x" * 10}))
+    assert reports == ["sse_slow_clients"]
+    assert writer.max_backlog_bytes == writer.backlog_bytes > 100
+
+
+class _Request:
+    def __init__(self):
+        self.gone = False
+
+    async def is_disconnected(self):
+        return self.gone
+
+
+def test_disconnect_stops_the_body_but_not_the_producer():
+    async def run():
+        request = _Request()
+        writer = SSEWriter(request, check_interval_ms=10)
+        produced = []
+
+        async def source():
+            for i in range(20):
+                produced.append(i)
+                yield _token(str(i))
+                await asyncio.sleep(0.005)
+
+        pump = asyncio.create_task(writer.pump(source()))
+        out = []
+        async for chunk in writer.events():
+            out.append(chunk)
+            request.gone = True
+        await pump
+        return writer, out, produced
+
+    writer, out, produced = asyncio.run(run())
+    assert writer.disconnected and len(out) < 20
+    # the generation ran to completion so the answer is still persisted
+    assert produced == list(range(20))
+    assert writer.backlog_bytes == 0
+
+
+def test_admission_rejects_over_the_limit_and_while_draining():
+    admission = StreamAdmission(limit=2, retry_after=7)
+    first, second = admission.acquire(), admission.acquire()
+    with pytest.raises(StreamCapacityError) as exc:
+        admission.acquire()
+    assert exc.value.retry_after == 7 and not exc.value.draining
+
+    first.release()
+    first.release()
+    assert admission.active == 1
+    third = admission.acquire()
+
+    admission.close()
+    second.release()
+    with pytest.raises(StreamCapacityError) as exc:
+        admission.acquire()
+    assert exc.value.draining and "shutting down" in str(exc.value)
+    third.release()
+    assert admission.stats() == {"active": 0, "peak": 2, "limit": 2, "admitted": 3, "rejected": 2, "draining": True}
+
+
+def test_slot_is_held_until_the_stream_ends_however_it_ends():
+    admission = StreamAdmission(limit=1)
+
+    async def source():
+        yield "a"
+        raise RuntimeError("upstream failed")
+
+    async def run():
+        slot = admission.acquire()
+        out = []
+        with pytest.raises(RuntimeError):
+            async for chunk in slot.track(source()):
+                out.append(chunk)
+                assert admission.active == 1
+        return out
+
+    assert asyncio.run(run()) == ["a"]
+    assert admission.active == 0
+
+
+def test_capacity_errors_answer_503_with_retry_after():
+    from app.main import stream_capacity_handler
+    response = asyncio.run(stream_capacity_handler(None, StreamCapacityError(500, 5)))
+    assert response.status_code == 503 and response.headers["Retry-After"] == "5"
+    assert json.loads(response.body)["error"]["code"] == "STREAMS_BUSY"
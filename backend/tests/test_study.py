@@ -0,0 +1,60 @@
+import pytest
+
+from app.study import MAX_FRONT_CHARS, dedupe, parse_cards
+
+
+CARDS = [{"front": "What is ATP?", "back": "The cell's energy currency."}, {"front": "Mitosis", "back": "Cell division."}]
+
+
+def test_plain_array():
+    assert parse_cards('[{"front": "What is ATP?", "back": "The cell\'s energy currency."}, {"front": "Mitosis", "back": "Cell division."}]') == CARDS
+
+
+def test_fenced_with_prose_and_trailing_commas():
+    text = (
+        "Sure! Here are your flashcards:\n```json\n"
+        '[\n  {"front": "What is ATP?", "back": "The cell\'s energy currency.",},\n'
+        '  {"front": "Mitosis", "back": "Cell division."},\n]\n```\nLet me know if you need more.'
+    )
+    assert parse_cards(text) == CARDS
+
+
+def test_wrapped_in_object():
+    text = '{"deck": "biology", "cards": [{"question": "What is ATP?", "answer": "The cell\'s energy currency."}, {"term": "Mitosis", "definition": "Cell division."}]}'
+    assert parse_cards(text) == CARDS
+
+
+def test_single_card_object():
+    assert parse_cards('{"front": "Mitosis", "back": "Cell division."}') == [CARDS[1]]
+
+
+def test_truncated_keeps_complete_cards():
+    text = '[{"front": "What is ATP?", "back": "The cell\'s energy currency."}, {"front": "Mitosis", "back": "Cell division."}, {"front": "Meiosis", "ba'
+    assert parse_cards(text) == CARDS
+
+
+def test_truncated_inside_wrapper():
+    text = '```json\n{"cards": [{"front": "What is ATP?", "back": "The cell\'s energy currency."}, {"front": "Mitosis", "back": "Cell'
+    assert parse_cards(text) == [CARDS[0]]
+
+
+def test_skips_incomplete_items_and_normalizes_fields():
+    text = '[{"front": "  What is\\nATP? ", "back": "The cell\'s   energy currency."}, {"front": "no back"}, "junk", {"front": "x' + "y" * 400 + '", "back": 42}]'
+    cards = parse_cards(text)
+    assert cards[0] == CARDS[0]
+    assert len(cards) == 2
+    assert len(cards[1]["front"]) == MAX_FRONT_CHARS and cards[1]["back"] == "42"
+
+
+@pytest.mark.parametrize("text", ["", "I can't help with that.", "[]", '[{"front": "only"}]', "[{broken"])
+def test_nothing_usable_raises(text):
+    with pytest.raises(ValueError):
+        parse_cards(text)
+
+
+def test_dedupe_across_batches():
+    seen = set()
+    assert dedupe(CARDS, seen) == CARDS
+    assert dedupe([{"front": "  what is atp? ", "back": "other"}, {"front": "Osmosis", "back": "Diffusion of water."}], seen) == [
+        {"front": "Osmosis", "back": "Diffusion of water."}
+    ]
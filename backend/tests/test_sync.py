@@ -0,0 +1,65 @@
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from app import sync
+from app.sync import HistorySync, InvalidCursor, decode_cursor, encode_cursor, fresh_cursor
+
+T0 = datetime(2024, 5, 1, 12, 0, tzinfo=timezone.utc)
+
+
+def test_cursor_round_trip():
+    cursor = encode_cursor(T0, "message:users/u1/chats/c/messages/m")
+    assert "=" not in cursor
+    assert decode_cursor(cursor) == (T0, "message:users/u1/chats/c/messages/m")
+    # other timezones are normalized to UTC
+    local = T0.astimezone(timezone(timedelta(hours=2)))
+    assert decode_cursor(encode_cursor(local)) == (T0, "")
+
+
+@pytest.mark.parametrize("cursor", ["", "not-a-cursor", encode_cursor(T0)[:-4], "eyJrIjoieCJ9"])
+def test_invalid_cursors_are_rejected(cursor):
+    with pytest.raises(InvalidCursor):
+        decode_cursor(cursor)
+
+
+def test_fresh_cursor_allows_for_clock_skew(monkeypatch):
+    monkeypatch.setattr(sync, "SYNC_CLOCK_SKEW_SECONDS", 5)
+    ts, key = decode_cursor(fresh_cursor())
+    assert key == "" and 4 <= time.time() - ts.timestamp() <= 6
+
+
+def _history(fs):
+    fs.document("users/u1/chats/c1").set({"title": "one", "updatedAt": T0 + timedelta(seconds=1)})
+    # a batch write: the chat's messages share one server timestamp
+    for i in range(5):
+        fs.document(f"users/u1/chats/c1/messages/m{i}").set(
+            {"uid": "u1", "chatId": "c1", "content": str(i), "updatedAt": T0 + timedelta(seconds=2)})
+    fs.document("users/u1/tombstones/c0").set({"status": "deleted", "updatedAt": T0 + timedelta(seconds=3)})
+    # someone else's message and a change before the cursor
+    fs.document("users/u2/chats/x/messages/m").set({"uid": "u2", "chatId": "x", "updatedAt": T0 + timedelta(seconds=2)})
+    fs.document("users/u1/chats/old").set({"title": "old", "updatedAt": T0 - timedelta(seconds=1)})
+
+
+def test_changes_page_through_equal_timestamps_exactly_once(fs):
+    _history(fs)
+    history = HistorySync(fs, "u1", page_size=3)
+    cursor = encode_cursor(T0)
+    pages = []
+    while True:
+        page = history.changes(cursor)
+        pages.append(page)
+        cursor = page["cursor"]
+        if not page["has_more"]:
+            break
+
+    assert [p["has_more"] for p in pages] == [True, True, False]
+    assert [c["id"] for p in pages for c in p["chats"]] == ["c1"]
+    messages = [m for p in pages for m in p["messages"]]
+    assert [m["id"] for m in messages] == ["m0", "m1", "m2", "m3", "m4"]
+    assert messages[0] == {"id": "m0", "chat_id": "c1", "content": "0", "updatedAt": T0 + timedelta(seconds=2)}
+    assert [d["chat_id"] for p in pages for d in p["deleted"]] == ["c0"]
+
+    # nothing new: the cursor stays put
+    assert history.changes(cursor) == {"chats": [], "messages": [], "deleted": [], "cursor": cursor, "has_more": False}
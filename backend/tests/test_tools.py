@@ -0,0 +1,202 @@
+import asyncio
+import importlib
+
+import pytest
+
+import app.main as main
+from app.tools import Tool, ToolError, ToolRegistry, tools
+
+
+def _tool(name, handler, *, max_concurrent=2, timeout_seconds=5, cache_seconds=0):
+    return Tool(name, handler, max_concurrent=max_concurrent, timeout_seconds=timeout_seconds,
+                cache_seconds=cache_seconds, dependencies=[], env_keys=[], description="")
+
+
+def _registry(*tools_):
+    registry = ToolRegistry()
+    for tool in tools_:
+        registry._tools[tool.name] = tool
+    return registry
+
+
+def _patch_search(monkeypatch, fn):
+    # the tool imports backend.services.search when the repo root is importable, else services.search
+    for name in ("services.search", "backend.services.search"):
+        try:
+            monkeypatch.setattr(importlib.import_module(name), "multi_search", fn)
+        except ImportError:
+            pass
+
+
+def test_unknown_tool_and_empty_prompt():
+    registry = _registry()
+    with pytest.raises(ToolError) as exc:
+        asyncio.run(registry.invoke("nope", "x", {}, "u1"))
+    assert (exc.value.code, exc.value.status_code) == ("UNKNOWN_TOOL", 404)
+
+    async def echo(prompt, options, uid):
+        yield {"type": "result", "text": prompt}
+
+    registry = _registry(_tool("echo", echo))
+    with pytest.raises(ToolError) as exc:
+        asyncio.run(registry.invoke("echo", "   ", {}, "u1"))
+    assert exc.value.code == "INVALID_INPUT"
+
+
+def test_results_are_cached_by_normalized_prompt():
+    calls = []
+
+    async def echo(prompt, options, uid):
+        calls.append(prompt)
+        yield {"type": "progress"}
+        yield {"type": "result", "text": prompt}
+
+    registry = _registry(_tool("echo", echo, cache_seconds=60))
+
+    async def main_():
+        first = await registry.invoke("echo", "Hello  World", {"a": 1}, "u1")
+        second = await registry.invoke("echo", "hello world", {"a": 1}, "u2")
+        other = await registry.invoke("echo", "hello world", {"a": 2}, "u1")
+        return first, second, other
+
+    first, second, other = asyncio.run(main_())
+    assert first == {"success": True, "tool": "echo", "cached": False, "text": "Hello  World"}
+    assert second["cached"] is True and second["text"] == "Hello  World"
+    assert other["cached"] is False
+    assert len(calls) == 2
+
+
+def test_timeout_and_failure_become_tool_errors():
+    async def slow(prompt, options, uid):
+        await asyncio.sleep(1)
+        yield {"type": "result"}
+
+    async def broken(prompt, options, uid):
+        raise ValueError("bad input")
+        yield
+
+    registry = _registry(_tool("slow", slow, timeout_seconds=0.05), _tool("broken", broken))
+    with pytest.raises(ToolError) as exc:
+        asyncio.run(registry.invoke("slow", "x", {}, "u1"))
+    assert (exc.value.code, exc.value.status_code) == ("TOOL_TIMEOUT", 504)
+    with pytest.raises(ToolError) as exc:
+        asyncio.run(registry.invoke("broken", "x", {}, "u1"))
+    assert (exc.value.code, exc.value.status_code) == ("TOOL_FAILED", 502)
+    assert registry.get("slow").in_flight == 0
+
+
+def test_busy_tool_rejects_after_waiting():
+    release = asyncio.Event()
+
+    async def hold(prompt, options, uid):
+        await release.wait()
+        yield {"type": "result"}
+
+    registry = _registry(_tool("hold", hold, max_concurrent=1, timeout_seconds=0.1))
+
+    async def main_():
+        first = asyncio.create_task(registry.invoke("hold", "a", {}, "u1"))
+        await asyncio.sleep(0)
+        with pytest.raises(ToolError) as exc:
+            await registry.invoke("hold", "b", {}, "u1")
+        release.set()
+        await asyncio.gather(first, return_exceptions=True)
+        return exc.value
+
+    error = asyncio.run(main_())
+    assert (error.code, error.status_code) == ("TOOL_BUSY", 429)
+
+
+def test_search_charges_the_grounding_quota_before_searching(monkeypatch):
+    charged, searched = [], []
+
+    async def fake_search(prompt, recency_days=None):
+        searched.append(prompt)
+        return [{"index": 1, "url": "https://example.com", "title": "T", "snippet": prompt}]
+
+    _patch_search(monkeypatch, fake_search)
+    monkeypatch.setattr(main, "check_and_increment_grounding_quota", lambda uid: charged.append(uid) or len(charged) <= 1)
+    monkeypatch.setattr(tools, "cache", type(tools.cache)(16))
+
+    result = asyncio.run(tools.invoke("search", "first question", {}, "u1"))
+    assert result["success"] and result["results"][0]["snippet"] == "first question"
+
+    with pytest.raises(ToolError) as exc:
+        asyncio.run(tools.invoke("search", "second question", {}, "u1"))
+    assert (exc.value.code, exc.value.status_code) == ("QUOTA_EXCEEDED", 429)
+    assert 0 < exc.value.retry_after <= 3600
+    assert charged == ["u1", "u1"]
+    assert searched == ["first question"]
+
+
+def _batch_client(registry, monkeypatch):
+    import httpx
+    from fastapi import Depends, FastAPI, Request
+
+    from app import tools as tools_module
+
+    def user(request: Request):
+        request.state.user = {"uid": "u1"}
+
+    monkeypatch.setattr(tools_module, "tools", registry)
+    app = FastAPI()
+    app.include_router(tools_module.router, dependencies=[Depends(user)])
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test")
+
+
+def test_batch_streams_one_line_per_item_and_shares_cacheable_duplicates(monkeypatch):
+    import json
+
+    from app.lifecycle import registry as task_registry
+
+    calls = []
+
+    async def echo(prompt, options, uid):
+        calls.append(("echo", prompt))
+        yield {"type": "result", "text": prompt.upper()}
+
+    async def job(prompt, options, uid):
+        calls.append(("job", prompt))
+        if prompt == "fail":
+            raise ToolError("BAD_PROMPT", "cannot do that")
+        yield {"type": "result", "job_id": len(calls)}
+
+    registry = _registry(_tool("echo", echo, cache_seconds=60), _tool("job", job))
+    finished = task_registry.finished["tool_batch"]
+    body = {"requests": [
+        {"tool": "echo", "prompt": "Hi there"}, {"tool": "job", "prompt": "a"}, {"tool": "echo", "prompt": "hi  THERE"},
+        {"tool": "job", "prompt": "a"}, {"tool": "job", "prompt": "fail"}, {"tool": "nope", "prompt": "x"},
+    ]}
+
+    async def run():
+        async with _batch_client(registry, monkeypatch) as client:
+            return await client.post("/tools/invoke/batch", json=body)
+
+    response = asyncio.run(run())
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    done = lines.pop()
+    assert done["done"] is True and (done["total"], done["succeeded"], done["failed"]) == (6, 4, 2)
+    by_index = {line["index"]: line for line in lines}
+    assert sorted(by_index) == [0, 1, 2, 3, 4, 5]
+    # identical cacheable items run once; jobs with side effects run per item
+    assert by_index[0]["text"] == by_index[2]["text"] == "HI THERE"
+    assert sorted(calls) == [("echo", "Hi there"), ("job", "a"), ("job", "a"), ("job", "fail")]
+    assert by_index[1]["job_id"] != by_index[3]["job_id"]
+    assert (by_index[4]["success"], by_index[4]["code"]) == (False, "BAD_PROMPT")
+    assert by_index[5]["code"] == "UNKNOWN_TOOL"
+    # items run as tracked tasks, so a shutdown drains them
+    assert task_registry.finished["tool_batch"] == finished + 5
+
+
+@pytest.mark.parametrize("count,status,code", [(0, 400, "INVALID_INPUT"), (51, 413, "BATCH_TOO_LARGE")])
+def test_batch_size_limits(monkeypatch, count, status, code):
+    from app import tools as tools_module
+    monkeypatch.setattr(tools_module, "TOOL_BATCH_MAX_ITEMS", 50)
+
+    async def run():
+        async with _batch_client(_registry(), monkeypatch) as client:
+            return await client.post("/tools/invoke/batch", json={"requests": [{"tool": "x", "prompt": "p"}] * count})
+
+    response = asyncio.run(run())
+    assert response.status_code == status and response.json()["code"] == code
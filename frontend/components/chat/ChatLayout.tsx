@@ -20,43 +20,41 @@ export default function ChatLayout() {
   const [currentAssistantId, setCurrentAssistantId] = useState<string | null>(null);
   const [inFlightRequest, setInFlightRequest] = useState<string | null>(null);
   const serverChatIdRef = useRef<string | null>(null);
+  // chat whose messages are already in state (from /bootstrap or a sync), so selecting it skips the fetch
+  const loadedChatRef = useRef<string | null>(null);
+  const syncCursorRef = useRef<string | null>(null);
   const controllerRef = useRef<AbortController | null>(null);
 
   useEffect(() => {
-    // initial load: fetch settings and chats
+    // initial load: settings, models, chats and the active chat's recent messages in one request
     (async () => {
       if (!idToken) return;
       const base = process.env.NEXT_PUBLIC_BACKEND_URL || "http://localhost:8000";
       try {
         setError(null);
-        const sres = await fetch(`${base}/settings`, { headers: { Authorization: `Bearer ${idToken}` } });
-        if (!sres.ok) throw new Error("Failed to load settings");
-        const sjson = await sres.json();
-        const lastActive = sjson?.settings?.lastActiveChat;
-        const defModel = sjson?.settings?.defaultModel;
-        setDefaultModel(defModel || null);
-
-        try {
-          const mres = await fetch(`${base}/models`, { headers: { Authorization: `Bearer ${idToken}` } });
-          if (mres.ok) {
-            const mj = await mres.json();
-            setAvailableModels(mj.models || []);
-          }
-        } catch (e) {
-          // ignore
-        }
-
-        const cres = await fetch(`${base}/history/chats`, { headers: { Authorization: `Bearer ${idToken}` } });
-        if (!cres.ok) throw new Error("Failed to load chats");
-        const cjson = await cres.json();
-        const list = cjson?.chats || [];
-        setChats(list);
-        if (lastActive && list.find((c: any) => c.id === lastActive)) {
-          setActiveId(lastActive);
-        } else if (list.length) {
-          setActiveId(list[0].id);
+        const bres = await fetch(`${base}/bootstrap`, { headers: { Authorization: `Bearer ${idToken}` } });
+        if (!bres.ok) throw new Error("Failed to load chats");
+        const bjson = await bres.json();
+        setDefaultModel(bjson?.settings?.defaultModel || null);
+        setAvailableModels(bjson?.models || []);
+        setChats(bjson?.chats || []);
+        syncCursorRef.current = bjson?.sync_cursor || null;
+        const active = bjson?.active_chat;
+        if (active?.chat?.id) {
+          setMessages(active.messages || []);
+          // skip the per-chat fetch below unless only the most recent page was returned
+          if (!active.has_more) loadedChatRef.current = active.chat.id;
+          setActiveId(active.chat.id);
         }
         setSettingsLoaded(true);
+        if (bjson?.chats_has_more) {
+          // rest of the sidebar, off the critical path
+          const cres = await fetch(`${base}/history/chats`, { headers: { Authorization: `Bearer ${idToken}` } });
+          if (cres.ok) {
+            const cjson = await cres.json();
+            setChats(cjson?.chats || []);
+          }
+        }
       } catch (e: any) {
         console.error(e);
         setError(e?.message || "Failed to contact backend");
@@ -74,6 +72,11 @@ export default function ChatLayout() {
         setMessages([]);
         return;
       }
+      if (loadedChatRef.current === activeId) {
+        // already delivered by /bootstrap or applied by refreshHistory
+        loadedChatRef.current = null;
+        return;
+      }
       const base = process.env.NEXT_PUBLIC_BACKEND_URL || "http://localhost:8000";
       try {
         setError(null);
@@ -147,6 +150,68 @@ export default function ChatLayout() {
     }
   }
 
+  async function refreshHistory(chatId: string | null) {
+    // apply only what changed since the last sync; full re-fetch if there is no cursor yet or sync fails
+    if (!idToken) return;
+    const base = process.env.NEXT_PUBLIC_BACKEND_URL || "http://localhost:8000";
+    const headers = { Authorization: `Bearer ${idToken}` };
+    try {
+      if (!syncCursorRef.current) throw new Error("no sync cursor");
+      let cursor: string = syncCursorRef.current;
+      const changedChats: any[] = [];
+      const changedMessages: any[] = [];
+      const deleted = new Set<string>();
+      while (true) {
+        const res = await fetch(`${base}/history/sync?cursor=${encodeURIComponent(cursor)}`, { headers });
+        if (!res.ok) throw new Error("sync failed");
+        const j = await res.json();
+        changedChats.push(...(j.chats || []));
+        changedMessages.push(...(j.messages || []));
+        for (const d of j.deleted || []) deleted.add(d.chat_id);
+        cursor = j.cursor;
+        if (!j.has_more) break;
+      }
+      syncCursorRef.current = cursor;
+      setChats((list) => {
+        const byId = new Map(list.map((c: any) => [c.id, c]));
+        for (const c of changedChats) byId.set(c.id, { ...byId.get(c.id), ...c });
+        for (const id of deleted) byId.delete(id);
+        return Array.from(byId.values()).sort((a: any, b: any) => String(b.updatedAt || "").localeCompare(String(a.updatedAt || "")));
+      });
+      if (chatId) {
+        const incoming = changedMessages.filter((m) => m.chat_id === chatId);
+        if (incoming.length) {
+          setMessages((msgs) => {
+            const copy = [...msgs];
+            for (const m of incoming) {
+              const idx = copy.findIndex((x) => x.id === m.id);
+              if (idx === -1) copy.push(m);
+              else copy[idx] = { ...copy[idx], ...m };
+            }
+            return copy;
+          });
+        }
+      }
+    } catch (e) {
+      const cres = await fetch(`${base}/history/chats`, { headers });
+      const cjson = await cres.json();
+      setChats(cjson.chats || []);
+      if (chatId) {
+        const res = await fetch(`${base}/history/chats/${chatId}`, { headers });
+        const json = await res.json();
+        setMessages(json.messages || []);
+      }
+    }
+  }
+
+  function showRefreshedChat(id: string) {
+    // refreshHistory(id) has just applied this chat's messages; switching to it must not re-fetch them
+    setActiveId((current) => {
+      if (current !== id) loadedChatRef.current = id;
+      return id;
+    });
+  }
+
   function selectChat(id: string) {
     setActiveId(id);
     // persist active chat to server settings
@@ -190,16 +255,10 @@ export default function ChatLayout() {
         const j = await res.json();
         if (j.ok) {
           // refresh chat list and messages to show generating message
-          const base = process.env.NEXT_PUBLIC_BACKEND_URL || "http://localhost:8000";
-          const cres = await fetch(`${base}/history/chats`, { headers: { Authorization: `Bearer ${idToken}` } });
-          const cjson = await cres.json();
-          setChats(cjson.chats || []);
-          setActiveId(j.chat_id);
+          await refreshHistory(j.chat_id);
+          showRefreshedChat(j.chat_id);
           serverChatIdRef.current = j.chat_id;
           setCurrentAssistantId(j.message_id);
-          const chatRes = await fetch(`${base}/history/chats/${j.chat_id}`, { headers: { Authorization: `Bearer ${idToken}` } });
-          const chatJson = await chatRes.json();
-          setMessages(chatJson.messages || []);
         }
       } catch (e) {
         console.error(e);
@@ -221,16 +280,10 @@ export default function ChatLayout() {
         });
         const j = await res.json();
         if (j.ok) {
-          const base = process.env.NEXT_PUBLIC_BACKEND_URL || "http://localhost:8000";
-          const cres = await fetch(`${base}/history/chats`, { headers: { Authorization: `Bearer ${idToken}` } });
-          const cjson = await cres.json();
-          setChats(cjson.chats || []);
-          setActiveId(j.chat_id);
+          await refreshHistory(j.chat_id);
+          showRefreshedChat(j.chat_id);
           serverChatIdRef.current = j.chat_id;
           setCurrentAssistantId(j.message_id);
-          const chatRes = await fetch(`${base}/history/chats/${j.chat_id}`, { headers: { Authorization: `Bearer ${idToken}` } });
-          const chatJson = await chatRes.json();
-          setMessages(chatJson.messages || []);
         }
       } catch (e) {
         console.error(e);
@@ -320,19 +373,11 @@ export default function ChatLayout() {
             if (event === "meta") {
               // server created/assigned chat and assistant message
               if (payload.chat_id) {
-                const base = process.env.NEXT_PUBLIC_BACKEND_URL || "http://localhost:8000";
                 try {
-                  // refresh chat list
-                  const cres = await fetch(`${base}/history/chats`, { headers: { Authorization: `Bearer ${idToken}` } });
-                  const cjson = await cres.json();
-                  setChats(cjson.chats || []);
-
-                  // immediately fetch authoritative messages for the chat so we can attach tokens
-                  const res = await fetch(`${base}/history/chats/${payload.chat_id}`, { headers: { Authorization: `Bearer ${idToken}` } });
-                  const json = await res.json();
-                  setMessages(json.messages || []);
+                  // pull the new chat and the server-created messages so we can attach tokens
+                  await refreshHistory(payload.chat_id);
                   serverChatIdRef.current = payload.chat_id;
-                  setActiveId(payload.chat_id);
+                  showRefreshedChat(payload.chat_id);
                   // set assistant message id to be updated by incoming tokens
                   setCurrentAssistantId(payload.message_id);
                   // clear in-flight marker once server accepted mapping
@@ -368,12 +413,8 @@ export default function ChatLayout() {
               if (dev) console.log("stream completed duration_ms:", performance.now() - startTime);
               // refresh messages from server to ensure persisted state
               (async () => {
-                const base = process.env.NEXT_PUBLIC_BACKEND_URL || "http://localhost:8000";
                 try {
-                  const chatToFetch = serverChatIdRef.current || activeId;
-                  const res = await fetch(`${base}/history/chats/${chatToFetch}`, { headers: { Authorization: `Bearer ${idToken}` } });
-                  const json = await res.json();
-                  setMessages(json.messages || []);
+                  await refreshHistory(serverChatIdRef.current || activeId);
                 } catch (e) {
                   console.error(e);
                 }
@@ -0,0 +1,84 @@
+"""
+Benchmark for attachment-aware prompting (services.documents, app.attachments).
+Requires:
+ - Nothing external; uses a synthetic text document (pypdf is not needed)
+ - ATTACH_BENCH_PAGES (defaults to 300) — pages in the synthetic document
+ - ATTACH_BENCH_REQUESTS (defaults to 200) — simulated chat requests referencing it
+ - ATTACH_BUDGET_MS (defaults to 10) — per-request budget for building the context from cached chunks
+
+Behavior:
+ - Times extraction and chunking once (the upload-time cost) and then the per-request work of
+   scoring cached chunks against a prompt and packing them, with and without the tokens cache
+ - Checks every context stays within ATTACHMENT_CONTEXT_TOKENS and contains the page the prompt asks about
+ - Print concise PASS/FAIL against the budget
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+
+from services.documents import ATTACHMENT_CONTEXT_TOKENS, build_attachment_context, extract_document, select_chunks  # noqa: E402
+from services.rerank import CHARS_PER_TOKEN, tokenize  # noqa: E402
+
+N_PAGES = int(os.getenv("ATTACH_BENCH_PAGES", "300"))
+N_REQUESTS = int(os.getenv("ATTACH_BENCH_REQUESTS", "200"))
+BUDGET_MS = float(os.getenv("ATTACH_BUDGET_MS", "10"))
+
+FILLER = "The committee reviewed the quarterly figures and agreed to revisit the staffing plan next month. "
+
+
+def document() -> bytes:
+    pages = []
+    for i in range(N_PAGES):
+        body = (FILLER * 12) + f"\n\nSection {i} covers topic{i} in detail: topic{i} matters because of reason{i}."
+        pages.append(body)
+    return "\f".join(pages).encode("utf-8")
+
+
+def main():
+    data = document()
+    started = time.perf_counter()
+    extracted = extract_document(data, "text/plain")
+    extract_ms = (time.perf_counter() - started) * 1000
+    chunks = extracted["chunks"]
+
+    started = time.perf_counter()
+    tokens = [tokenize(c["text"]) for c in chunks]
+    tokenize_ms = (time.perf_counter() - started) * 1000
+    doc = {"name": "report.txt", "chunks": chunks, "tokens": tokens}
+
+    budget_chars = ATTACHMENT_CONTEXT_TOKENS * CHARS_PER_TOKEN
+    misses = oversized = 0
+    started = time.perf_counter()
+    for n in range(N_REQUESTS):
+        page = n * 7 % N_PAGES
+        selected = select_chunks(f"Why does topic{page} matter?", [doc])
+        context = build_attachment_context(selected)
+        if not any(c["page"] == page + 1 for c in selected):
+            misses += 1
+        if sum(len(c["text"]) for c in selected) > budget_chars:
+            oversized += 1
+    cached_ms = (time.perf_counter() - started) * 1000 / N_REQUESTS
+    uncached_ms = cached_ms + tokenize_ms
+
+    print(f"pages={extracted['pages']} chars={extracted['chars']} chunks={len(chunks)} requests={N_REQUESTS}")
+    print(f"upload: extract+chunk {extract_ms:.1f}ms, tokenize {tokenize_ms:.1f}ms (once per document)")
+    print(f"per request: cached chunks {cached_ms:.2f}ms, re-tokenizing every time {uncached_ms:.2f}ms; last context {len(context)} chars")
+
+    ok = True
+    if misses:
+        print(f"FAIL: {misses} contexts left out the page the prompt asked about")
+        ok = False
+    if oversized:
+        print(f"FAIL: {oversized} contexts exceeded the {ATTACHMENT_CONTEXT_TOKENS}-token budget")
+        ok = False
+    if cached_ms > BUDGET_MS:
+        print(f"FAIL: {cached_ms:.2f}ms per request over budget {BUDGET_MS:.0f}ms")
+        ok = False
+    print("PASS" if ok else "FAIL")
+    sys.exit(0 if ok else 4)
+
+
+if __name__ == "__main__":
+    main()
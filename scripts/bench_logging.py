@@ -0,0 +1,103 @@
+"""
+Benchmark for the logging pipeline's cost on the request path (app.logs).
+Requires:
+ - Nothing external; logs synthetic requests to a temporary file
+ - LOG_BENCH_REQUESTS (defaults to 20000) — simulated requests
+ - LOG_BUDGET_US (defaults to 60) — per-request budget in microseconds for the event loop side
+
+Behavior:
+ - Each simulated request logs what a chat request logs: the access line plus three events
+ - Times the caller side of the previous synchronous setup (json.dumps + StreamHandler write) and of
+   the queue pipeline (context capture + enqueue), then waits for the listener to drain
+ - Checks every record reached the file as one JSON object with the bound request context
+ - Print concise PASS/FAIL against the budget
+"""
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+
+os.environ.setdefault("LOG_SAMPLE_RATES", "")
+os.environ.setdefault("LOG_QUEUE_SIZE", "1000000")
+
+from app import logs  # noqa: E402
+
+N_REQUESTS = int(os.getenv("LOG_BENCH_REQUESTS", "20000"))
+BUDGET_US = float(os.getenv("LOG_BUDGET_US", "60"))
+EVENTS_PER_REQUEST = 4
+
+
+def legacy(path: str) -> float:
+    root = logging.getLogger()
+    handler = logging.StreamHandler(open(path, "w"))
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    root.addHandler(handler)
+    root.setLevel(logging.INFO)
+    started = time.perf_counter()
+    for i in range(N_REQUESTS):
+        base = {"uid": "u1", "request_id": f"r{i}"}
+        logging.info("start_stream | %s", {**base, "chat_id": "c1", "model": "gemini-2.0-flash"})
+        logging.info("model_route | %s", {"requested": "gemini-2.0-flash", "model": "gemini-2.0-flash", "reason": "requested"})
+        logging.info("stream_done | %s", {**base, "chars": 1200})
+        logging.info(json.dumps({"path": "/chat/stream", "method": "POST", "status_code": 200, "latency": 0.12, **base}))
+    took = time.perf_counter() - started
+    root.removeHandler(handler)
+    handler.close()
+    return took
+
+
+def pipeline(path: str) -> float:
+    sys.stderr = open(path, "w")
+    logs.setup_logging("production")
+    started = time.perf_counter()
+    for i in range(N_REQUESTS):
+        token = logs.bind(request_id=f"r{i}", uid="u1", chat_id="c1")
+        logs.log_event("start_stream", model="gemini-2.0-flash", generation_type="text")
+        logs.log_event("model_route", requested="gemini-2.0-flash", model="gemini-2.0-flash", reason="requested")
+        logs.log_event("stream_done", chars=1200)
+        logs.log_event("request", path="/chat/stream", method="POST", status_code=200, latency_ms=120.0)
+        logs.reset(token)
+    took = time.perf_counter() - started
+    drain_started = time.perf_counter()
+    logs.stop_logging()
+    print(f"listener drained the backlog in {(time.perf_counter() - drain_started) * 1000:.0f}ms")
+    sys.stderr.close()
+    sys.stderr = sys.__stderr__
+    return took
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy_path = os.path.join(tmp, "legacy.log")
+        pipeline_path = os.path.join(tmp, "pipeline.log")
+        legacy_s = legacy(legacy_path)
+        pipeline_s = pipeline(pipeline_path)
+        with open(pipeline_path) as f:
+            lines = [json.loads(line) for line in f if line.strip()]
+
+    legacy_us = legacy_s / N_REQUESTS * 1e6
+    pipeline_us = pipeline_s / N_REQUESTS * 1e6
+    print(f"requests={N_REQUESTS} events/request={EVENTS_PER_REQUEST}")
+    print(f"caller cost per request: sync handler {legacy_us:.1f}us, queue pipeline {pipeline_us:.1f}us (budget {BUDGET_US:.0f}us)")
+
+    ok = True
+    events = [line for line in lines if line.get("event") in ("start_stream", "model_route", "stream_done", "request")]
+    if len(events) != N_REQUESTS * EVENTS_PER_REQUEST:
+        print(f"FAIL: {len(events)} records written, expected {N_REQUESTS * EVENTS_PER_REQUEST}")
+        ok = False
+    if any(line.get("request_id") is None or line.get("uid") != "u1" for line in events):
+        print("FAIL: some records are missing the bound request context")
+        ok = False
+    if pipeline_us > BUDGET_US:
+        print(f"FAIL: caller cost {pipeline_us:.1f}us over budget {BUDGET_US:.0f}us")
+        ok = False
+    print("PASS" if ok else "FAIL")
+    sys.exit(0 if ok else 4)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Benchmark for the grounding rerank stage (BM25 rerank + dedupe + context packing).
+Requires:
+ - Nothing external; runs on synthetic search results
+ - RERANK_BENCH_RESULTS (defaults to 10) — results per set, as returned by the provider
+ - RERANK_BUDGET_US (defaults to 1000) — per result set budget in microseconds
+
+Behavior:
+ - Builds synthetic result sets with duplicate URLs, repeated domains and missing dates
+ - Times rerank() and build_grounding_context() over many iterations
+ - Print concise PASS/FAIL against the budget
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+
+from services.rerank import build_grounding_context, rerank  # noqa: E402
+
+N_RESULTS = int(os.getenv("RERANK_BENCH_RESULTS", "10"))
+ITERATIONS = int(os.getenv("RERANK_BENCH_ITERATIONS", "2000"))
+BUDGET_US = float(os.getenv("RERANK_BUDGET_US", "1000"))
+
+WORDS = ("solar battery storage grid capacity price policy europe china market energy wind forecast "
+         "demand lithium supply chain report growth investment utility regulation record").split()
+
+
+def make_results(rng: random.Random, n: int):
+    out = []
+    for i in range(n):
+        domain = rng.choice(["example.com", "news.example.org", "www.example.com", "blog.example.net", f"site{i}.example"])
+        path = rng.choice(["a", "b", "c", f"p{i}"])
+        out.append({
+            "index": i + 1,
+            "title": " ".join(rng.choice(WORDS) for _ in range(rng.randint(5, 12))),
+            "url": f"https://{domain}/{path}/?utm_source=x" if rng.random() < 0.3 else f"https://{domain}/{path}",
+            "snippet": " ".join(rng.choice(WORDS) for _ in range(rng.randint(30, 60))),
+            "published_date": f"2024-0{rng.randint(1, 9)}-1{rng.randint(0, 9)}" if rng.random() < 0.6 else None,
+            "source": domain,
+        })
+    return out
+
+
+def main():
+    rng = random.Random(42)
+    query = "latest grid battery storage capacity and price trends in europe"
+    sets = [make_results(rng, N_RESULTS) for _ in range(64)]
+
+    # warm up
+    for s in sets:
+        build_grounding_context(rerank(query, s, max_results=5))
+
+    start = time.perf_counter()
+    for i in range(ITERATIONS):
+        ranked = rerank(query, sets[i % len(sets)], max_results=5)
+    rerank_us = (time.perf_counter() - start) / ITERATIONS * 1e6
+
+    start = time.perf_counter()
+    for i in range(ITERATIONS):
+        build_grounding_context(ranked)
+    pack_us = (time.perf_counter() - start) / ITERATIONS * 1e6
+
+    total_us = rerank_us + pack_us
+    print(f"results per set: {N_RESULTS}, iterations: {ITERATIONS}")
+    print(f"rerank:  {rerank_us:8.1f} us/set ({rerank_us / N_RESULTS:.1f} us/result)")
+    print(f"pack:    {pack_us:8.1f} us/set")
+    print(f"total:   {total_us:8.1f} us/set (budget {BUDGET_US:.0f} us)")
+    if total_us > BUDGET_US:
+        print("FAIL: rerank stage over budget")
+        sys.exit(4)
+    print("PASS: rerank stage within budget")
+    sys.exit(0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+"""
+Benchmark for the backpressure-aware SSE writer (app.streaming.SSEWriter).
+Requires:
+ - Nothing external; runs a synthetic token producer against simulated readers
+ - SSE_BENCH_TOKENS (defaults to 2000) — tokens per stream
+ - SSE_BENCH_TOKEN_INTERVAL_MS (defaults to 1) — producer pace
+ - SSE_BENCH_SLOW_READ_MS (defaults to 20) — per-event delay of the slow reader
+
+Behavior:
+ - Streams the same token sequence to a fast reader, a slow reader and a reader that disconnects early
+ - Checks the text each reader reassembles is exactly what was produced (or a prefix, on disconnect)
+ - Checks the producer finishes in about the same time regardless of reader speed
+ - Prints the coalesce ratio (events out / events in) and the max backlog per reader
+ - Print concise PASS/FAIL
+"""
+import asyncio
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+
+from app.streaming import SSEWriter  # noqa: E402
+
+N_TOKENS = int(os.getenv("SSE_BENCH_TOKENS", "2000"))
+TOKEN_INTERVAL = float(os.getenv("SSE_BENCH_TOKEN_INTERVAL_MS", "1")) / 1000.0
+SLOW_READ = float(os.getenv("SSE_BENCH_SLOW_READ_MS", "20")) / 1000.0
+# the producer may take at most this much longer with a slow reader than with a fast one
+PRODUCER_SLACK = 1.5
+
+
+def token_event(text: str) -> str:
+    payload = text.replace("\n", "\\n")
+    return f"event: token\ndata: {{\"text\": \"{payload}\"}}\n\n"
+
+
+async def produce():
+    yield "event: meta\ndata: {\"chat_id\": \"c\", \"message_id\": \"m\"}\n\n"
+    for i in range(N_TOKENS):
+        await asyncio.sleep(TOKEN_INTERVAL)
+        yield token_event(f"t{i} ")
+    yield "event: done\ndata: {}\n\n"
+
+
+def expected_text() -> str:
+    return "".join(f"t{i} " for i in range(N_TOKENS))
+
+
+def reassemble(chunks):
+    text, kinds = [], []
+    for chunk in chunks:
+        event, data = chunk.split("\n", 1)
+        kinds.append(event[len("event: "):])
+        if event == "event: token":
+            text.append(json.loads(data[len("data: "):].strip())["text"])
+    return "".join(text), kinds
+
+
+async def run_reader(read_delay: float, stop_after: int = 0):
+    writer = SSEWriter()
+    started = time.perf_counter()
+    producer_done = {}
+
+    async def pump():
+        await writer.pump(produce())
+        producer_done["at"] = time.perf_counter() - started
+
+    task = asyncio.create_task(pump())
+    chunks = []
+    body = writer.events()
+    async for chunk in body:
+        chunks.append(chunk)
+        if stop_after and len(chunks) >= stop_after:
+            # what the server does when it finds the client gone
+            await body.aclose()
+            break
+        if read_delay:
+            await asyncio.sleep(read_delay)
+    await task
+    return writer, chunks, producer_done["at"]
+
+
+async def main_async() -> bool:
+    ok = True
+    want = expected_text()
+    results = {}
+    for name, delay, stop in (("fast", 0.0, 0), ("slow", SLOW_READ, 0), ("disconnect", SLOW_READ, 5)):
+        writer, chunks, producer_s = await run_reader(delay, stop)
+        text, kinds = reassemble(chunks)
+        results[name] = producer_s
+        ratio = writer.events_out / writer.events_in if writer.events_in else 0
+        print(f"{name:>10}: events in={writer.events_in} out={writer.events_out} ratio={ratio:.3f} "
+              f"max_backlog={writer.max_backlog_bytes}B producer={producer_s * 1000:.0f}ms")
+        if stop:
+            if not want.startswith(text) or not writer.disconnected:
+                print(f"FAIL: {name} reader did not get a clean prefix / was not marked disconnected")
+                ok = False
+        elif text != want or kinds[0] != "meta" or kinds[-1] != "done":
+            print(f"FAIL: {name} reader reassembled a different stream ({len(text)} vs {len(want)} chars)")
+            ok = False
+    for name in ("slow", "disconnect"):
+        if results[name] > results["fast"] * PRODUCER_SLACK:
+            print(f"FAIL: producer slowed down by the {name} reader ({results[name]:.2f}s vs {results['fast']:.2f}s)")
+            ok = False
+    return ok
+
+
+def main():
+    ok = asyncio.run(main_async())
+    print("PASS" if ok else "FAIL")
+    sys.exit(0 if ok else 4)
+
+
+if __name__ == "__main__":
+    main()
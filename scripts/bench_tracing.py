@@ -0,0 +1,129 @@
+"""
+Benchmark for tracing overhead per request (services.tracing).
+Requires:
+ - Nothing external; exports to a temporary OTLP/JSON file
+ - TRACE_BENCH_REQUESTS (defaults to 20000) — simulated requests
+ - TRACE_BENCH_CALLS (defaults to 25) — instrumented Firestore-like calls per request (every fifth inside a stage span)
+ - TRACE_BUDGET_US (defaults to 40) — budget for the added cost per request at the default sample rate
+
+Behavior:
+ - Times a request-shaped workload (root span, nested stage spans, instrumented Firestore-like calls)
+   untraced, with tracing enabled at TRACE_SAMPLE_RATE (default 5%), and with every request sampled
+ - Checks the exported file holds the expected span trees with parent links intact
+ - Print concise PASS/FAIL against the budget
+"""
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+
+_tmp = tempfile.mkdtemp()
+os.environ.setdefault("TRACE_EXPORTER", "file")
+os.environ["TRACE_FILE"] = os.path.join(_tmp, "traces.jsonl")
+os.environ.setdefault("TRACE_QUEUE_SIZE", "1000000")
+
+from services import tracing  # noqa: E402
+
+N_REQUESTS = int(os.getenv("TRACE_BENCH_REQUESTS", "20000"))
+N_CALLS = int(os.getenv("TRACE_BENCH_CALLS", "25"))
+# root + pipeline + one per call + one stage span per fifth call
+SPANS_PER_REQUEST = 2 + N_CALLS + len(range(0, N_CALLS, 5))
+BUDGET_US = float(os.getenv("TRACE_BUDGET_US", "40"))
+
+
+class FakeDocument:
+    path = "users/u1/chats/c1/messages/m1"
+
+    def get(self):
+        return None
+
+    def update(self, data):
+        return None
+
+
+tracing.instrument(FakeDocument, ("get", "update"), "firestore")
+
+
+def request(doc: FakeDocument):
+    root = tracing.start_trace("POST /chat/stream")
+    with tracing.use_span(root):
+        with tracing.span("chat.pipeline", model="gemini-2.0-flash"):
+            for i in range(N_CALLS):
+                if i % 5 == 0:
+                    with tracing.span("chat.flush", chars=120):
+                        doc.update({"content": "x"})
+                else:
+                    doc.get()
+    root.end()
+
+
+def timed(rate: float) -> float:
+    tracing.TRACE_SAMPLE_RATE = rate
+    doc = FakeDocument()
+    started = time.perf_counter()
+    for _ in range(N_REQUESTS):
+        request(doc)
+    return (time.perf_counter() - started) / N_REQUESTS * 1e6
+
+
+def baseline() -> float:
+    class Plain:
+        def get(self):
+            return None
+
+        def update(self, data):
+            return None
+
+    doc = Plain()
+    started = time.perf_counter()
+    for _ in range(N_REQUESTS):
+        for i in range(N_CALLS):
+            if i % 5 == 0:
+                doc.update({"content": "x"})
+            else:
+                doc.get()
+    return (time.perf_counter() - started) / N_REQUESTS * 1e6
+
+
+def main():
+    default_rate = float(os.getenv("TRACE_SAMPLE_RATE", "0.05"))
+    base_us = baseline()
+    sampled_default_us = timed(default_rate)
+    tracing.flush()
+    sampled_all_us = timed(1.0)
+    tracing.flush()
+
+    spans = []
+    with open(os.environ["TRACE_FILE"]) as f:
+        for line in f:
+            for rs in json.loads(line)["resourceSpans"]:
+                for scope in rs["scopeSpans"]:
+                    spans.extend(scope["spans"])
+    ids = {s["spanId"] for s in spans}
+    orphans = [s for s in spans if s.get("parentSpanId") and s["parentSpanId"] not in ids]
+    stats = tracing.stats()
+
+    added_us = sampled_default_us - base_us
+    print(f"requests={N_REQUESTS} spans/request={SPANS_PER_REQUEST}")
+    print(f"per request: untraced {base_us:.1f}us, rate {default_rate:g} {sampled_default_us:.1f}us (+{added_us:.1f}us), all sampled {sampled_all_us:.1f}us")
+    print(f"exported spans={len(spans)} traces={stats['traces_sampled']} dropped={stats['spans_dropped']}")
+
+    ok = True
+    if len(spans) != stats["traces_sampled"] * SPANS_PER_REQUEST:
+        print(f"FAIL: expected {stats['traces_sampled'] * SPANS_PER_REQUEST} spans, exported {len(spans)}")
+        ok = False
+    if orphans:
+        print(f"FAIL: {len(orphans)} spans reference a parent that was not exported")
+        ok = False
+    if added_us > BUDGET_US:
+        print(f"FAIL: tracing adds {added_us:.1f}us per request, over budget {BUDGET_US:.0f}us")
+        ok = False
+    print("PASS" if ok else "FAIL")
+    sys.exit(0 if ok else 4)
+
+
+if __name__ == "__main__":
+    main()
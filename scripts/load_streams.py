@@ -0,0 +1,179 @@
+"""
+Load test: how many long-lived SSE streams one worker holds, and how admission control behaves.
+Requires:
+ - Nothing external; serves a synthetic stream endpoint built from app.streaming (SSEWriter +
+   StreamAdmission) in one uvicorn worker process and drives it with raw asyncio sockets
+ - LOAD_STREAMS (defaults to 2000) — concurrent connections to open
+ - LOAD_STREAM_LIMIT (defaults to 1500) — STREAM_MAX_CONCURRENT for the worker
+ - LOAD_STREAM_SECONDS (defaults to 20) — how long each synthetic generation runs
+ - LOAD_TOKEN_INTERVAL_MS (defaults to 250) — token pace of each stream
+ - LOAD_TTFB_BUDGET_MS (defaults to 1500) — p99 time to first event, measured across the connection burst
+
+Behavior:
+ - Opens LOAD_STREAMS connections at once; up to the limit are streamed, the rest must get 503 + Retry-After
+ - Reports worker RSS per held stream, time to first event (p50/p99) and whether every admitted
+   stream completed with its full token count
+ - Print concise PASS/FAIL
+"""
+import asyncio
+import json
+import multiprocessing
+import os
+import socket
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+
+N_STREAMS = int(os.getenv("LOAD_STREAMS", "2000"))
+LIMIT = int(os.getenv("LOAD_STREAM_LIMIT", "1500"))
+STREAM_SECONDS = float(os.getenv("LOAD_STREAM_SECONDS", "20"))
+TOKEN_INTERVAL = float(os.getenv("LOAD_TOKEN_INTERVAL_MS", "250")) / 1000.0
+TTFB_BUDGET_MS = float(os.getenv("LOAD_TTFB_BUDGET_MS", "1500"))
+N_TOKENS = max(1, int(STREAM_SECONDS / TOKEN_INTERVAL))
+
+
+def serve(port: int):
+    os.environ["STREAM_MAX_CONCURRENT"] = str(LIMIT)
+    import uvicorn
+    from fastapi import FastAPI, Request
+    from fastapi.responses import JSONResponse, StreamingResponse
+    from app.streaming import SSEWriter, StreamCapacityError, stream_admission
+
+    app = FastAPI()
+    tasks = set()
+
+    @app.exception_handler(StreamCapacityError)
+    async def capacity(request: Request, exc: StreamCapacityError):
+        return JSONResponse(status_code=503, content={"error": str(exc)}, headers={"Retry-After": str(exc.retry_after)})
+
+    async def generation():
+        yield "event: meta\ndata: {}\n\n"
+        for i in range(N_TOKENS):
+            await asyncio.sleep(TOKEN_INTERVAL)
+            yield f"event: token\ndata: {{\"text\": \"t{i} \"}}\n\n"
+        yield "event: done\ndata: {}\n\n"
+
+    @app.get("/stream")
+    async def stream(request: Request):
+        slot = stream_admission.acquire()
+        writer = SSEWriter(request)
+        task = asyncio.create_task(writer.pump(slot.track(generation())))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+        return StreamingResponse(writer.events(), media_type="text/event-stream")
+
+    @app.get("/stats")
+    async def stats():
+        return stream_admission.stats()
+
+    uvicorn.run(app, host="127.0.0.1", port=port, log_level="warning", backlog=4096)
+
+
+def rss_kb(pid: int) -> int:
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+    return 0
+
+
+async def open_stream(port: int, results: list, started: float):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(b"GET /stream HTTP/1.1\r\nHost: x\r\nConnection: close\r\n\r\n")
+    await writer.drain()
+    head = await reader.readuntil(b"\r\n\r\n")
+    status = int(head.split(b" ", 2)[1])
+    if status != 200:
+        results.append({"status": status, "retry_after": b"retry-after:" in head.lower()})
+        writer.close()
+        return
+    first = None
+    tokens = 0
+    done = False
+    buf = b""
+    while True:
+        data = await reader.read(65536)
+        if not data:
+            break
+        if first is None:
+            first = time.perf_counter() - started
+        buf += data
+        tokens += data.count(b"event: token")
+        if b"event: done" in buf[-64:]:
+            done = True
+    writer.close()
+    results.append({"status": 200, "ttfb": first, "tokens": tokens, "done": done})
+
+
+async def fetch_stats(port: int) -> dict:
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(b"GET /stats HTTP/1.1\r\nHost: x\r\nConnection: close\r\n\r\n")
+    body = (await reader.read()).split(b"\r\n\r\n", 1)[1]
+    writer.close()
+    return json.loads(body)
+
+
+async def drive(port: int, pid: int) -> bool:
+    base_rss = rss_kb(pid)
+    results = []
+    started = time.perf_counter()
+    conns = [asyncio.create_task(open_stream(port, results, time.perf_counter())) for _ in range(N_STREAMS)]
+    await asyncio.sleep(min(5.0, STREAM_SECONDS / 2))
+    held_rss = rss_kb(pid)
+    stats = await fetch_stats(port)
+    await asyncio.gather(*conns, return_exceptions=True)
+    elapsed = time.perf_counter() - started
+
+    ok_streams = [r for r in results if r["status"] == 200]
+    rejected = [r for r in results if r["status"] == 503]
+    ttfb = sorted(r["ttfb"] * 1000 for r in ok_streams if r["ttfb"] is not None)
+    complete = [r for r in ok_streams if r["done"] and r["tokens"] >= 1]
+    per_stream_kb = (held_rss - base_rss) / max(1, stats["active"])
+    print(f"streams held per worker: {stats['active']} (limit {LIMIT}, peak {stats['peak']}) in {elapsed:.1f}s")
+    print(f"worker RSS: {base_rss / 1024:.0f}MB idle -> {held_rss / 1024:.0f}MB loaded, ~{per_stream_kb:.0f}KB per stream")
+    if ttfb:
+        p99 = ttfb[min(len(ttfb) - 1, int(len(ttfb) * 0.99))]
+        print(f"time to first event: p50={statistics.median(ttfb):.0f}ms p99={p99:.0f}ms")
+    else:
+        p99 = float("inf")
+    print(f"completed={len(complete)}/{len(ok_streams)} rejected={len(rejected)} (with Retry-After: {sum(r['retry_after'] for r in rejected)})")
+
+    ok = True
+    expected_ok = min(N_STREAMS, LIMIT)
+    if len(ok_streams) != expected_ok or len(complete) != len(ok_streams):
+        print(f"FAIL: expected {expected_ok} complete streams, got {len(complete)} of {len(ok_streams)}")
+        ok = False
+    if len(rejected) != N_STREAMS - expected_ok or not all(r["retry_after"] for r in rejected):
+        print("FAIL: streams over the limit were not all rejected with 503 + Retry-After")
+        ok = False
+    if p99 > TTFB_BUDGET_MS:
+        print(f"FAIL: p99 time to first event {p99:.0f}ms over budget {TTFB_BUDGET_MS:.0f}ms")
+        ok = False
+    return ok
+
+
+def main():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    proc = multiprocessing.Process(target=serve, args=(port,), daemon=True)
+    proc.start()
+    for _ in range(100):
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            break
+        except OSError:
+            time.sleep(0.1)
+    try:
+        ok = asyncio.run(drive(port, proc.pid))
+    finally:
+        proc.terminate()
+        proc.join(5)
+    print("PASS" if ok else "FAIL")
+    sys.exit(0 if ok else 4)
+
+
+if __name__ == "__main__":
+    main()
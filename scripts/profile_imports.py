@@ -0,0 +1,79 @@
+"""
+Import-time profile for the backend app module.
+Requires:
+ - Run from the repository root (the backend directory is located relative to this script)
+ - IMPORT_TIME_BUDGET_MS (defaults to 400) — total budget for `import app.main`
+
+Behavior:
+ - Imports app.main in a fresh interpreter with `-X importtime`
+ - Prints the slowest modules by cumulative import time
+ - Reports any heavy SDK that was imported eagerly (they must load lazily in workers)
+ - Print concise PASS/FAIL against the budget
+"""
+import os
+import subprocess
+import sys
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend")
+BUDGET_MS = float(os.getenv("IMPORT_TIME_BUDGET_MS", "400"))
+TOP_N = int(os.getenv("IMPORT_TIME_TOP_N", "15"))
+
+# SDKs that must not be imported when the app module is loaded
+LAZY_MODULES = ["firebase_admin", "google.generativeai", "google.cloud.firestore", "grpc", "requests"]
+
+
+def parse_importtime(stderr: str):
+    # lines look like: 'import time:  self [us] | cumulative | imported package'
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        parts = line[len("import time:"):].split("|")
+        if len(parts) != 3:
+            continue
+        try:
+            self_us = int(parts[0].strip())
+            cumulative_us = int(parts[1].strip())
+        except ValueError:
+            continue
+        name = parts[2].rstrip()
+        depth = (len(name) - len(name.lstrip())) // 2
+        rows.append({"module": name.strip(), "self_us": self_us, "cumulative_us": cumulative_us, "depth": depth})
+    return rows
+
+
+def main():
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import app.main"],
+        cwd=BACKEND_DIR,
+        capture_output=True,
+        text=True,
+    )
+    if proc.returncode != 0:
+        print("FAIL: importing app.main raised an error")
+        print("\n".join(l for l in proc.stderr.splitlines() if not l.startswith("import time:")))
+        sys.exit(3)
+
+    rows = parse_importtime(proc.stderr)
+    top = [r for r in rows if r["module"] == "app.main"]
+    total_ms = (top[-1]["cumulative_us"] if top else sum(r["self_us"] for r in rows)) / 1000.0
+
+    print(f"Slowest {TOP_N} imports (cumulative):")
+    for r in sorted(rows, key=lambda x: x["cumulative_us"], reverse=True)[:TOP_N]:
+        print(f"  {r['cumulative_us'] / 1000.0:8.1f} ms  {r['self_us'] / 1000.0:8.1f} ms self  {r['module']}")
+
+    imported = {r["module"] for r in rows}
+    eager = [m for m in LAZY_MODULES if m in imported]
+    if eager:
+        print(f"WARN: heavy modules imported eagerly: {eager}")
+
+    print(f"\nTotal import time for app.main: {total_ms:.1f} ms (budget {BUDGET_MS:.0f} ms)")
+    if total_ms > BUDGET_MS or eager:
+        print("FAIL: import-time budget exceeded")
+        sys.exit(4)
+    print("PASS: import-time budget met")
+    sys.exit(0)
+
+
+if __name__ == '__main__':
+    main()